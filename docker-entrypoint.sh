@@ -2,24 +2,33 @@
 
 set -o pipefail
 
+# Reported in the startup log of parse_spacy_pipe.py
+export SPACY_CONTAINER_START="${SPACY_CONTAINER_START:-$(date +%s.%N)}"
+
 # Default values
 model="de_core_news_lg"
 use_dependencies="True"
 use_germalemma="True"
+serve_address=""
+client_url=""
+batch_output_dir=""
 
 usage() {
-    echo "Usage: $0 [-h] [-m MODEL] [-L] [-V] [-d] [-g]"
+    echo "Usage: $0 [-h] [-m MODEL] [-L] [-V] [-d] [-g] [-s ADDRESS] [-C URL] [-b OUTPUT_DIR FILE_OR_GLOB...]"
     echo "  -h            Display this help message"
     echo "  -m MODEL      Specify spaCy model (default: $model)"
     echo "  -L            List available/installed models"
     echo "  -V            Display spaCy version information"
     echo "  -d            Disable dependency parsing (faster processing)"
     echo "  -g            Disable GermaLemma (use spaCy lemmatizer only)"
+    echo "  -s ADDRESS    Run as annotation server on ADDRESS (host:port or unix:/path/to/socket)"
+    echo "  -C URL        Send stdin to a running annotation server (http://host:port or unix:/path)"
+    echo "  -b OUTPUT_DIR Annotate the given files or quoted globs into OUTPUT_DIR with one model load"
     exit 1
 }
 
 # Parse command line options
-while getopts "hm:LVdg" opt; do
+while getopts "hm:LVdgs:C:b:" opt; do
     case $opt in
         h)
             usage
@@ -86,6 +95,15 @@ except ImportError:
         g)
             use_germalemma="False"
             ;;
+        s)
+            serve_address="$OPTARG"
+            ;;
+        C)
+            client_url="$OPTARG"
+            ;;
+        b)
+            batch_output_dir="$OPTARG"
+            ;;
         \?)
             echo "Invalid option: -$OPTARG" >&2
             usage
@@ -97,10 +115,20 @@ except ImportError:
     esac
 done
 
-if [ $OPTIND -le $# ]; then
+shift $((OPTIND - 1))
+batch_inputs=("$@")
+if [ -n "$batch_output_dir" ] && [ ${#batch_inputs[@]} -eq 0 ]; then
+    echo "Option -b needs input files or globs" >&2
+    usage
+elif [ -z "$batch_output_dir" ] && [ ${#batch_inputs[@]} -gt 0 ]; then
     usage
 fi
 
+# Thin client mode: the server holds the model, nothing to install here
+if [ -n "$client_url" ]; then
+    exec python /app/systems/spacy_client.py "$client_url"
+fi
+
 MODEL_DIR="/local/models"
 MODEL_PATH="$MODEL_DIR/$model"
 
@@ -110,8 +138,8 @@ mkdir -p "$MODEL_DIR"
 # Function to check if model is installed and usable
 is_model_installed() {
     local model_name="$1"
-    # Check if model is installed in the venv
-    python -c "import spacy; spacy.load('$model_name')" 2>/dev/null
+    # Check if model is installed in the venv (without importing spaCy or loading the model)
+    python /app/resolve_model.py --model_dir "$MODEL_DIR" "$model_name" >/dev/null 2>&1
     return $?
 }
 
@@ -213,9 +241,19 @@ echo "  Model: $MODEL_TO_USE" >&2
 echo "  Use dependencies: $use_dependencies" >&2
 echo "  Use GermaLemma: $use_germalemma" >&2
 
+mode_args=()
+if [ -n "$serve_address" ]; then
+    echo "  Serving on: $serve_address" >&2
+    mode_args=(--serve "$serve_address")
+elif [ -n "$batch_output_dir" ]; then
+    echo "  Batch mode: ${#batch_inputs[@]} input patterns into $batch_output_dir" >&2
+    mode_args=(--input_files "${batch_inputs[@]}" --output_dir "$batch_output_dir")
+fi
+
 # Run the spaCy tagging pipeline
-python /app/systems/parse_spacy_pipe.py \
+exec python /app/systems/parse_spacy_pipe.py \
     --spacy_model "$MODEL_TO_USE" \
     --corpus_name "stdin" \
     --gld_token_type "CoNLLUP_Token" \
-    --comment_str "#"
+    --comment_str "#" \
+    "${mode_args[@]}"
@@ -1,5 +1,6 @@
 from collections import defaultdict, OrderedDict
-import re
+from itertools import islice
+import os, re
 
 # CoNLL-U Format - https://universaldependencies.org/format.html
 
@@ -18,6 +19,9 @@ def get_token_type(type_str):
 
 
 class TigerNew_Token():
+    __slots__ = ("info", "id", "position", "word", "lemma", "pos_universal", "pos_tag", "detail_tag",
+                 "head", "dep_tag", "blank", "auto_score")
+
     def __init__(self, raw_line, word_ix):
         info = raw_line.split() # [FORM, XPOS]
         self.info = info
@@ -43,6 +47,9 @@ class TigerNew_Token():
 
 
 class RNNTagger_Token():
+    __slots__ = ("info", "id", "position", "word", "lemma", "pos_universal", "pos_tag", "detail_tag",
+                 "head", "dep_tag", "blank", "auto_score")
+
     def __init__(self, raw_line, word_ix):
         info = raw_line.split() # [FORM, XPOS.FEATS, LEMMA]
         self.info = info
@@ -71,25 +78,59 @@ class RNNTagger_Token():
         return separator.join(info)
 
 
+def _column(ix):
+    """ Property reading/writing column ix of a lazily split token line. """
+    def get_field(self):
+        return self.info[ix]
+    def set_field(self, value):
+        self.info[ix] = value
+    return property(get_field, set_field)
+
+
 class CoNLLUP_Token():
+    """
+    Token of a CoNLL-U line. Only FORM is extracted eagerly, since that is all the
+    annotation pipeline reads; the other columns are split from the raw line on first
+    access. With __slots__ and a single string per token, a chunk of sentences needs a
+    fraction of the objects and memory of one attribute per column.
+    """
+    __slots__ = ("_line", "_info", "position", "word")
+
     def __init__(self, raw_line, word_ix):
-        info = raw_line.split()
-        # print(info)
         # [ID, FORM, LEMMA, UPOS, XPOS, FEATS, HEAD, DEPREL, DEPS, MISC]
         # [11, Prügel, Prügel, NN, NN, _, _, _,	_, 1.000000]
-        self.info = info
-        self.id = info[0] # 1-based ID as in the CoNLL file
+        # Without the line ending, which would otherwise end up in the last column split off
+        raw_line = raw_line.rstrip("\r\n")
+        self._line = raw_line
+        self._info = None
         self.position = word_ix # 0-based position in sentence
-        self.word = info[1]
-        self.lemma = info[2]
-        self.pos_universal = info[3]
-        self.pos_tag = self._process_tag(info[4]) # 'XPOS=NE|Case=Nom|Gender=Masc|Number=Sing' TODO: Reuse MorphInfo in the self.detail_tag
-        self.detail_tag = info[5]
-        self.head = info[6]
-        self.dep_tag = info[7]
-        self.blank = info[8] # ???
-        self.auto_score = info[9]
-        
+        # Columns are tab-separated, so FORM may contain spaces (e.g. "New York")
+        self.word = raw_line.split("\t", 2)[1] if "\t" in raw_line else raw_line.split(None, 2)[1]
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = self._line.split("\t") if "\t" in self._line else self._line.split()
+            self._info[1] = self.word
+        return self._info
+
+    id = _column(0) # 1-based ID as in the CoNLL file
+    lemma = _column(2)
+    pos_universal = _column(3)
+    detail_tag = _column(5)
+    head = _column(6)
+    dep_tag = _column(7)
+    blank = _column(8) # ???
+    auto_score = _column(9)
+
+    @property
+    def pos_tag(self):
+        return self._process_tag(self.info[4]) # 'XPOS=NE|Case=Nom|Gender=Masc|Number=Sing' TODO: Reuse MorphInfo in the self.detail_tag
+
+    @pos_tag.setter
+    def pos_tag(self, value):
+        self.info[4] = value
+
     def _process_tag(self, tag):
         if tag == "_" or "|" not in tag: return tag # The XPOS=NE|Case=Nom... is only for Turku!
         info = tag.split("|")
@@ -107,6 +148,9 @@ class CoNLLUP_Token():
 
 
 class CoNLL09_Token():
+    __slots__ = ("info", "id", "position", "word", "lemma", "pos_universal", "pos_tag", "head", "dep_tag",
+                 "detail_tag", "is_pred", "pred_sense", "pred_sense_id", "labels")
+
     def __init__(self, raw_line, word_ix):
         info = raw_line.split()
         # print(info)
@@ -153,6 +197,8 @@ class CoNLL09_Token():
 
 ################################# GETTING SENTENCE ANNOTATIONS ####################################
 class AnnotatedSentence():
+    __slots__ = ("metadata", "tokens")
+
     def __init__(self):
         self.metadata = []
         self.tokens = []
@@ -182,32 +228,179 @@ def get_annotation(raw_lines, raw_meta, token_class):
     return ann
 
 
-def read_conll(line_generator, chunk_size, token_class=CoNLLUP_Token, comment_str="###C:", our_foundry="spacy"):
-    n_sents = 0
-    annotated_sentences, buffer_meta, buffer_lst = [], [], []
-    for i, line in enumerate(line_generator):
+FOUNDRY_RE = re.compile(r'(foundry\s*=\s*).*')
+FILENAME_RE = re.compile(r'(filename\s*=\s* .[^/]*/[^/]+/[^/]+/).*')
+
+
+def rewrite_metadata(line, our_foundry):
+    """ Point the foundry and the filename of a KorAP metadata comment to our_foundry. """
+    if "foundry" in line:
+        line = FOUNDRY_RE.sub(lambda m: m.group(1) + our_foundry, line)
+    if "filename" in line:
+        line = FILENAME_RE.sub(lambda m: m.group(1) + our_foundry + "/morpho.xml", line)
+    return line
+
+
+def read_conll_stream(line_generator, token_class=CoNLLUP_Token, comment_str="###C:", our_foundry="spacy"):
+    """
+    Read sentences lazily: yields one AnnotatedSentence as soon as its closing empty line
+    has been read, so memory use does not depend on the input size.
+    """
+    buffer_meta, buffer_lst = [], []
+    for line in line_generator:
         if line.startswith(comment_str):
-            line = re.sub(r'(foundry\s*=\s*).*', r"\1" + our_foundry, line)
-            line = re.sub(r'(filename\s*=\s* .[^/]*/[^/]+/[^/]+/).*', r"\1" + our_foundry + "/morpho.xml", line)
-            buffer_meta.append(line)
-            continue
-        if len(line.split()) > 0:
+            buffer_meta.append(rewrite_metadata(line, our_foundry))
+        elif line.strip():
             buffer_lst.append(line)
         else:
-            ann = get_annotation(buffer_lst, buffer_meta, token_class)
-            n_sents += 1
-            buffer_lst, buffer_meta = [], []
-            annotated_sentences.append(ann)
-        if chunk_size > 0 and n_sents == chunk_size: break
-    # logger.info("Read {} Sentences!".format(n_sents))
-    return annotated_sentences, n_sents
+            yield get_annotation(buffer_lst, buffer_meta, token_class)
+            buffer_meta, buffer_lst = [], []
+    # Last sentence without a closing empty line
+    if buffer_lst:
+        yield get_annotation(buffer_lst, buffer_meta, token_class)
+
+
+def skip_sentences(line_generator, n_sentences, comment_str="###C:"):
+    """
+    Consume the lines of the first n_sentences sentences as read_conll_stream would read
+    them, without building sentence objects (used to resume a run).
+    
+    Returns:
+        int: Number of sentences skipped (less than n_sentences if the input ended first)
+    """
+    if n_sentences <= 0:
+        return 0
+    skipped, pending = 0, False
+    for line in line_generator:
+        if line.startswith(comment_str):
+            continue
+        elif line.strip():
+            pending = True
+        else:
+            skipped += 1
+            pending = False
+            if skipped == n_sentences:
+                return skipped
+    # Last sentence without a closing empty line
+    return skipped + 1 if pending else skipped
+
+
+# Comment lines that open a new text: KorAP "# text_id = ..." or CoNLL-U "# newdoc id = ..."
+TEXT_START_RE = re.compile(r'^#\s*(text_id|newdoc)\b')
+TEXT_START_BYTES_RE = re.compile(TEXT_START_RE.pattern.encode("ascii"))
+SHARD_UNITS = ["text", "sentence"]
+
+
+def find_shard_boundary(binary_file, offset, comment_str="#", unit="text"):
+    """
+    Find the first sentence block (or, with unit "text", the first block whose metadata
+    opens a new text) that starts after a blank line read at or after offset. The result
+    only depends on offset, so neighbouring shards computed independently on different
+    machines always agree on their common boundary. If no text starts after offset, the
+    first sentence boundary is used, and the end of the file if there is none either.
+    
+    Args:
+        binary_file: Seekable, uncompressed CoNLL-U file opened in binary mode
+        offset: Byte offset to start looking from
+        comment_str: Prefix of comment lines
+        unit: "text" or "sentence"
+        
+    Returns:
+        int: Byte offset of the boundary
+    """
+    comment = comment_str.encode("utf-8")
+    binary_file.seek(offset)
+    # The line the offset falls into, or the line starting at it
+    binary_file.readline()
+    previous_blank, block_start, first_sentence = False, None, None
+    while True:
+        position = binary_file.tell()
+        line = binary_file.readline()
+        if not line:
+            return first_sentence if first_sentence is not None else position
+        if not line.strip():
+            previous_blank, block_start = True, None
+            continue
+        if previous_blank:
+            if unit == "sentence":
+                return position
+            block_start = position
+            if first_sentence is None:
+                first_sentence = position
+        previous_blank = False
+        if block_start is not None and line.startswith(comment):
+            if TEXT_START_BYTES_RE.match(line):
+                return block_start
+        else:
+            # Past the metadata of this sentence
+            block_start = None
+
+
+def shard_range(path, shard, n_shards, comment_str="#", unit="text"):
+    """
+    Byte range of shard number shard (0-based) of n_shards roughly equal parts of a CoNLL-U
+    file, cut only at sentence or text boundaries (see find_shard_boundary). The ranges of
+    all shards cover the file without gaps or overlaps.
+    
+    Returns:
+        tuple: (start, end) byte offsets
+    """
+    if unit not in SHARD_UNITS:
+        raise ValueError(f"Unknown shard unit {unit}, expected one of {', '.join(SHARD_UNITS)}")
+    if not 0 <= shard < n_shards:
+        raise ValueError(f"Shard {shard + 1} out of range 1..{n_shards}")
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        start = 0 if shard == 0 else find_shard_boundary(f, size * shard // n_shards, comment_str, unit)
+        end = size if shard == n_shards - 1 else find_shard_boundary(f, size * (shard + 1) // n_shards, comment_str, unit)
+    return start, end
+
+
+def take_sentences(sentences, max_sentences, max_tokens=0, held_back=None):
+    """
+    Take sentences from an iterator until max_sentences sentences have been taken or the
+    next sentence would exceed max_tokens tokens (0 means no limit for either). A sentence
+    longer than max_tokens forms a chunk of its own.
+    
+    Args:
+        sentences: Iterator of AnnotatedSentence objects
+        max_sentences: Maximum number of sentences per chunk
+        max_tokens: Maximum number of tokens per chunk
+        held_back: List that keeps the sentence that did not fit into the chunk; pass the
+            same list to the next call, whose chunk starts with that sentence (needed with max_tokens)
+    """
+    chunk, n_tokens = [], 0
+    if held_back:
+        chunk.append(held_back.pop())
+        n_tokens = len(chunk[0].tokens)
+    if max_tokens <= 0:
+        return chunk + list(islice(sentences, max_sentences - len(chunk)) if max_sentences > 0 else sentences)
+    if held_back is None:
+        raise ValueError("A token limit needs a held_back list for the sentence that does not fit into the chunk")
+    if n_tokens >= max_tokens or len(chunk) == max_sentences:
+        return chunk
+    for anno in sentences:
+        if chunk and n_tokens + len(anno.tokens) > max_tokens:
+            held_back.append(anno)
+            break
+        chunk.append(anno)
+        n_tokens += len(anno.tokens)
+        if n_tokens >= max_tokens or len(chunk) == max_sentences:
+            break
+    return chunk
+
+
+def read_conll(line_generator, chunk_size, token_class=CoNLLUP_Token, comment_str="###C:", our_foundry="spacy"):
+    sentences = read_conll_stream(line_generator, token_class, comment_str=comment_str, our_foundry=our_foundry)
+    annotated_sentences = take_sentences(sentences, chunk_size)
+    return annotated_sentences, len(annotated_sentences)
 
     
 def read_conll_generator(filepath, token_class=CoNLLUP_Token, sent_sep=None, comment_str="###C:"):
     buffer_meta, buffer_lst = [], []
     sentence_finished = False
     with open(filepath) as f:
-        for i, line in enumerate(f.readlines()):
+        for i, line in enumerate(f):
             if sent_sep and sent_sep in line: sentence_finished = True
             if line.startswith(comment_str):
                 continue
@@ -0,0 +1,179 @@
+import logging, logging.handlers, os, signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing, multiprocessing.util
+import lib.spacy_annotation as sa
+from lib.batch_files import annotate_file
+from my_utils.cpu_utils import worker_cpus, pin_process, format_cpu_list
+from my_utils.profile_utils import ChunkProfiler
+
+logger = logging.getLogger(__name__)
+
+# Per-process state of the worker processes, set up once by _init_worker
+_worker_model = None
+_worker_settings = None
+_worker_profiler = None
+
+
+class WorkerCrashException(Exception):
+    pass
+
+
+def _init_worker(log_queue, pid_queue, model_name, settings, germalemma_options, sentence_cache_options, reuse_columns, cpu_options,
+                 profile_options):
+    """ Load the spaCy pipeline (and GermaLemma and the sentence cache) once per worker process. """
+    global _worker_model, _worker_settings, _worker_profiler
+    # Interrupts are handled by the main process, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pid_queue.put(os.getpid())
+    # Forward log records to the main process, which owns the console and file handlers
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+    if cpu_options.get("affinity") is not None:
+        # Workers take the next CPU set in start order; restarted workers reuse the sets in turn
+        counter = cpu_options["counter"]
+        with counter.get_lock():
+            index = counter.value
+            counter.value += 1
+        cpus = worker_cpus(cpu_options["affinity"], index % cpu_options["n_process"], cpu_options["n_process"])
+        pin_process(cpus)
+        logger.info(f"Worker {multiprocessing.current_process().pid} pinned to CPUs {format_cpu_list(cpus)}")
+    _worker_settings = dict(settings)
+    _worker_model = sa.load_pipeline(model_name, use_dependencies=_worker_settings["use_dependencies"], reuse_columns=reuse_columns)
+    if _worker_settings["use_germalemma"] == "True":
+        if sa.load_germalemma(**germalemma_options):
+            # Merge this worker's lookups into the shared cache file when the worker exits
+            multiprocessing.util.Finalize(None, sa.save_germalemma_cache, args=(germalemma_options.get("cache_file"),), exitpriority=10)
+        else:
+            _worker_settings["use_germalemma"] = "False"
+    if sentence_cache_options.get("cache_size", 0) > 0:
+        sa.load_sentence_cache(_worker_model, _worker_settings["use_germalemma"], _worker_settings["use_dependencies"],
+                               text_doc_tokens=_worker_settings.get("text_doc_tokens", 0), **sentence_cache_options)
+        multiprocessing.util.Finalize(None, sa.save_sentence_cache, args=(sentence_cache_options.get("cache_file"),), exitpriority=10)
+    if profile_options:
+        _worker_profiler = ChunkProfiler(**profile_options)
+
+
+def _annotate_task(task):
+    chunk, offset, annos = task
+    if _worker_profiler is not None:
+        return _worker_profiler.profile(chunk, sa.annotate_batch, _worker_model, annos, offset=offset, **_worker_settings)
+    return sa.annotate_batch(_worker_model, annos, offset=offset, **_worker_settings)
+
+
+def _annotate_file_task(task):
+    input_path, output_path, file_options = task
+    return annotate_file(_worker_model, input_path, output_path, _worker_settings, **file_options)
+
+
+class AnnotationPool():
+    """
+    Pool of worker processes that each load the spaCy pipeline once and annotate
+    batches of sentences. Results are returned in input order.
+    
+    Workers are started with the "spawn" method, so no locks or thread pools of the
+    main process are inherited (which is what makes spaCy's own n_process prone to
+    deadlocks), and the main process does not need to load the model itself.
+    
+    A worker that dies while the pool is in use (e.g. killed by the OOM killer) takes
+    its batch with it, so the pool stops and raises WorkerCrashException instead of
+    waiting forever for the lost result.
+    """
+    def __init__(self, n_process, model_name, settings, germalemma_options=None, max_tasks_per_child=None,
+                 sentence_cache_options=None, reuse_columns=(), affinity=None, profile_options=None):
+        """
+        Args:
+            n_process: Number of worker processes
+            model_name: spaCy model name or path
+            settings: Keyword arguments for annotate_batch (use_germalemma, use_dependencies, ...)
+            germalemma_options: Keyword arguments for load_germalemma (cache_size, cache_file)
+            max_tasks_per_child: Restart workers after this many batches to release memory (None: never)
+            sentence_cache_options: Keyword arguments for load_sentence_cache (cache_size, cache_file);
+                each worker keeps its own cache
+            reuse_columns: Input columns reused as annotations (see load_pipeline)
+            affinity: CPU sets to pin the workers to (see cpu_utils.parse_affinity), or None
+            profile_options: Keyword arguments for a ChunkProfiler in each worker (None: no profiling)
+        """
+        self.n_process = n_process
+        ctx = multiprocessing.get_context("spawn")
+        self._log_queue = ctx.Queue()
+        self._log_listener = logging.handlers.QueueListener(self._log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+        self._log_listener.start()
+        # Workers report their PID when they start, including those restarted after max_tasks_per_child
+        self._pid_queue = ctx.SimpleQueue()
+        self._pids = set()
+        cpu_options = dict(affinity=affinity, counter=ctx.Value("i", 0), n_process=n_process)
+        initargs = (self._log_queue, self._pid_queue, model_name, settings, germalemma_options or {}, sentence_cache_options or {}, reuse_columns, cpu_options,
+                    profile_options)
+        self._pool = ProcessPoolExecutor(n_process, mp_context=ctx, initializer=_init_worker, initargs=initargs,
+                                         max_tasks_per_child=max_tasks_per_child)
+
+    def annotate(self, batches, max_pending=None, offset=0):
+        """
+        Annotate batches of sentences in the worker processes.
+        
+        Batches are pulled from the iterable only when a worker can take them, so a
+        streaming input is never read far ahead of the annotation.
+        
+        Args:
+            batches: Iterable of lists of AnnotatedSentence objects
+            max_pending: Maximum number of batches submitted but not yet returned (default: 2 per worker)
+            offset: Number of sentences before the first batch (for log messages)
+            
+        Yields:
+            tuple: (list of CoNLL-U strings, Counter of statistics) per batch, in input order
+            
+        Raises:
+            WorkerCrashException: A worker process died
+        """
+        max_pending = max_pending or 2 * self.n_process
+        pending = deque()
+        try:
+            for chunk, annos in enumerate(batches, 1):
+                pending.append(self._pool.submit(_annotate_task, (chunk, offset, annos)))
+                offset += len(annos)
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except BrokenProcessPool as e:
+            raise WorkerCrashException("An annotation worker process died (killed by the OOM killer?), so its batch is lost") from e
+
+    def annotate_files(self, files, **file_options):
+        """
+        Annotate whole files in the worker processes. Each idle worker takes the next file,
+        so with files ordered largest first, the load evens out at the end of the run.
+        
+        Args:
+            files: List of (input, output) file pairs
+            file_options: Further keyword arguments for batch_files.annotate_file
+            
+        Yields:
+            dict: Result of annotate_file per file, in order of completion
+            
+        Raises:
+            WorkerCrashException: A worker process died
+        """
+        try:
+            futures = [self._pool.submit(_annotate_file_task, (input_path, output_path, file_options)) for input_path, output_path in files]
+            for future in as_completed(futures):
+                yield future.result()
+        except BrokenProcessPool as e:
+            raise WorkerCrashException("An annotation worker process died (killed by the OOM killer?), so its file is lost") from e
+
+    def pids(self):
+        """ PIDs of the current worker processes. """
+        while not self._pid_queue.empty():
+            self._pids.add(self._pid_queue.get())
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                self._pids.discard(pid)
+        return sorted(self._pids)
+
+    def close(self):
+        self._pool.shutdown()
+        self._log_listener.stop()
@@ -0,0 +1,161 @@
+import logging, os, signal, socketserver, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from lib.CoNLL_Annotation import read_conll_stream
+from lib.annotation_pool import WorkerCrashException
+import my_utils.file_utils as fu
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SIZE = 64 * 1024 * 1024  # request bodies larger than this are buffered on disk
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, handler_class, socket_mode=None):
+        # Anyone who may write to the socket may submit work, so by default the umask decides
+        self.socket_mode = socket_mode
+        socketserver.UnixStreamServer.__init__(self, path, handler_class)
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        if self.socket_mode is not None:
+            os.chmod(self.server_address, self.socket_mode)
+
+
+class AnnotationRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST / (or /annotate) with a CoNLL-U body (plain or compressed) returns the annotated
+    CoNLL-U, streamed batch by batch with chunked transfer encoding. GET /health reports
+    whether the server is up.
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "conllu-spacy"
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/health":
+            self.send_error(404)
+            return
+        body = f"OK {self.server.model_name}\n".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("", "/annotate"):
+            self.send_error(404)
+            return
+        # Read the whole request first: a client that sends its body before reading the
+        # response would otherwise deadlock with a server streaming a large response.
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        try:
+            self._read_body(body)
+        except (ValueError, OSError) as e:
+            self.send_error(400, f"Could not read request body: {str(e)}")
+            return
+        body.seek(0)
+
+        with self.server.request_slots:
+            start = time.time()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            n_sents = 0
+            try:
+                sentences = read_conll_stream(fu.open_input(body), token_class=self.server.token_class,
+                                              comment_str=self.server.comment_str, our_foundry="spacy")
+                for conll_strs, _ in self.server.pool.annotate(fu.batch_sentences(sentences, self.server.batch_size)):
+                    self._write_chunk("".join(f"{conll_str}\n\n" for conll_str in conll_strs).encode("utf-8"))
+                    n_sents += len(conll_strs)
+                self._write_chunk(b"")
+            except WorkerCrashException as e:
+                # The pool cannot be used any more: fail this request and stop the server
+                logger.error(f"Request from {self.address_string()} failed after {n_sents} sentences: {str(e)}")
+                self.close_connection = True
+                self.server.worker_crash = e
+                self.server.shutdown()
+                return
+            except Exception as e:
+                # The status line is already sent: drop the connection without the final
+                # chunk, so the client sees an incomplete response instead of truncated output
+                logger.error(f"Request from {self.address_string()} failed after {n_sents} sentences: {str(e)}")
+                self.close_connection = True
+                return
+            finally:
+                body.close()
+            logger.info(f"Request from {self.address_string()}: {n_sents} sentences in {time.time() - start:.2f}s")
+
+    def _read_body(self, out):
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers up to the empty line
+                    while self.rfile.readline().strip(): pass
+                    return
+                out.write(self.rfile.read(size))
+                self.rfile.readline()
+        remaining = int(self.headers.get("Content-Length", "0"))
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, fu.OUTPUT_BUFFER_SIZE))
+            if not data: raise ValueError("Unexpected end of request body")
+            out.write(data)
+            remaining -= len(data)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(address, pool, model_name, token_class, comment_str="#", batch_size=2000, max_requests=4, socket_mode=None):
+    """
+    Run an HTTP annotation server until interrupted.
+
+    Args:
+        address: "host:port" for TCP or "unix:/path/to/socket" for a Unix domain socket
+        pool: AnnotationPool holding the loaded pipeline(s)
+        model_name: spaCy model name (reported by /health)
+        token_class: Token class of the CoNLL-U input
+        comment_str: Prefix of comment lines
+        batch_size: Number of sentences per annotation batch
+        max_requests: Maximum number of requests annotated at the same time; others wait
+        socket_mode: Permissions of a Unix domain socket, e.g. 0o660 (default: as set by the umask)
+        
+    Raises:
+        WorkerCrashException: A worker process died, so the server stopped
+    """
+    if address.startswith("unix:"):
+        server = _UnixHTTPServer(address[len("unix:"):], AnnotationRequestHandler, socket_mode=socket_mode)
+    else:
+        host, _, port = address.rpartition(":")
+        server = ThreadingHTTPServer((host or "0.0.0.0", int(port)), AnnotationRequestHandler)
+        server.daemon_threads = True
+    server.pool = pool
+    server.model_name = model_name
+    server.token_class = token_class
+    server.comment_str = comment_str
+    server.batch_size = batch_size
+    server.request_slots = threading.BoundedSemaphore(max_requests)
+    server.worker_crash = None
+    # Shut down cleanly on "docker stop" as on Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    logger.info(f"Annotation server listening on {address} (at most {max_requests} concurrent requests)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Annotation server stopped")
+    finally:
+        server.server_close()
+    if server.worker_crash is not None:
+        raise server.worker_crash
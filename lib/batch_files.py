@@ -0,0 +1,146 @@
+import glob, logging, os, time
+from collections import Counter
+from lib.CoNLL_Annotation import read_conll_stream
+import lib.spacy_annotation as sa
+import my_utils.file_utils as fu
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+
+
+def expand_inputs(patterns):
+    """
+    Expand input files and glob patterns (** matches subdirectories) to a list of files.
+    Patterns are expanded here, so that quoted globs work beyond the shell's argument limit.
+
+    Returns:
+        list: Existing input files without duplicates, in order of first appearance
+    """
+    files = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = [path for path in sorted(glob.glob(pattern, recursive=True)) if os.path.isfile(path)]
+            if not matches:
+                logger.warning(f"No input files match {pattern}")
+            files.extend(matches)
+        elif os.path.isfile(pattern):
+            files.append(pattern)
+        else:
+            logger.warning(f"Input file {pattern} does not exist")
+    return list(dict.fromkeys(files))
+
+
+def output_path(input_path, input_root, output_dir, compression="none"):
+    """
+    Output file of an input file: its path relative to input_root below output_dir, with the
+    compression suffix of the input replaced by that of the output.
+    """
+    relative = os.path.relpath(os.path.abspath(input_path), input_root)
+    for suffix in fu.COMPRESSION_SUFFIXES.values():
+        if relative.endswith(suffix):
+            relative = relative[:-len(suffix)]
+            break
+    return os.path.join(output_dir, relative + fu.COMPRESSION_SUFFIXES.get(compression, ""))
+
+
+def plan_files(inputs, output_dir, compression="none"):
+    """
+    Pair input files with their outputs and order them largest first, so that the longest
+    files start early and small files fill up idle workers at the end of the run. The size
+    of a compressed input is its estimated uncompressed size, so inputs with different
+    compression ratios are ordered by the amount of text they hold.
+
+    Args:
+        inputs: Input files
+        output_dir: Directory for the outputs; the directory structure of the inputs below
+            their common parent directory is kept, so equal file names do not collide
+        compression: Output compression (see file_utils.COMPRESSIONS)
+
+    Returns:
+        tuple: (list of (input, output, estimated uncompressed size) to annotate, list of (input, output) whose output is already complete)
+
+    Raises:
+        ValueError: If an output would replace its input
+    """
+    if not inputs:
+        return [], []
+    input_root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in inputs])
+    jobs, done = [], []
+    for path in inputs:
+        output = output_path(path, input_root, output_dir, compression)
+        if os.path.abspath(output) == os.path.abspath(path):
+            raise ValueError(f"Output of {path} would overwrite it; choose another output directory")
+        # Outputs are only renamed to their final name once complete
+        if os.path.exists(output):
+            done.append((path, output))
+        else:
+            jobs.append((path, output, fu.estimate_uncompressed_size(path)))
+    jobs.sort(key=lambda job: -job[2])
+    return jobs, done
+
+
+def annotate_file(spacy_model, input_path, output_path, settings, token_class, comment_str="#", compression="none"):
+    """
+    Annotate one CoNLL-U file into output_path. The output is written to output_path + ".part"
+    and renamed when complete, so an interrupted run never leaves an output that looks complete.
+
+    Args:
+        spacy_model: Pipeline returned by load_pipeline
+        input_path: CoNLL-U input, plain or compressed
+        output_path: CoNLL-U output
+        settings: Keyword arguments for annotate_batch (use_germalemma, use_dependencies, batch_size, ...)
+        token_class: Token class of the CoNLL-U input
+        comment_str: Prefix of comment lines
+        compression: Output compression
+
+    Returns:
+        dict: input, output, sentences, tokens, seconds and error (None on success)
+    """
+    start = time.time()
+    stats = Counter()
+    part_path = output_path + PART_SUFFIX
+    try:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with fu.open_input(input_path) as input_stream, fu.open_output(part_path, compression=compression) as output:
+            sentences = read_conll_stream(input_stream, token_class=token_class, comment_str=comment_str, our_foundry="spacy")
+            for annos in fu.batch_sentences(sentences, settings.get("batch_size", 2000)):
+                conll_strs, batch_stats = sa.annotate_batch(spacy_model, annos, offset=stats["sentences"], **settings)
+                fu.write_conll_batch(output, conll_strs)
+                stats.update(batch_stats)
+                stats["sentences"] += len(conll_strs)
+        os.replace(part_path, output_path)
+        error = None
+    except Exception as e:
+        logger.error(f"Annotating {input_path} failed: {str(e)}")
+        error = str(e) or type(e).__name__
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+    return {"input": input_path, "output": output_path, "sentences": stats["sentences"], "tokens": stats["tokens"],
+            "seconds": round(time.time() - start, 3), "dependency_warnings": stats["dependency_warnings"], "error": error}
+
+
+def log_summary(results, skipped, total_time):
+    """
+    Log throughput per file, failures and totals of a batch run.
+
+    Returns:
+        int: Number of failed files
+    """
+    failed = [result for result in results if result["error"] is not None]
+    logger.info("=== Batch Summary ===")
+    for result in sorted(results, key=lambda result: result["input"]):
+        if result["error"] is None:
+            tokens_per_sec = result["tokens"] / result["seconds"] if result["seconds"] > 0 else 0
+            logger.info(f"{result['input']}: {result['sentences']} sentences, {result['tokens']} tokens in "
+                        f"{result['seconds']:.1f}s ({tokens_per_sec:.0f} tokens/sec)")
+        else:
+            logger.info(f"{result['input']}: FAILED after {result['seconds']:.1f}s: {result['error']}")
+    sentences = sum(result["sentences"] for result in results if result["error"] is None)
+    tokens = sum(result["tokens"] for result in results if result["error"] is None)
+    logger.info(f"Files: {len(results) - len(failed)} annotated, {len(skipped)} already complete, {len(failed)} failed")
+    logger.info(f"Total: {sentences} sentences, {tokens} tokens in {total_time:.2f}s "
+                f"({sentences / total_time if total_time > 0 else 0:.1f} sents/sec, {tokens / total_time if total_time > 0 else 0:.0f} tokens/sec)")
+    for result in failed:
+        logger.error(f"Failed: {result['input']}: {result['error']}")
+    return len(failed)
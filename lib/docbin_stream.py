@@ -0,0 +1,123 @@
+import logging, struct, time
+from collections import Counter
+from spacy.tokens import DocBin
+from spacy.vocab import Vocab
+import lib.spacy_annotation as sa
+from lib.CoNLL_Annotation import rewrite_metadata
+
+logger = logging.getLogger(__name__)
+
+# A DocBin stream is a sequence of frames, one per annotated batch: FRAME_MAGIC, the length of
+# the DocBin bytes and the bytes of DocBin.to_bytes(). Frames are self-contained, so streams can
+# be concatenated (shards) and truncated after any frame (checkpoints).
+FRAME_MAGIC = b"SDB1"
+_FRAME_LENGTH = struct.Struct(">Q")
+
+# Doc.user_data keys of the sentence information needed to write CoNLL-U without the input
+METADATA_KEY = "conllu_metadata"
+DEPENDENCIES_KEY = "conllu_dependencies"
+REUSED_KEY = "conllu_reused"
+
+
+class DocBinBatch():
+    """ Serialized DocBin of a batch of sentences; len() is the number of sentences. """
+    __slots__ = ("data", "n_sentences")
+
+    def __init__(self, data, n_sentences):
+        self.data = data
+        self.n_sentences = n_sentences
+
+    def __len__(self):
+        return self.n_sentences
+
+
+def encode_docbin(annos, docs, dependency_flags, stats=None):
+    """
+    Serialize parsed sentences as one DocBin, with the metadata lines of each sentence, whether
+    its dependencies were parsed, and its reused input columns (if any) as user data.
+
+    Args:
+        annos: List of AnnotatedSentence objects
+        docs: Docs for annos as returned by parse_batch (the sentence cache must be disabled)
+        dependency_flags: use_dependencies value per Doc as returned by parse_batch
+        stats: Optional Counter to add the stage timing to
+
+    Returns:
+        tuple: (DocBinBatch, Counter of statistics)
+    """
+    stats = Counter() if stats is None else stats
+    start = time.perf_counter()
+    doc_bin = DocBin(store_user_data=True)
+    for anno, doc, flag in zip(annos, docs, dependency_flags):
+        if isinstance(doc, str):
+            raise ValueError("DocBin output needs Docs, but got a sentence from the sentence cache")
+        # DocBin.add serializes the user data at once, so a Doc shared by repeated sentences
+        # can get the metadata of each repeat in turn
+        doc.user_data[METADATA_KEY] = list(anno.metadata)
+        doc.user_data[DEPENDENCIES_KEY] = flag
+        words = sa.sentence_words(anno)
+        if getattr(words, "columns", None):
+            doc.user_data[REUSED_KEY] = words.columns
+        doc_bin.add(doc)
+    batch = DocBinBatch(doc_bin.to_bytes(), len(annos))
+    stats["time_serialize"] += time.perf_counter() - start
+    return batch, stats
+
+
+def write_docbin_batch(out, batch):
+    """ Write a DocBinBatch as one frame to the binary stream under the text stream out and flush it. """
+    out.flush()
+    out.buffer.write(FRAME_MAGIC + _FRAME_LENGTH.pack(len(batch.data)) + batch.data)
+    out.buffer.flush()
+
+
+def read_docbin_stream(binary_in, vocab=None):
+    """
+    Read the Docs of a DocBin stream written by write_docbin_batch.
+
+    Args:
+        binary_in: Binary input stream
+        vocab: Vocab to deserialize into (default: a new, empty Vocab; no model is needed,
+            since the DocBins contain their strings)
+
+    Yields:
+        Doc: Sentence Docs in order, with the user data of encode_docbin
+
+    Raises:
+        ValueError: If the stream is not a DocBin stream or ends within a frame
+    """
+    vocab = Vocab() if vocab is None else vocab
+    header_size = len(FRAME_MAGIC) + _FRAME_LENGTH.size
+    while True:
+        header = binary_in.read(header_size)
+        if not header:
+            return
+        if len(header) < header_size or header[:len(FRAME_MAGIC)] != FRAME_MAGIC:
+            raise ValueError("Not a DocBin stream of parse_spacy_pipe.py, or truncated")
+        length, = _FRAME_LENGTH.unpack(header[len(FRAME_MAGIC):])
+        data = binary_in.read(length)
+        if len(data) < length:
+            raise ValueError(f"DocBin stream ends within a frame ({len(data)} of {length} bytes)")
+        yield from DocBin(store_user_data=True).from_bytes(data).get_docs(vocab)
+
+
+def docbin_to_conll(doc, use_germalemma, use_dependencies, foundry=None, timings=None):
+    """
+    CoNLL-U string of a sentence Doc read from a DocBin stream, as get_conll_str would write it.
+
+    Args:
+        doc: Doc with the user data of encode_docbin
+        use_germalemma: "True" to replace spaCy lemmas by GermaLemma lemmas (load_germalemma must have been called)
+        use_dependencies: "True" to write HEAD/DEPREL where the dependencies were parsed
+        foundry: Rewrite the foundry metadata to this foundry (default: keep the stored metadata)
+        timings: Optional Counter to add the GermaLemma time to
+
+    Returns:
+        str: CoNLL-U sentence without the trailing empty line
+    """
+    metadata = doc.user_data.get(METADATA_KEY, [])
+    if foundry is not None:
+        metadata = [rewrite_metadata(line, foundry) for line in metadata]
+    flag = "True" if use_dependencies == "True" and doc.user_data.get(DEPENDENCIES_KEY) == "True" else "False"
+    token_lines = sa.get_conll_token_lines(doc, use_germalemma, flag, timings=timings, reused=doc.user_data.get(REUSED_KEY))
+    return "\n".join(list(metadata) + token_lines)
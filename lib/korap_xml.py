@@ -0,0 +1,169 @@
+import logging, os, re, time, zipfile
+from collections import Counter
+from xml.sax.saxutils import escape, quoteattr
+import lib.spacy_annotation as sa
+
+logger = logging.getLogger(__name__)
+
+KORAP_FOUNDRY = "spacy"
+KORAP_LAYER = "morpho.xml"
+
+TEXT_ID_RE = re.compile(r'text_id\s*=\s*(\S+)')
+FILENAME_RE = re.compile(r'filename\s*=\s*(\S+)')
+START_OFFSETS_RE = re.compile(r'start_offsets\s*=\s*([\d ]+)')
+END_OFFSETS_RE = re.compile(r'end_offsets\s*=\s*([\d ]+)')
+
+LAYER_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<?xml-model href="span.rng" type="application/xml" schematypens="http://relaxng.org/ns/structure/1.0"?>\n'
+                '<layer docid={docid} xmlns="http://ids-mannheim.de/ns/KorAP" version="KorAP-0.4">\n'
+                '  <spanList>\n')
+LAYER_FOOTER = '  </spanList>\n</layer>\n'
+
+
+class KorapSentence():
+    """
+    A sentence formatted for a KorAP morpho.xml layer: the text it starts (if any) and its
+    token spans without their id attribute, which is numbered per text by KorapWriter.
+    """
+    __slots__ = ("text_id", "filename", "spans")
+
+    def __init__(self, text_id, filename, spans):
+        self.text_id = text_id
+        self.filename = filename
+        self.spans = spans
+
+
+def _metadata_value(metadata, pattern):
+    for line in metadata:
+        match = pattern.search(line)
+        if match:
+            return match.group(1).strip()
+    return None
+
+
+def token_offsets(anno, words):
+    """
+    Character offsets of the tokens of a sentence in the primary text, from the start_offsets and
+    end_offsets metadata of KorAP CoNLL-U (the first value of each is the sentence). Without
+    end_offsets, a token ends after the length of its FORM.
+
+    Raises:
+        ValueError: If the sentence has no offsets for all tokens
+    """
+    starts = _metadata_value(anno.metadata, START_OFFSETS_RE)
+    if starts is None:
+        raise ValueError("KorAP XML output needs start_offsets metadata in the input")
+    starts = [int(offset) for offset in starts.split()[1:]]
+    ends = _metadata_value(anno.metadata, END_OFFSETS_RE)
+    ends = [int(offset) for offset in ends.split()[1:]] if ends is not None else [start + len(word) for start, word in zip(starts, words)]
+    if len(starts) < len(words) or len(ends) < len(words):
+        raise ValueError(f"Offsets for {min(len(starts), len(ends))} of {len(words)} tokens")
+    return starts, ends
+
+
+def morpho_spans(anno, columns):
+    """ Spans (without id) of the morpho.xml layer for a sentence's output columns (see get_conll_columns). """
+    words, lemmas, upos, xpos, feats = columns[:5]
+    starts, ends = token_offsets(anno, words)
+    spans = []
+    for start, end, lemma, pos_universal, pos, msd in zip(starts, ends, lemmas, upos, xpos, feats):
+        features = "".join(f'<f name="{name}">{escape(value)}</f>'
+                           for name, value in (("lemma", lemma), ("upos", pos_universal), ("pos", pos), ("msd", msd)) if value and value != "_")
+        spans.append(f'from="{start}" to="{end}"><fs type="lex" xmlns="http://www.tei-c.org/ns/1.0"><f name="lex"><fs>'
+                     f'{features}</fs></f></fs></span>\n')
+    return spans
+
+
+def format_korap_batch(annos, docs, dependency_flags, use_germalemma, stats=None):
+    """
+    Format parsed sentences for KorAP morpho.xml layers.
+
+    Args:
+        annos: List of AnnotatedSentence objects
+        docs: Docs for annos as returned by parse_batch (the sentence cache must be disabled)
+        dependency_flags: use_dependencies value per Doc as returned by parse_batch
+        use_germalemma: "True" to replace spaCy lemmas by GermaLemma lemmas
+        stats: Optional Counter to add the stage timings to
+
+    Returns:
+        tuple: (list of KorapSentence in input order, Counter of statistics)
+    """
+    stats = Counter() if stats is None else stats
+    start = time.perf_counter()
+    germalemma_time = stats["time_germalemma"]
+    sentences = []
+    for anno, doc, flag in zip(annos, docs, dependency_flags):
+        if isinstance(doc, str):
+            raise ValueError("KorAP XML output needs Docs, but got a sentence from the sentence cache")
+        words = sa.sentence_words(anno)
+        columns = sa.get_conll_columns(doc, use_germalemma, flag, timings=stats, reused=getattr(words, "columns", None))
+        # The placeholder token of an empty sentence has no span
+        spans = morpho_spans(anno, columns) if anno.tokens else []
+        sentences.append(KorapSentence(_metadata_value(anno.metadata, TEXT_ID_RE), _metadata_value(anno.metadata, FILENAME_RE), spans))
+    stats["time_serialize"] += time.perf_counter() - start - (stats["time_germalemma"] - germalemma_time)
+    return sentences, stats
+
+
+def layer_path(text_id, filename=None, foundry=KORAP_FOUNDRY):
+    """
+    Path of the morpho.xml layer of a text: the filename metadata (already pointed to the foundry by
+    read_conll_stream), or else derived from the text sigle (e.g. GOE_AGA.00000 -> GOE/AGA/00000/spacy/morpho.xml).
+    """
+    if filename:
+        return filename
+    corpus, _, rest = text_id.partition("_")
+    document, _, text = rest.partition(".")
+    return "/".join([corpus, document, text, foundry, KORAP_LAYER])
+
+
+class KorapWriter():
+    """
+    Writes KorAP morpho.xml layers, one text at a time, as entries of a zip file or as files
+    below a directory. Only the spans of the current text are kept in memory; a text ends
+    where the next one starts (text_id metadata).
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path: Output zip file (*.zip) or directory
+        """
+        self.path = path
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) if path.endswith(".zip") else None
+        self._text_id = None
+        self._filename = None
+        self._spans = []
+        self.texts = 0
+
+    def write_batch(self, sentences):
+        """ Add a batch of KorapSentences, writing each text that is complete. """
+        for sentence in sentences:
+            if sentence.text_id is not None:
+                self._write_text()
+                self._text_id, self._filename = sentence.text_id, sentence.filename
+            elif self._text_id is None and sentence.spans:
+                raise ValueError("KorAP XML output needs text_id metadata at the start of each text")
+            self._spans.extend(sentence.spans)
+
+    def _write_text(self):
+        if self._text_id is None:
+            return
+        parts = [LAYER_HEADER.format(docid=quoteattr(self._text_id))]
+        parts.extend(f'    <span id="s_{ix}" {span}' for ix, span in enumerate(self._spans))
+        parts.append(LAYER_FOOTER)
+        data = "".join(parts).encode("utf-8")
+        path = layer_path(self._text_id, self._filename)
+        if self._zip is not None:
+            self._zip.writestr(path, data)
+        else:
+            target = os.path.join(self.path, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as out:
+                out.write(data)
+        self.texts += 1
+        self._text_id, self._filename, self._spans = None, None, []
+
+    def close(self):
+        """ Write the last text and finish the zip file. """
+        self._write_text()
+        if self._zip is not None:
+            self._zip.close()
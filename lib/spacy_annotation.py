@@ -0,0 +1,998 @@
+import logging, signal, os, time, hashlib, json
+import importlib.util
+from collections import Counter
+import numpy
+import spacy
+from spacy.attrs import ORTH, LEMMA, POS, TAG, MORPH, HEAD, DEP
+from spacy.tokens import Doc
+from spacy.parts_of_speech import IDS as POS_IDS
+from lib.CoNLL_Annotation import TEXT_START_RE
+from my_utils.cache_utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# GermaLemma is optional; it takes about a second to import, so it is only imported by load_germalemma()
+GERMALEMMA_AVAILABLE = importlib.util.find_spec("germalemma") is not None
+
+# GermaLemma instance and lookup cache used by find_germalemma, set by load_germalemma()
+lemmatizer = None
+lemma_cache = None
+DEFAULT_GERMALEMMA_CACHE_SIZE = 200000  # (word, POS) pairs
+
+# Cache of formatted token lines per sentence, set by load_sentence_cache(). Keys are
+# (sentence_cache_key, tab-separated FORMs); the first part identifies the model and options.
+sentence_cache = None
+sentence_cache_key = None
+DEFAULT_SENTENCE_CACHE_SIZE = 0  # sentences (opt-in)
+# Doc.user_data flag of Docs that must not be cached (fallbacks after timeouts or errors)
+_NO_CACHE = "conllu_spacy_no_cache"
+
+# STTS tags mapped to the simplified POS classes understood by GermaLemma
+SIMPLIFY_POS = {"ADJA":"ADJ", "ADJD":"ADJ",
+                "NA":"N", "NE":"N", "NN":"N",
+                "ADV":"ADV", "PAV":"ADV", "PROAV":"ADV", "PAVREL":"ADV", "PWAV":"ADV", "PWAVREL":"ADV",
+                "VAFIN":"V", "VAIMP":"V", "VAINF":"V", "VAPP":"V", "VMFIN":"V", "VMINF":"V",
+                "VMPP":"V", "VVFIN":"V", "VVIMP":"V", "VVINF":"V", "VVIZU":"V","VVPP":"V"
+            }
+# simplify_pos = {"VERB": "V", "ADV": "ADV", "ADJ": "ADJ", "NOUN":"N", "PROPN": "N"}
+
+_MISSING = object()
+
+# Doc.user_data key of the sentence lengths of a text Doc (see make_text_doc)
+_SENTENCE_LENGTHS = "conllu_spacy_sentence_lengths"
+
+# CoNLL-U columns that can be taken over from the input (SPACY_REUSE_COLUMNS), with the
+# token attribute they are read from
+REUSABLE_COLUMNS = {"LEMMA": "lemma", "UPOS": "pos_universal", "XPOS": "pos_tag", "FEATS": "detail_tag",
+                    "HEAD": "head", "DEPREL": "dep_tag"}
+# Columns computed by each component factory; a component is disabled when all of its columns are reused
+COMPONENT_COLUMNS = {"tagger": {"XPOS"}, "morphologizer": {"UPOS", "FEATS"}, "parser": {"HEAD", "DEPREL"},
+                     "trainable_lemmatizer": {"LEMMA"}, "lemmatizer": {"LEMMA"}}
+# Shared embedding components, and components that do not listen to them
+EMBEDDING_FACTORIES = {"tok2vec", "transformer"}
+NON_LISTENING_FACTORIES = {"attribute_ruler", "lemmatizer", "sentencizer", "entity_ruler", "span_ruler"}
+# Reused columns, set by load_pipeline
+preset_columns = ()
+
+# Output formats of annotate_batch: CoNLL-U, DocBin stream (see docbin_stream), KorAP morpho.xml (see korap_xml)
+OUTPUT_FORMATS = ["conllu", "docbin", "korap"]
+
+# Dependency parsing safety limits
+DEFAULT_PARSE_TIMEOUT = 0.5  # seconds per sentence
+DEFAULT_MAX_SENTENCE_LENGTH = 500  # tokens
+DEFAULT_PARSE_BATCH_SIZE = 256  # sentences per dependency parsing batch
+DEFAULT_PARSE_BATCH_BUDGET = 60  # maximum seconds per dependency parsing batch
+
+class TimeoutException(Exception):
+    pass
+
+def timeout_handler(signum, frame):
+    raise TimeoutException("Dependency parsing timeout")
+
+class PresetSentence(list):
+    """
+    FORMs of a sentence together with the values of its reused input columns (see
+    sentence_words), which make_doc sets as preset annotations.
+    """
+    def __init__(self, words, columns):
+        super().__init__(words)
+        self.columns = columns
+
+
+def parse_reuse_columns(value):
+    """
+    Parse SPACY_REUSE_COLUMNS, a comma-separated list of CoNLL-U column names.
+    
+    Returns:
+        tuple: Column names in CoNLL-U order
+        
+    Raises:
+        ValueError: For unknown columns, or HEAD without DEPREL (or vice versa)
+    """
+    columns = {column.strip().upper() for column in value.split(",") if column.strip()}
+    unknown = sorted(columns - set(REUSABLE_COLUMNS))
+    if unknown:
+        raise ValueError(f"Unknown columns to reuse: {', '.join(unknown)} (expected {', '.join(REUSABLE_COLUMNS)})")
+    if len(columns & {"HEAD", "DEPREL"}) == 1:
+        raise ValueError("HEAD and DEPREL can only be reused together")
+    return tuple(column for column in REUSABLE_COLUMNS if column in columns)
+
+
+def input_columns(anno, columns):
+    """ Values of the given CoNLL-U columns of a sentence's input tokens ("_" where a line has fewer columns). """
+    values = {}
+    for column in columns:
+        attr = REUSABLE_COLUMNS[column]
+        values[column] = column_values = []
+        for token in anno.tokens:
+            try:
+                column_values.append(str(getattr(token, attr)))
+            except IndexError:
+                column_values.append("_")
+    return values
+
+
+def sentence_words(anno):
+    """ Words of a sentence for make_doc: its FORMs, with the reused input columns if any. """
+    if preset_columns:
+        return PresetSentence(anno.get_words(), input_columns(anno, preset_columns))
+    return anno.get_words()
+
+
+def _doc_presets(sentence, offset=0):
+    """
+    Doc keyword arguments presetting the reused columns of a PresetSentence, with HEAD as
+    absolute token index in a Doc in which the sentence starts at token offset.
+    
+    Raises:
+        ValueError: If a HEAD is not a token of the sentence
+    """
+    length = max(1, len(sentence))
+    # An empty sentence is represented by one placeholder token without annotations
+    columns = sentence.columns if sentence else {column: ["_"] for column in sentence.columns}
+    presets = {}
+    if "LEMMA" in columns:
+        presets["lemmas"] = columns["LEMMA"]
+    if "UPOS" in columns:
+        # Tags outside the UD tag set cannot be stored in Token.pos; they are still written as they are
+        presets["pos"] = [pos if pos in POS_IDS else "" for pos in columns["UPOS"]]
+    if "XPOS" in columns:
+        presets["tags"] = [tag if tag != "_" else "" for tag in columns["XPOS"]]
+    if "FEATS" in columns:
+        presets["morphs"] = [feats if feats != "_" else "" for feats in columns["FEATS"]]
+    if "HEAD" in columns:
+        heads = []
+        for ix, head in enumerate(columns["HEAD"]):
+            # Roots (and tokens without a head) are their own head in spaCy
+            head = ix if head in ("0", "_") else int(head) - 1
+            if not 0 <= head < length:
+                raise ValueError(f"HEAD {head + 1} of token {ix + 1} is outside the sentence")
+            heads.append(head + offset)
+        presets["heads"] = heads
+        presets["deps"] = [dep if dep != "_" else "" for dep in columns["DEPREL"]]
+    return presets
+
+
+def make_doc(vocab, words):
+    """
+    Doc of a pre-tokenized sentence, built directly from its FORMs. Every token is followed
+    by a space, as in the output of WhitespaceTokenizer, and FORMs containing spaces stay
+    single tokens, so tokens are always aligned with the input IDs. The reused columns of
+    a PresetSentence are set as annotations.
+    """
+    presets = {}
+    if getattr(words, "columns", None):
+        try:
+            presets = _doc_presets(words)
+        except ValueError as e:
+            logger.warning(f"Could not preset the input annotations of a sentence, annotating it without them: {str(e)}")
+    words = words or ['_EMPTY_']
+    try:
+        return Doc(vocab, words=words, spaces=[True] * len(words), **presets)
+    except ValueError as e:
+        if not presets:
+            raise
+        logger.warning(f"Could not preset the input annotations of a sentence, annotating it without them: {str(e)}")
+        return Doc(vocab, words=words, spaces=[True] * len(words))
+
+
+def safe_dependency_parse(spacy_model, words, timeout=DEFAULT_PARSE_TIMEOUT, max_length=DEFAULT_MAX_SENTENCE_LENGTH):
+    """
+    Safely parse a sentence with timeout and length limits.
+
+    Args:
+        spacy_model: Loaded spaCy model
+        words: Tokens of the sentence
+        timeout: Maximum seconds to wait for parsing
+        max_length: Maximum sentence length in tokens
+
+    Returns:
+        tuple: (spacy_doc, success, warning_message)
+    """
+    # Check sentence length
+    if len(words) > max_length:
+        # Process without dependency parsing for long sentences
+        disabled_components = ["ner", "parser"]
+        doc = spacy_model(make_doc(spacy_model.vocab, words), disable=disabled_components)
+        return doc, False, f"Sentence too long ({len(words)} tokens > {max_length}), dependency parsing skipped"
+
+    # Set up timeout
+    old_handler = signal.signal(signal.SIGALRM, timeout_handler)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        doc = spacy_model(make_doc(spacy_model.vocab, words))
+        signal.setitimer(signal.ITIMER_REAL, 0)  # Cancel alarm
+        signal.signal(signal.SIGALRM, old_handler)
+        return doc, True, None
+    except TimeoutException:
+        signal.setitimer(signal.ITIMER_REAL, 0)  # Cancel alarm
+        signal.signal(signal.SIGALRM, old_handler)
+        # Retry without dependency parsing
+        disabled_components = ["ner", "parser"]
+        doc = spacy_model(make_doc(spacy_model.vocab, words), disable=disabled_components)
+        return doc, False, f"Dependency parsing timeout after {timeout}s, processed without dependencies"
+    except Exception as e:
+        signal.setitimer(signal.ITIMER_REAL, 0)  # Cancel alarm
+        signal.signal(signal.SIGALRM, old_handler)
+        # Retry without dependency parsing
+        disabled_components = ["ner", "parser"]
+        doc = spacy_model(make_doc(spacy_model.vocab, words), disable=disabled_components)
+        return doc, False, f"Dependency parsing error: {str(e)}, processed without dependencies"
+
+def run_with_timeout(func, timeout):
+    """
+    Run func() and raise TimeoutException if it takes longer than timeout seconds.
+
+    Args:
+        func: Callable without arguments
+        timeout: Maximum seconds to wait
+
+    Returns:
+        The return value of func()
+    """
+    old_handler = signal.signal(signal.SIGALRM, timeout_handler)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)  # Cancel alarm
+        signal.signal(signal.SIGALRM, old_handler)
+
+
+def timed_pipe(spacy_model, sentences, batch_size, timings):
+    """
+    Equivalent of list(spacy_model.pipe(docs, batch_size=batch_size)) that makes the
+    Docs and runs each pipeline component over all of them in turn and adds the seconds
+    spent in each to timings["time_tokenizer"] and timings["time_<component>"].
+    
+    Args:
+        spacy_model: Loaded spaCy model
+        sentences: List of sentences as lists of tokens, or of Docs
+        batch_size: Batch size passed to the components
+        timings: Counter to add the stage timings to
+        
+    Returns:
+        list: Docs for sentences
+    """
+    start = time.perf_counter()
+    docs = [sentence if isinstance(sentence, Doc) else make_doc(spacy_model.vocab, sentence) for sentence in sentences]
+    timings["time_tokenizer"] += time.perf_counter() - start
+    for name, proc in spacy_model.pipeline:
+        start = time.perf_counter()
+        if hasattr(proc, "pipe"):
+            docs = list(proc.pipe(docs, batch_size=batch_size))
+        else:
+            docs = [proc(doc) for doc in docs]
+        timings[f"time_{name}"] += time.perf_counter() - start
+    return docs
+
+
+def batch_budget(timeout, n_sentences, max_budget=DEFAULT_PARSE_BATCH_BUDGET):
+    """ Time budget of a parsing batch: timeout seconds per sentence, capped at max_budget (but at least timeout). """
+    return max(timeout, min(timeout * n_sentences, max_budget))
+
+
+def _parse_with_budget(spacy_model, sentences, indices, results, timeout, stats, max_budget=DEFAULT_PARSE_BATCH_BUDGET):
+    """
+    Parse sentences[i] for all i in indices with one nlp.pipe call and a budget of
+    timeout seconds per sentence, capped at max_budget seconds. If the batch fails, it
+    is split in halves until the offending sentences are isolated. If it times out, its
+    sentences are parsed one by one with safe_dependency_parse, so a hanging sentence
+    costs one more timeout instead of a timeout at every level of a bisection.
+
+    Worst case for a batch with hanging sentences: max_budget seconds, then one timeout
+    (and a parse without the parser) per hanging sentence, plus the single-sentence
+    parsing time of the others.
+    """
+    if len(indices) == 0:
+        return
+    if len(indices) == 1:
+        ix = indices[0]
+        start = time.perf_counter()
+        results[ix] = safe_dependency_parse(spacy_model, sentences[ix], timeout=timeout, max_length=float("inf"))
+        stats["time_single_sentence"] += time.perf_counter() - start
+        return
+    batch = [sentences[ix] for ix in indices]
+    try:
+        docs = run_with_timeout(lambda: timed_pipe(spacy_model, batch, len(batch), stats), batch_budget(timeout, len(batch), max_budget))
+    except TimeoutException:
+        stats["parse_batch_timeouts"] += 1
+        for ix in indices:
+            _parse_with_budget(spacy_model, sentences, [ix], results, timeout, stats, max_budget)
+        return
+    except Exception:
+        stats["parse_bisections"] += 1
+        middle = len(indices) // 2
+        _parse_with_budget(spacy_model, sentences, indices[:middle], results, timeout, stats, max_budget)
+        _parse_with_budget(spacy_model, sentences, indices[middle:], results, timeout, stats, max_budget)
+        return
+    for ix, doc in zip(indices, docs):
+        results[ix] = (doc, True, None)
+
+
+def plan_batches(lengths, indices, batch_size, token_budget=0):
+    """
+    Split sentences into model batches.
+    
+    Without a token budget, the sentences are cut into consecutive batches of batch_size.
+    With a token budget, they are sorted by length and each batch is filled with sentences
+    of similar length up to token_budget tokens (and at most batch_size sentences), so that
+    batches have a predictable size whatever the mix of short and long sentences.
+    
+    Args:
+        lengths: Number of tokens per sentence
+        indices: Indices of the sentences to batch
+        batch_size: Maximum number of sentences per batch
+        token_budget: Maximum number of tokens per batch (0 to batch by sentence count only)
+        
+    Returns:
+        list: Lists of sentence indices, one per batch
+    """
+    batch_size = max(1, batch_size)
+    if token_budget <= 0:
+        return [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+    batches, batch, batch_tokens = [], [], 0
+    for ix in sorted(indices, key=lambda ix: lengths[ix]):
+        if batch and (batch_tokens + lengths[ix] > token_budget or len(batch) >= batch_size):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(ix)
+        batch_tokens += lengths[ix]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def make_text_doc(vocab, sentences):
+    """
+    Make one Doc of consecutive sentences (see make_doc), with the sentence boundaries of
+    the input preset as is_sent_start.
+    
+    Args:
+        vocab: Vocab of the pipeline
+        sentences: Sentences of the same text as lists of tokens (or PresetSentences)
+        
+    Returns:
+        Doc: Doc with the number of tokens of each sentence in user_data[_SENTENCE_LENGTHS]
+        
+    Raises:
+        ValueError: If the reused columns of a sentence cannot be preset
+    """
+    words, sent_starts, lengths, presets = [], [], [], {}
+    for sentence in sentences:
+        if getattr(sentence, "columns", None):
+            for key, values in _doc_presets(sentence, offset=len(words)).items():
+                presets.setdefault(key, []).extend(values)
+        sentence = sentence or ['_EMPTY_']
+        words.extend(sentence)
+        sent_starts.extend([True] + [False] * (len(sentence) - 1))
+        lengths.append(len(sentence))
+    doc = Doc(vocab, words=words, spaces=[True] * len(words), sent_starts=sent_starts, **presets)
+    doc.user_data[_SENTENCE_LENGTHS] = lengths
+    return doc
+
+
+def split_text_doc(doc):
+    """
+    Split an annotated Doc made by make_text_doc back into one Doc per input sentence.
+    
+    Returns:
+        list: Docs of the sentences, or None for sentences with a dependency that crosses
+        the sentence boundary (which a pipeline might predict despite the preset boundaries)
+    """
+    lengths = doc.user_data[_SENTENCE_LENGTHS]
+    # HEAD is stored relative to the token; the cast recovers negative offsets
+    heads = numpy.arange(len(doc)) + doc.to_array([HEAD]).astype(numpy.int64).ravel()
+    docs, start = [], 0
+    for length in lengths:
+        end = start + length
+        inside = ((heads[start:end] >= start) & (heads[start:end] < end)).all()
+        docs.append(doc[start:end].as_doc() if inside else None)
+        start = end
+    return docs
+
+
+def _group_texts(annos, sents, todo, max_tokens, max_length):
+    """
+    Group the sentences todo into runs of consecutive sentences of the same text (a text
+    starts at a sentence with text_id/newdoc metadata) of at most max_tokens tokens.
+    
+    Returns:
+        tuple: (list of lists of sentence indices, list of indices of sentences longer than max_length)
+    """
+    groups, rest = [], []
+    group, group_tokens, previous = [], 0, None
+    for ix in todo:
+        length = max(1, len(sents[ix]))
+        if length > max_length:
+            rest.append(ix)
+            continue
+        starts_text = any(TEXT_START_RE.match(line) for line in annos[ix].metadata)
+        if group and (starts_text or previous != ix - 1 or group_tokens + length > max_tokens):
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(ix)
+        group_tokens += length
+        previous = ix
+    if group:
+        groups.append(group)
+    return groups, rest
+
+
+def _parse_text_docs(spacy_model, annos, sents, todo, docs, use_dependencies, max_tokens, timeout, max_length, batch_size, stats,
+                     max_budget=DEFAULT_PARSE_BATCH_BUDGET):
+    """
+    Annotate the sentences todo as text Docs (see make_text_doc) and fill docs[ix] with the
+    per-sentence Docs split from them. With dependencies, each batch of text Docs gets a
+    time budget of timeout seconds per sentence, capped at max_budget seconds.
+    
+    Returns:
+        list: Indices of the sentences left to the per-sentence path (too long for dependency
+        parsing, in a batch that timed out or failed, or with dependencies crossing boundaries)
+    """
+    max_length = max_length if use_dependencies == "True" else float("inf")
+    groups, rest = _group_texts(annos, sents, todo, max_tokens, max_length)
+    # Batches of text Docs with at most batch_size sentences
+    batches, batch, batch_sents = [], [], 0
+    for group in groups:
+        if batch and batch_sents + len(group) > batch_size:
+            batches.append(batch)
+            batch, batch_sents = [], 0
+        batch.append(group)
+        batch_sents += len(group)
+    if batch:
+        batches.append(batch)
+    for batch in batches:
+        n_sents = sum(len(group) for group in batch)
+        try:
+            start = time.perf_counter()
+            text_docs = [make_text_doc(spacy_model.vocab, [sents[ix] for ix in group]) for group in batch]
+            stats["time_tokenizer"] += time.perf_counter() - start
+            if use_dependencies == "True":
+                text_docs = run_with_timeout(lambda: timed_pipe(spacy_model, text_docs, len(text_docs), stats),
+                                             batch_budget(timeout, n_sents, max_budget))
+            else:
+                text_docs = timed_pipe(spacy_model, text_docs, len(text_docs), stats)
+        except Exception as e:
+            stats["text_doc_fallbacks"] += 1
+            logger.warning(f"Text Docs of {n_sents} sentences failed ({str(e) or type(e).__name__}), annotating them one by one")
+            rest.extend(ix for group in batch for ix in group)
+            continue
+        start = time.perf_counter()
+        for group, text_doc in zip(batch, text_docs):
+            for ix, doc in zip(group, split_text_doc(text_doc)):
+                if doc is None:
+                    stats["text_doc_fallbacks"] += 1
+                    rest.append(ix)
+                else:
+                    docs[ix] = doc
+        stats["time_split_text_docs"] += time.perf_counter() - start
+    return sorted(rest)
+
+
+def safe_dependency_parse_batch(spacy_model, sentences, timeout=DEFAULT_PARSE_TIMEOUT, max_length=DEFAULT_MAX_SENTENCE_LENGTH, batch_size=DEFAULT_PARSE_BATCH_SIZE, stats=None, token_budget=0,
+                                max_budget=DEFAULT_PARSE_BATCH_BUDGET):
+    """
+    Batched version of safe_dependency_parse using spacy_model.pipe.
+
+    Each batch gets a time budget of timeout seconds per sentence, capped at max_budget
+    seconds. Sentences that make a batch fail are isolated by bisection; the sentences of
+    a batch that times out are parsed one by one. Either way, the offending sentences are
+    processed without dependency parsing, exactly as safe_dependency_parse would do for them
+    (see _parse_with_budget for the worst-case time).
+
+    Args:
+        spacy_model: Loaded spaCy model
+        sentences: List of sentences to parse, as lists of tokens
+        timeout: Maximum seconds per sentence
+        max_length: Maximum sentence length in tokens
+        batch_size: Maximum number of sentences per nlp.pipe call
+        stats: Optional Counter to add stage timings and the number of bisections to
+        token_budget: Maximum number of tokens per nlp.pipe call; sentences are then
+            grouped by length (see plan_batches)
+        max_budget: Maximum seconds per nlp.pipe call
+
+    Returns:
+        list: (spacy_doc, success, warning_message) for each sentence, in input order
+    """
+    stats = Counter() if stats is None else stats
+    lengths = [len(words) for words in sentences]
+    results = [None] * len(sentences)
+    to_parse = []
+    for ix, words in enumerate(sentences):
+        if lengths[ix] > max_length:
+            start = time.perf_counter()
+            results[ix] = safe_dependency_parse(spacy_model, words, timeout=timeout, max_length=max_length)
+            stats["time_single_sentence"] += time.perf_counter() - start
+        else:
+            to_parse.append(ix)
+    # Results are stored by index, so they come back in input order however the batches are formed
+    for batch in plan_batches(lengths, to_parse, batch_size, token_budget):
+        _parse_with_budget(spacy_model, sentences, batch, results, timeout, stats, max_budget)
+    return results
+
+
+def format_morphological_features(token):
+    """
+    Extract and format morphological features from a spaCy token for CoNLL-U output.
+
+    Args:
+        token: spaCy token object
+
+    Returns:
+        str: Formatted morphological features string for CoNLL-U 5th column
+             Returns "_" if no features are available
+    """
+    if not hasattr(token, 'morph') or not token.morph:
+        return "_"
+
+    morph_dict = token.morph.to_dict()
+    if not morph_dict:
+        return "_"
+
+    # Format as CoNLL-U format: Feature=Value|Feature2=Value2
+    features = []
+    for feature, value in sorted(morph_dict.items()):
+        features.append(f"{feature}={value}")
+
+    return "|".join(features)
+
+
+# Columns read at once from each Doc by get_conll_str
+CONLL_ATTRS = [ORTH, LEMMA, POS, TAG, MORPH, HEAD, DEP]
+
+# Formatted column values by hash (or POS id). The number of distinct tags, feature
+# bundles and dependency labels is small, so these never grow large.
+_pos_strings = {}
+_tag_strings = {}
+_morph_strings = {}
+_dep_strings = {}
+
+
+def _column_strings(keys, cache, doc, format_token):
+    """ Map a column of Doc.to_array to strings, formatting each distinct value only once. """
+    strings = []
+    for ix, key in enumerate(keys):
+        value = cache.get(key)
+        if value is None:
+            value = cache[key] = format_token(doc[ix])
+        strings.append(value)
+    return strings
+
+
+class WhitespaceTokenizer(object):
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def __call__(self, text):
+        words = text.split(' ')
+        # Filter out empty strings to avoid spaCy errors
+        words = [w for w in words if w]
+        # Handle edge case of empty input - use a placeholder token
+        if not words:
+            words = ['_EMPTY_']
+        # All tokens 'own' a subsequent space character in this tokenizer
+        spaces = [True] * len(words)
+        return Doc(self.vocab, words=words, spaces=spaces)
+
+
+def get_conll_str(anno_obj, spacy_doc, use_germalemma, use_dependencies, timings=None):
+    #  First lines are comments. (metadata)
+    conll_lines = list(anno_obj.metadata) # Then we want: [ID, FORM, LEMMA, UPOS, XPOS, FEATS, HEAD, DEPREL, DEPS, MISC]
+    reused = input_columns(anno_obj, preset_columns) if preset_columns else None
+    conll_lines += get_conll_token_lines(spacy_doc, use_germalemma, use_dependencies, timings=timings, reused=reused)
+    return "\n".join(conll_lines)
+
+
+def get_conll_token_lines(spacy_doc, use_germalemma, use_dependencies, timings=None, reused=None):
+    """
+    CoNLL-U token lines of a Doc (see get_conll_str), without the metadata lines. Columns in
+    reused (column name -> input values, see input_columns) are written as in the input.
+    """
+    columns = get_conll_columns(spacy_doc, use_germalemma, use_dependencies, timings=timings, reused=reused)
+    return [f"{ix+1}\t" + "\t".join(content) + "\t_\t_" for ix, content in enumerate(zip(*columns))]
+
+
+def get_conll_columns(spacy_doc, use_germalemma, use_dependencies, timings=None, reused=None):
+    """
+    Output columns of a Doc (see get_conll_token_lines).
+    
+    Returns:
+        tuple: Lists of FORM, LEMMA, UPOS, XPOS, FEATS, HEAD and DEPREL strings, one value per token
+    """
+    if len(spacy_doc) == 0:
+        return [], [], [], [], [], [], []
+    
+    # Read all columns of the doc at once instead of formatting token by token
+    columns = spacy_doc.to_array(CONLL_ATTRS)
+    strings = spacy_doc.vocab.strings
+    words = [strings[key] for key in columns[:, 0].tolist()]
+    lemmas = [strings[key] for key in columns[:, 1].tolist()]
+    upos = _column_strings(columns[:, 2].tolist(), _pos_strings, spacy_doc, lambda token: token.pos_)
+    xpos = _column_strings(columns[:, 3].tolist(), _tag_strings, spacy_doc, lambda token: token.tag_)
+    feats = _column_strings(columns[:, 4].tolist(), _morph_strings, spacy_doc, format_morphological_features)
+    
+    # Get HEAD and DEPREL columns if dependency parsing is enabled
+    if use_dependencies == "True":
+        deps = _column_strings(columns[:, 6].tolist(), _dep_strings, spacy_doc, lambda token: token.dep_)
+        # HEAD is stored relative to the token; the cast recovers negative offsets
+        head_offsets = columns[:, 5].astype(numpy.int64).tolist()
+        heads = ["0" if dep == "ROOT" else str(ix + offset + 1) for ix, (offset, dep) in enumerate(zip(head_offsets, deps))]
+        deprels = [dep if dep else "_" for dep in deps]
+    else:
+        heads = deprels = ["_"] * len(words)
+    
+    # Reused columns are copied, so values spaCy cannot store (e.g. non-UD UPOS tags) survive
+    if reused and all(len(values) == len(words) for values in reused.values()):
+        lemmas = reused.get("LEMMA", lemmas)
+        upos = reused.get("UPOS", upos)
+        xpos = reused.get("XPOS", xpos)
+        feats = reused.get("FEATS", feats)
+        heads = reused.get("HEAD", heads)
+        deprels = reused.get("DEPREL", deprels)
+    
+    if use_germalemma == "True":
+        start = time.perf_counter()
+        lemmas = [find_germalemma(word, tag, lemma) for word, tag, lemma in zip(words, xpos, lemmas)]
+        if timings is not None:
+            timings["time_germalemma"] += time.perf_counter() - start
+    return words, lemmas, upos, xpos, feats, heads, deprels
+
+    
+def find_germalemma(word, pos, spacy_lemma):
+    pos = SIMPLIFY_POS.get(pos, "UNK")
+    lemma = lemma_cache.get((word, pos), _MISSING) if lemma_cache is not None else _MISSING
+    if lemma is _MISSING:
+        try:
+            lemma = lemmatizer.find_lemma(word, pos)
+        except Exception:
+            lemma = None  # e.g. unsupported POS tag: keep the spaCy lemma
+        if lemma_cache is not None:
+            lemma_cache.put((word, pos), lemma)
+    return spacy_lemma if lemma is None else lemma
+
+
+def load_pipeline(model_name, use_dependencies="True", reuse_columns=()):
+    """
+    Load a spaCy pipeline set up for pre-tokenized CoNLL-U input.
+    
+    Args:
+        model_name: spaCy model name or path
+        use_dependencies: "True" to keep the dependency parser enabled
+        reuse_columns: CoNLL-U columns taken from the input (see parse_reuse_columns); they are
+            preset in the Docs, and components that only compute reused columns are disabled
+        
+    Returns:
+        Language: spaCy pipeline with WhitespaceTokenizer
+    """
+    global preset_columns
+    # Configure which components to disable based on dependency parsing option
+    disabled_components = ["ner"]
+    if use_dependencies != "True":
+        disabled_components.append("parser")
+    start = time.time()
+    spacy_model = spacy.load(model_name, disable=disabled_components)
+    logger.info(f"Loaded spaCy model {model_name} in {time.time() - start:.2f}s")
+    spacy_model.tokenizer = WhitespaceTokenizer(spacy_model.vocab) # We won't re-tokenize to respect how the source CoNLL are tokenized!
+    # Increase max_length to handle very long sentences (especially when parser is disabled)
+    spacy_model.max_length = 10000000  # 10M characters
+    preset_columns = tuple(column for column in REUSABLE_COLUMNS if column in reuse_columns)
+    if preset_columns:
+        disabled = _disable_reused_components(spacy_model, set(preset_columns))
+        logger.info(f"Reusing input columns {', '.join(preset_columns)}; disabled components: {', '.join(disabled) or 'none'}")
+    return spacy_model
+
+
+def _disable_reused_components(spacy_model, columns):
+    """ Disable the components whose columns are all reused, and embeddings no component listens to any more. """
+    factory = lambda name: spacy_model.get_pipe_meta(name).factory
+    disabled = [name for name in spacy_model.pipe_names if COMPONENT_COLUMNS.get(factory(name), {None}) <= columns]
+    for name in disabled:
+        spacy_model.disable_pipe(name)
+    if disabled and all(factory(name) in EMBEDDING_FACTORIES | NON_LISTENING_FACTORIES for name in spacy_model.pipe_names):
+        embeddings = [name for name in spacy_model.pipe_names if factory(name) in EMBEDDING_FACTORIES]
+        for name in embeddings:
+            spacy_model.disable_pipe(name)
+        disabled += embeddings
+    return disabled
+
+
+def load_germalemma(cache_size=DEFAULT_GERMALEMMA_CACHE_SIZE, cache_file=None):
+    """
+    Initialize the GermaLemma lemmatizer and lookup cache used by find_germalemma.
+    
+    Args:
+        cache_size: Maximum number of (word, POS) lookups to memoize (0 disables the cache)
+        cache_file: Optional file to preload the cache from (see save_germalemma_cache)
+        
+    Returns:
+        bool: True if GermaLemma is available and was loaded
+    """
+    global lemmatizer, lemma_cache
+    if not GERMALEMMA_AVAILABLE:
+        return False
+    if lemmatizer is None:
+        start = time.time()
+        from germalemma import GermaLemma
+        lemmatizer = GermaLemma()
+        logger.info(f"Loaded GermaLemma in {time.time() - start:.2f}s")
+        lemma_cache = LRUCache(cache_size) if cache_size > 0 else None
+        if lemma_cache is not None and cache_file and os.path.isfile(cache_file):
+            try:
+                lemma_cache.load(cache_file)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not preload GermaLemma cache from {cache_file}: {str(e)}")
+    return True
+
+
+def save_germalemma_cache(cache_file):
+    """ Merge the GermaLemma lookup cache into cache_file. """
+    if lemma_cache is None or not cache_file:
+        return
+    try:
+        lemma_cache.save(cache_file)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not save GermaLemma cache to {cache_file}: {str(e)}")
+
+
+def sentence_key(words):
+    """
+    Sentence cache key of a sentence (FORMs cannot contain tabs, but may contain spaces),
+    including the reused input columns of a PresetSentence.
+    """
+    key = "\t".join(words)
+    columns = getattr(words, "columns", None)
+    if columns:
+        key += "".join("\n" + "\t".join(values) for values in columns.values())
+    return key
+
+
+def load_sentence_cache(spacy_model, use_germalemma, use_dependencies, cache_size=DEFAULT_SENTENCE_CACHE_SIZE, cache_file=None,
+                        text_doc_tokens=0):
+    """
+    Initialize the cache of annotated sentences used by parse_batch and format_batch.
+    Entries are specific to the model (name, version, components) and the options,
+    so a cache file can be shared by runs with different settings.
+    
+    Args:
+        spacy_model: Pipeline returned by load_pipeline
+        use_germalemma: "True" if GermaLemma lemmas are used
+        use_dependencies: "True" if dependencies are parsed
+        cache_size: Maximum number of sentences to keep (0 disables the cache)
+        cache_file: Optional file to preload the cache from (see save_sentence_cache)
+        text_doc_tokens: text_doc_tokens option of parse_batch (annotations in text Docs depend on the context)
+    """
+    global sentence_cache, sentence_cache_key
+    if cache_size <= 0:
+        sentence_cache = sentence_cache_key = None
+        return
+    meta = spacy_model.meta
+    key_data = [meta.get("lang"), meta.get("name"), meta.get("version"), spacy.__version__, spacy_model.pipe_names,
+                use_germalemma == "True" and lemmatizer is not None, use_dependencies]
+    if text_doc_tokens > 0:
+        key_data.append(["text_docs", text_doc_tokens])
+    if preset_columns:
+        key_data.append(["reuse", list(preset_columns)])
+    sentence_cache_key = hashlib.sha1(json.dumps(key_data).encode("utf-8")).hexdigest()[:16]
+    sentence_cache = LRUCache(cache_size)
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            sentence_cache.load(cache_file, keep=lambda key: key[0] == sentence_cache_key)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not preload sentence cache from {cache_file}: {str(e)}")
+
+
+def save_sentence_cache(cache_file):
+    """ Merge the sentence cache into cache_file. """
+    if sentence_cache is None or not cache_file:
+        return
+    try:
+        sentence_cache.save(cache_file)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not save sentence cache to {cache_file}: {str(e)}")
+
+
+def get_model_meta(model_name):
+    """
+    Read the meta.json of an installed spaCy model without loading the pipeline.
+    
+    Args:
+        model_name: spaCy model name or path
+        
+    Returns:
+        dict: Model meta data, empty if it cannot be found
+    """
+    try:
+        if spacy.util.is_package(model_name):
+            return spacy.util.get_model_meta(spacy.util.get_package_path(model_name))
+        return spacy.util.get_model_meta(model_name)
+    except Exception:
+        return {}
+
+
+def parse_batch(spacy_model, annos, use_dependencies, offset=0,
+                parse_timeout=DEFAULT_PARSE_TIMEOUT, max_sentence_length=DEFAULT_MAX_SENTENCE_LENGTH,
+                parse_batch_size=DEFAULT_PARSE_BATCH_SIZE, batch_size=2000, token_budget=0, text_doc_tokens=0,
+                parse_batch_budget=DEFAULT_PARSE_BATCH_BUDGET):
+    """
+    Run the spaCy pipeline over a list of sentences.
+    
+    Args:
+        spacy_model: Pipeline returned by load_pipeline
+        annos: List of AnnotatedSentence objects
+        use_dependencies: "True" to run the dependency parser
+        offset: Number of sentences before annos in the input (for log messages)
+        parse_timeout: Maximum seconds per sentence for dependency parsing
+        max_sentence_length: Maximum sentence length for dependency parsing in tokens
+        parse_batch_size: Number of sentences per dependency parsing batch
+        batch_size: Batch size for spacy_model.pipe when dependencies are disabled
+        token_budget: Maximum number of tokens per model batch; sentences are then grouped
+            by length instead of being batched in input order (0 to disable)
+        text_doc_tokens: Annotate consecutive sentences of the same text as one Doc of up to
+            this many tokens with preset sentence boundaries, so the model sees the context
+            of neighbouring sentences (0 to annotate each sentence on its own)
+        parse_batch_budget: Maximum seconds per dependency parsing batch
+        
+    Returns:
+        tuple: (list of Docs, or of CoNLL-U token lines for sentences found in the sentence
+        cache, list of use_dependencies values per Doc, Counter of statistics)
+    """
+    # Docs are built from the FORMs directly (see make_doc), without joining and re-splitting them
+    sents = [sentence_words(a) for a in annos]
+    docs, dependency_flags = [None] * len(annos), [use_dependencies] * len(annos)
+    stats = Counter()
+    
+    # Sentences annotated before are taken from the sentence cache and skip spaCy;
+    # repeats within the batch are annotated once and share the Doc
+    todo = list(range(len(annos)))
+    repeats = {}
+    if sentence_cache is not None:
+        todo, first_ix = [], {}
+        for ix, words in enumerate(sents):
+            sent = sentence_key(words)
+            if sent in first_ix:
+                repeats[ix] = first_ix[sent]
+                continue
+            cached = sentence_cache.get((sentence_cache_key, sent))
+            if cached is None:
+                first_ix[sent] = ix
+                todo.append(ix)
+            else:
+                docs[ix] = cached
+        stats["sentence_cache_hits"] += len(annos) - len(todo)
+        stats["sentence_cache_misses"] += len(todo)
+    
+    if text_doc_tokens > 0:
+        todo = _parse_text_docs(spacy_model, annos, sents, todo, docs, use_dependencies, text_doc_tokens, parse_timeout,
+                                max_sentence_length, parse_batch_size if use_dependencies == "True" else batch_size, stats,
+                                parse_batch_budget)
+    
+    # Parse in batches with a time budget when dependency parsing is enabled (timeout protection)
+    if use_dependencies == "True":
+        parsed = safe_dependency_parse_batch(
+            spacy_model, [sents[ix] for ix in todo], timeout=parse_timeout, max_length=max_sentence_length, batch_size=parse_batch_size,
+            stats=stats, token_budget=token_budget, max_budget=parse_batch_budget
+        )
+        for ix, (doc, dependency_success, warning) in zip(todo, parsed):
+            if warning:
+                stats["dependency_warnings"] += 1
+                stats[_warning_counter(warning)] += 1
+                logger.warning(f"Sentence {offset + ix + 1}: {warning}")
+            if not dependency_success:
+                doc.user_data[_NO_CACHE] = True
+            docs[ix] = doc
+            # Override use_dependencies based on actual parsing success
+            dependency_flags[ix] = "True" if dependency_success else "False"
+    else:
+        # Use batch processing for faster processing when dependencies are disabled
+        _parse_without_dependencies(spacy_model, sents, todo, docs, offset, batch_size, token_budget,
+                                    [len(anno.tokens) for anno in annos], stats)
+    for ix, first in repeats.items():
+        docs[ix], dependency_flags[ix] = docs[first], dependency_flags[first]
+    stats["tokens"] += sum(len(anno.tokens) for anno in annos)
+    return docs, dependency_flags, stats
+
+
+def _parse_without_dependencies(spacy_model, sents, todo, docs, offset, batch_size, token_budget, lengths, stats):
+    """ Fill docs[ix] for all ix in todo with nlp.pipe, falling back to one sentence at a time on errors. """
+    try:
+        if token_budget > 0:
+            for batch in plan_batches(lengths, todo, batch_size, token_budget):
+                for ix, doc in zip(batch, timed_pipe(spacy_model, [sents[ix] for ix in batch], len(batch), stats)):
+                    docs[ix] = doc
+        else:
+            for ix, doc in zip(todo, timed_pipe(spacy_model, [sents[ix] for ix in todo], batch_size, stats)):
+                docs[ix] = doc
+    except Exception as e:
+        logger.error(f"Batch processing failed: {str(e)}")
+        logger.info("Falling back to individual sentence processing...")
+        stats["batch_fallbacks"] += 1
+        start = time.perf_counter()
+        # Fallback: process sentences individually
+        for ix in todo:
+            try:
+                docs[ix] = spacy_model(make_doc(spacy_model.vocab, sents[ix]))
+            except Exception as sent_error:
+                stats["sentence_errors"] += 1
+                logger.error(f"Failed to process sentence {offset + ix + 1}: {str(sent_error)}")
+                logger.error(f"Sentence preview: {' '.join(sents[ix])[:100]}...")
+                # Output a placeholder to maintain alignment
+                docs[ix] = spacy_model("ERROR")
+                docs[ix].user_data[_NO_CACHE] = True
+        stats["time_single_sentence"] += time.perf_counter() - start
+
+
+def _warning_counter(warning):
+    """ Statistics key for a warning of safe_dependency_parse. """
+    if warning.startswith("Sentence too long"):
+        return "parse_too_long"
+    if warning.startswith("Dependency parsing timeout"):
+        return "parse_timeouts"
+    return "parse_errors"
+
+
+def format_batch(annos, docs, dependency_flags, use_germalemma, stats=None):
+    """
+    Format parsed sentences as CoNLL-U.
+    
+    Args:
+        annos: List of AnnotatedSentence objects
+        docs: Docs (or cached token lines) for annos as returned by parse_batch
+        dependency_flags: use_dependencies value per Doc as returned by parse_batch
+        use_germalemma: "True" to replace spaCy lemmas by GermaLemma lemmas
+        stats: Optional Counter to add the GermaLemma cache statistics and stage timings to
+        
+    Returns:
+        tuple: (list of CoNLL-U strings in input order, Counter of statistics)
+    """
+    stats = Counter() if stats is None else stats
+    if lemma_cache is not None:
+        hits, misses = lemma_cache.hits, lemma_cache.misses
+    start = time.perf_counter()
+    germalemma_time = stats["time_germalemma"]
+    conll_strs = []
+    for anno, doc, flag in zip(annos, docs, dependency_flags):
+        if isinstance(doc, str):
+            # Token lines from the sentence cache, combined with this sentence's own metadata
+            token_lines = [doc] if doc else []
+        else:
+            words = sentence_words(anno)
+            token_lines = get_conll_token_lines(doc, use_germalemma=use_germalemma, use_dependencies=flag, timings=stats,
+                                                reused=getattr(words, "columns", None))
+            if sentence_cache is not None and not doc.user_data.get(_NO_CACHE):
+                sentence_cache.put((sentence_cache_key, sentence_key(words)), "\n".join(token_lines))
+        conll_strs.append("\n".join(list(anno.metadata) + token_lines))
+    # GermaLemma lookups are timed separately
+    stats["time_serialize"] += time.perf_counter() - start - (stats["time_germalemma"] - germalemma_time)
+    if lemma_cache is not None:
+        stats["germalemma_hits"] += lemma_cache.hits - hits
+        stats["germalemma_misses"] += lemma_cache.misses - misses
+    return conll_strs, stats
+
+
+def annotate_batch(spacy_model, annos, use_germalemma, use_dependencies, offset=0, output_format="conllu", **parse_options):
+    """
+    Annotate a list of sentences with spaCy and format them as CoNLL-U.
+    
+    Args:
+        spacy_model: Pipeline returned by load_pipeline
+        annos: List of AnnotatedSentence objects
+        use_germalemma: "True" to replace spaCy lemmas by GermaLemma lemmas
+        use_dependencies: "True" to include HEAD/DEPREL columns
+        offset: Number of sentences before annos in the input (for log messages)
+        output_format: "conllu", "docbin" to serialize the Docs instead (see docbin_stream.encode_docbin), or
+            "korap" to format them for KorAP morpho.xml layers (see korap_xml.format_korap_batch)
+        parse_options: Further keyword arguments for parse_batch
+        
+    Returns:
+        tuple: (list of CoNLL-U strings in input order, a DocBinBatch or a list of KorapSentences, Counter of statistics)
+    """
+    docs, dependency_flags, stats = parse_batch(spacy_model, annos, use_dependencies, offset=offset, **parse_options)
+    if output_format == "docbin":
+        from lib.docbin_stream import encode_docbin
+        return encode_docbin(annos, docs, dependency_flags, stats=stats)
+    if output_format == "korap":
+        from lib.korap_xml import format_korap_batch
+        return format_korap_batch(annos, docs, dependency_flags, use_germalemma, stats=stats)
+    return format_batch(annos, docs, dependency_flags, use_germalemma, stats=stats)
@@ -0,0 +1,76 @@
+import json, logging, threading
+import os, fcntl
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache():
+    """
+    Bounded mapping that evicts the least recently used entry and counts hits and misses.
+    Keys must be strings or tuples of strings, values JSON-serializable, so the cache
+    can be saved to and preloaded from disk. Safe to share between threads (in pipeline mode,
+    the sentence cache is read by the annotating thread and filled by the writer thread).
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0: return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def load(self, path, keep=None):
+        """
+        Preload entries saved by save(), keeping at most max_size of them
+        (and only those whose key satisfies keep, if given).
+        """
+        for key, value in _read_items(path):
+            if keep is None or keep(key):
+                self.put(key, value)
+        logger.info(f"Preloaded {len(self)} cache entries from {path}")
+
+    def save(self, path):
+        """
+        Save the cache to path. Entries already in the file are merged in (ours take
+        precedence), so several processes can share one cache file.
+        """
+        with open(f"{path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = OrderedDict(_read_items(path) if os.path.isfile(path) else [])
+            with self._lock:
+                items = list(self._items.items())
+            for key, value in items:
+                merged[key] = value
+                merged.move_to_end(key)
+            items = list(merged.items())[-self.max_size:] if self.max_size > 0 else []
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as out:
+                json.dump([[list(key) if isinstance(key, tuple) else key, value] for key, value in items], fp=out, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+
+def _read_items(path):
+    with open(path, encoding="utf8") as f:
+        return [(tuple(key) if isinstance(key, list) else key, value) for key, value in json.load(f)]
@@ -0,0 +1,115 @@
+import json, logging, os, time
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+
+
+def run_identity(input_file, output_file, **settings):
+    """
+    Describe a run for its checkpoint: input and output files plus the settings that change
+    the output. A checkpoint is only resumed by a run with the same identity.
+
+    Args:
+        input_file: Input file, or None (or "-") for stdin
+        output_file: Output file
+        settings: Further options (model, GermaLemma, dependencies, ...)
+
+    Returns:
+        dict: JSON-serializable identity
+    """
+    identity = {"input_file": "-" if input_file in (None, "-") else os.path.abspath(input_file),
+                "output_file": os.path.abspath(output_file), **settings}
+    if identity["input_file"] != "-":
+        # A changed input file must not be resumed at a sentence count of its old version
+        stat = os.stat(input_file)
+        identity.update(input_size=stat.st_size, input_mtime=int(stat.st_mtime))
+    return identity
+
+
+class Checkpoint():
+    """
+    Progress of a long run: the number of input sentences whose annotation has been written,
+    and the length of the output file at that point. It is only updated after a batch has
+    been written completely and synced to disk, so a later run can truncate the output to
+    that length and skip exactly that many input sentences, without duplicating or dropping
+    sentences at the resume boundary. The file is replaced atomically.
+    """
+    def __init__(self, path, identity, interval=60):
+        """
+        Args:
+            path: Checkpoint file (JSON)
+            identity: Run identity (see run_identity) stored in and compared with the checkpoint
+            interval: Minimum number of seconds between two updates
+        """
+        self.path = path
+        self.identity = identity
+        self.interval = interval
+        self.sentences = 0
+        self.output_offset = 0
+        self.complete = False
+        self._last_time = time.time()
+
+    def load(self):
+        """
+        Read the checkpoint left by an earlier run, if any.
+
+        Returns:
+            bool: True if there is progress to resume (see sentences, output_offset and complete)
+
+        Raises:
+            ValueError: If the checkpoint is unreadable or was written by a run with a different identity
+        """
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Could not read checkpoint {self.path}: {str(e)}")
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Checkpoint {self.path} has version {state.get('version')}, expected {CHECKPOINT_VERSION}")
+        run = state.get("run", {})
+        differences = sorted(key for key in set(run) | set(self.identity) if run.get(key) != self.identity.get(key))
+        if differences:
+            raise ValueError(f"Checkpoint {self.path} was written by a run with different {', '.join(differences)}; "
+                             f"remove it to start over")
+        self.sentences = state["sentences"]
+        self.output_offset = state["output_offset"]
+        self.complete = state.get("complete", False)
+        return True
+
+    def maybe_update(self, sentences, output):
+        """ Update the checkpoint if at least interval seconds passed since the last update. """
+        if time.time() - self._last_time >= self.interval:
+            self.update(sentences, output)
+
+    def update(self, sentences, output, complete=False):
+        """
+        Record that the first sentences input sentences are written to output.
+
+        Args:
+            sentences: Number of input sentences written, including those of resumed runs
+            output: Uncompressed output file stream, with all of these sentences written
+            complete: Whether the whole input has been processed
+        """
+        output.flush()
+        self.output_offset = output.buffer.tell()
+        # The checkpoint must never refer to output that a crash could still lose
+        os.fsync(output.fileno())
+        self.sentences = sentences
+        self.complete = complete
+        state = {"version": CHECKPOINT_VERSION, "run": self.identity, "sentences": sentences,
+                 "output_offset": self.output_offset, "complete": complete,
+                 "updated": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as out:
+                json.dump(state, out, indent=2)
+                out.write("\n")
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write checkpoint {self.path}: {str(e)}")
+        self._last_time = time.time()
@@ -0,0 +1,144 @@
+import logging, os, sys
+
+logger = logging.getLogger(__name__)
+
+# Thread pool sizes of OpenMP and the BLAS libraries NumPy/thinc may be linked against. They are
+# read when a library is loaded, so they must be set before numpy is imported (or a worker started).
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS",
+                   "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+NUMA_NODE_DIR = "/sys/devices/system/node"
+
+
+def set_thread_env(n_threads):
+    """
+    Set the thread pool size of OpenMP and the BLAS libraries for this process and all processes
+    it starts later. Call it before numpy is imported.
+
+    Args:
+        n_threads: Threads per process (None, "" or 0 keeps the library defaults)
+
+    Returns:
+        int: The number of threads set, 0 if unchanged
+    """
+    n_threads = int(n_threads or 0)
+    if n_threads > 0:
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(n_threads)
+        # PyTorch (spacy-transformers) sizes its own pool; only adjust it if it is already loaded
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(n_threads)
+    return n_threads
+
+
+def parse_cpu_list(value):
+    """ Parse a Linux CPU list such as "0-3,8,10-11" into a sorted list of CPU numbers. """
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def numa_nodes():
+    """ CPUs of each NUMA node, by node number ({0: all CPUs} without NUMA information). """
+    nodes = {}
+    try:
+        for entry in os.listdir(NUMA_NODE_DIR):
+            if entry.startswith("node") and entry[4:].isdigit():
+                with open(os.path.join(NUMA_NODE_DIR, entry, "cpulist")) as f:
+                    nodes[int(entry[4:])] = parse_cpu_list(f.read())
+    except OSError:
+        pass
+    return {node: cpus for node, cpus in sorted(nodes.items()) if cpus} or {0: sorted(os.sched_getaffinity(0))}
+
+
+def parse_affinity(spec):
+    """
+    Parse SPACY_CPU_AFFINITY into the CPU sets workers are pinned to.
+
+    Args:
+        spec: "numa" (every NUMA node), "numa:0,1" (these nodes) or a CPU list such as "0-7,16-23"
+
+    Returns:
+        tuple: ("numa", list of CPU lists, one per node) or ("cpus", CPU list)
+
+    Raises:
+        ValueError: For unknown NUMA nodes, CPUs this process may not use, or an empty set
+    """
+    allowed = os.sched_getaffinity(0)
+    if spec.startswith("numa"):
+        nodes = numa_nodes()
+        _, _, selected = spec.partition(":")
+        numbers = [int(node) for node in selected.split(",") if node.strip()] if selected else list(nodes)
+        unknown = [node for node in numbers if node not in nodes]
+        if unknown:
+            raise ValueError(f"Unknown NUMA nodes {unknown}, available: {sorted(nodes)}")
+        sets = [[cpu for cpu in nodes[node] if cpu in allowed] for node in numbers]
+        if not all(sets):
+            raise ValueError(f"No usable CPUs on NUMA nodes {[node for node, cpus in zip(numbers, sets) if not cpus]}")
+        return "numa", sets
+    cpus = parse_cpu_list(spec)
+    if not cpus:
+        raise ValueError("Empty CPU list")
+    unavailable = [cpu for cpu in cpus if cpu not in allowed]
+    if unavailable:
+        raise ValueError(f"CPUs {unavailable} are not available to this process (allowed: {format_cpu_list(allowed)})")
+    return "cpus", cpus
+
+
+def worker_cpus(affinity, worker_index, n_workers):
+    """
+    CPUs of one worker: with NUMA nodes, workers are spread over the nodes round-robin and share
+    the CPUs of their node; with a CPU list, each worker gets its own contiguous slice of it
+    (slices are shared when there are more workers than CPUs).
+
+    Args:
+        affinity: Result of parse_affinity
+        worker_index: 0-based worker number
+        n_workers: Number of workers
+
+    Returns:
+        list: CPU numbers
+    """
+    kind, cpus = affinity
+    if kind == "numa":
+        return cpus[worker_index % len(cpus)]
+    if n_workers <= 1:
+        return cpus
+    if n_workers > len(cpus):
+        return [cpus[worker_index % len(cpus)]]
+    size = len(cpus) // n_workers
+    start = worker_index * size
+    # The last worker also takes the CPUs left over by the division
+    return cpus[start:start + size] if worker_index < n_workers - 1 else cpus[start:]
+
+
+def pin_process(cpus):
+    """ Restrict this process (and threads and processes it starts later) to the given CPUs. """
+    os.sched_setaffinity(0, cpus)
+
+
+def format_cpu_list(cpus):
+    """ Format CPU numbers as a Linux CPU list, e.g. [0, 1, 2, 3, 8] -> "0-3,8". """
+    ranges, cpus = [], sorted(cpus)
+    for cpu in cpus:
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def thread_settings():
+    """ Effective thread and CPU settings of this process, for the startup log. """
+    settings = {name: os.environ[name] for name in THREAD_ENV_VARS if name in os.environ}
+    settings["cpus"] = format_cpu_list(os.sched_getaffinity(0))
+    try:
+        from threadpoolctl import threadpool_info
+        settings["thread_pools"] = ", ".join(f"{pool['internal_api']}={pool['num_threads']}" for pool in threadpool_info())
+    except ImportError:
+        pass
+    return settings
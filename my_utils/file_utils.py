@@ -1,11 +1,26 @@
 import requests, logging, json
-import subprocess, time
-import glob, logging
 import os.path, sys
-from lib.CoNLL_Annotation import read_conll, read_conll_generator
+import io, gzip, bz2, lzma, shutil, zlib
+from lib.CoNLL_Annotation import read_conll, take_sentences
+
+# zstd support is optional (the zstandard package is not part of the standard library)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+    zstandard = None
 
 logger = logging.getLogger(__name__)
 
+# Leading bytes of the supported compressed formats
+COMPRESSION_MAGIC = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd", "bz2": b"BZh", "xz": b"\xfd7zXZ\x00"}
+COMPRESSIONS = ["none"] + list(COMPRESSION_MAGIC)
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "bz2": ".bz2", "xz": ".xz"}
+OUTPUT_BUFFER_SIZE = 1024 * 1024  # bytes
+SIZE_SAMPLE_BYTES = 256 * 1024  # compressed bytes decompressed to estimate the size of a compressed file
+SHARD_MANIFEST_SUFFIX = ".shard.json"  # written next to the output of a shard, read by systems/merge_shards.py
+
 
 def list_to_file(my_list, out_path):
     with open(out_path, "w") as out:
@@ -53,6 +68,25 @@ def get_file_annos_chunk(line_generator, chunk_size, token_class, comment_str="#
     return chunk, file_has_next
 
 
+def batch_sentences(sentences, batch_size, budget=None):
+    """
+    Group a stream of sentences (e.g. from read_conll_stream) into lists of at most batch_size.
+    
+    Args:
+        sentences: Iterable of AnnotatedSentence objects
+        batch_size: Maximum number of sentences per batch
+        budget: Optional object with a max_tokens attribute (e.g. my_utils.memory_utils.TokenBudget)
+            that additionally limits the number of tokens per batch; it is read for every new
+            batch, so the limit can be adjusted while batches are consumed
+    """
+    sentences = iter(sentences)
+    held_back = []
+    while True:
+        batch = take_sentences(sentences, batch_size, max_tokens=budget.max_tokens if budget is not None else 0, held_back=held_back)
+        if not batch: return
+        yield batch
+
+
 def get_file_text_chunk(line_generator, chunk_size, token_class, comment_str="###C:"):
     """ Same as get_file_annos_chunk but directly get (text, labels) pairs"""
     file_has_next = True
@@ -98,27 +132,221 @@ def response_to_file(response_str, fname):
 
 
 def expand_file(f, substitute_comment=False):
-    # Expand the .gz file
+    # Expand the .gz file (prefer open_input, which decompresses on the fly without a temporary file)
     fname = f[:-3]
     if not os.path.isfile(fname): 
-        p = subprocess.call(f"gunzip -c {f} > {fname}", shell=True)
-        if p == 0:
+        try:
+            with gzip.open(f, "rb") as compressed, open(fname, "wb") as out:
+                shutil.copyfileobj(compressed, out, OUTPUT_BUFFER_SIZE)
             logger.info("Successfully uncompressed file")
-        else:
+        except OSError:
             logger.info(f"Couldn't expand file {f}")
-            raise Exception
+            raise
     else:
         logger.info(f"File {fname} is already uncompressed. Skipping this step...")
     
     # Substitute the Commentary Lines on the Expanded file
     if substitute_comment:
         fixed_filename = f"{fname}.fixed"
-        p = subprocess.call(f"sed 's/^# /###C: /g' {fname}", shell=True, stdout=open(fixed_filename, "w")) # stdout=subprocess.PIPE
-        if p == 0:
+        try:
+            with open(fname, encoding="utf8") as expanded, open(fixed_filename, "w", encoding="utf8") as out:
+                for line in expanded:
+                    out.write("###C: " + line[2:] if line.startswith("# ") else line)
             logger.info("Successfully fixed comments on file")
-        else:
+        except OSError:
             logger.info(f"Something went wrong when substituting commentaries")
-            raise Exception    
+            raise
         return fixed_filename
     else:
         return fname
+
+
+class _PrefixedReader(io.RawIOBase):
+    """ Raw stream that returns already consumed prefix bytes before the rest of stream. """
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+        super().close()
+
+    def readinto(self, buffer):
+        if self._prefix:
+            n = min(len(buffer), len(self._prefix))
+            buffer[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        data = self._stream.read1(len(buffer)) if hasattr(self._stream, "read1") else self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _RangeReader(io.RawIOBase):
+    """ Raw stream over the bytes from start to end of a seekable binary file. """
+    def __init__(self, stream, start, end):
+        stream.seek(start)
+        self._stream = stream
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+        super().close()
+
+    def readinto(self, buffer):
+        data = self._stream.read(min(len(buffer), self._remaining))
+        self._remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def detect_compression(header):
+    for compression, magic in COMPRESSION_MAGIC.items():
+        if header.startswith(magic):
+            return compression
+    return "none"
+
+
+def _decompressor(compression):
+    if compression == "gzip":
+        return zlib.decompressobj(wbits=31)
+    if compression == "bz2":
+        return bz2.BZ2Decompressor()
+    if compression == "xz":
+        return lzma.LZMADecompressor()
+    if compression == "zstd" and ZSTD_AVAILABLE:
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+def estimate_uncompressed_size(path, sample_size=SIZE_SAMPLE_BYTES):
+    """
+    Estimate the uncompressed size of a file: its size if uncompressed, else its compressed
+    size times the compression ratio of its first sample_size bytes (bz2 decompresses whole
+    blocks, so up to 4 * sample_size bytes are read until there is output). Decompressors hold
+    back up to a block of output, so the estimate is rough, but good enough to order files by
+    the amount of text they hold. Falls back to the compressed size if the sample cannot be
+    decompressed.
+    
+    Returns:
+        int: Estimated size in bytes
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.read(max(len(magic) for magic in COMPRESSION_MAGIC.values()))
+        decompressor = _decompressor(detect_compression(header))
+        if decompressor is None:
+            return size
+        f.seek(0)
+        consumed = produced = 0
+        try:
+            while consumed < 4 * sample_size and (consumed < sample_size or produced == 0):
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                consumed += len(chunk)
+                produced += len(decompressor.decompress(chunk))
+        except Exception as e:
+            # A corrupt input is reported when it is read; only the order of the files depends on this
+            logger.debug(f"Could not estimate the uncompressed size of {path}: {str(e)}")
+            return size
+    return int(size * produced / consumed) if produced > 0 else size
+
+
+def open_input(path=None, byte_range=None):
+    """
+    Open a CoNLL-U input for streaming text reading, decompressing gzip, zstd, bz2 or xz
+    on the fly. The format is recognized by its magic bytes, not by the file name.
+    
+    Args:
+        path: Input file, binary file object, or None (or "-") for stdin
+        byte_range: Only read the bytes from start to end of an uncompressed input file,
+            given as (start, end) tuple
+        
+    Returns:
+        Text stream (utf-8)
+    """
+    if byte_range is not None:
+        binary = open(path, "rb")
+        if detect_compression(binary.read(max(len(magic) for magic in COMPRESSION_MAGIC.values()))) != "none":
+            binary.close()
+            raise ValueError(f"Byte ranges of compressed input {path} cannot be read; decompress it first")
+        return io.TextIOWrapper(io.BufferedReader(_RangeReader(binary, *byte_range), buffer_size=OUTPUT_BUFFER_SIZE), encoding="utf-8")
+    if hasattr(path, "read"):
+        binary = path
+    elif path in (None, "-"):
+        # A separate reader on the file descriptor, so closing the input does not close sys.stdin
+        binary = open(sys.stdin.fileno(), "rb", closefd=False)
+    else:
+        binary = open(path, "rb")
+    header = binary.read(max(len(magic) for magic in COMPRESSION_MAGIC.values()))
+    binary = io.BufferedReader(_PrefixedReader(header, binary), buffer_size=OUTPUT_BUFFER_SIZE)
+    compression = detect_compression(header)
+    if compression != "none":
+        logger.info(f"Reading {compression} compressed input")
+    if compression == "gzip":
+        binary = gzip.GzipFile(fileobj=binary, mode="rb")
+    elif compression == "bz2":
+        binary = bz2.BZ2File(binary, mode="rb")
+    elif compression == "xz":
+        binary = lzma.LZMAFile(binary, mode="rb")
+    elif compression == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("Input is zstd compressed, but the zstandard package is not installed")
+        binary = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(binary, read_across_frames=True), buffer_size=OUTPUT_BUFFER_SIZE)
+    return io.TextIOWrapper(binary, encoding="utf-8")
+
+
+def open_output(path=None, compression="none", resume_offset=None):
+    """
+    Open a CoNLL-U output for writing, optionally compressed.
+    
+    Args:
+        path: Output file, or None (or "-") for stdout
+        compression: One of COMPRESSIONS
+        resume_offset: Keep the first resume_offset bytes of an existing, uncompressed output
+            file and append after them instead of truncating it
+        
+    Returns:
+        Text stream (utf-8); close it to write the end of the compressed stream (stdout stays open)
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}, expected one of {', '.join(COMPRESSIONS)}")
+    if resume_offset is not None:
+        if path in (None, "-") or compression != "none":
+            raise ValueError("Only an uncompressed output file can be resumed")
+        binary = open(path, "r+b", buffering=OUTPUT_BUFFER_SIZE)
+        if binary.seek(0, io.SEEK_END) < resume_offset:
+            binary.close()
+            raise ValueError(f"Output file {path} is shorter than the {resume_offset} bytes to resume after")
+        # Drop whatever an interrupted run wrote after the last complete batch
+        binary.truncate(resume_offset)
+        binary.seek(resume_offset)
+        return io.TextIOWrapper(binary, encoding="utf-8")
+    binary = open(sys.stdout.fileno() if path in (None, "-") else path, "wb", buffering=OUTPUT_BUFFER_SIZE,
+                  closefd=path not in (None, "-"))
+    if compression == "gzip":
+        binary = gzip.GzipFile(fileobj=binary, mode="wb")
+    elif compression == "bz2":
+        binary = bz2.BZ2File(binary, mode="wb")
+    elif compression == "xz":
+        binary = lzma.LZMAFile(binary, mode="wb")
+    elif compression == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("zstd output requested, but the zstandard package is not installed")
+        binary = zstandard.ZstdCompressor().stream_writer(binary)
+    return io.TextIOWrapper(binary, encoding="utf-8")
+
+
+def write_conll_batch(out, conll_strs):
+    """ Write a batch of CoNLL-U sentences with one write call and flush it downstream. """
+    out.write("".join(f"{conll_str}\n\n" for conll_str in conll_strs))
+    out.flush()
@@ -0,0 +1,59 @@
+import logging
+from my_utils.metrics_utils import rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBudget():
+    """
+    Token limit for the batches read by file_utils.batch_sentences.
+    
+    With a memory limit, adjust() compares the resident set size (of this process and
+    any worker processes) with the limit after each batch: above the limit, the token
+    limit is halved (down to min_tokens); well below it, a limit that (nearly) filled the
+    last batch is raised again by a quarter (up to max_tokens, if set). Since freed
+    memory is not always returned to the system, RSS may stay high after a spike; the
+    limit then stays at min_tokens, which keeps further growth small.
+    """
+    def __init__(self, max_tokens=0, memory_limit=0, min_tokens=1000, worker_pids=None):
+        """
+        Args:
+            max_tokens: Initial (and maximum) number of tokens per batch, 0 for no limit
+            memory_limit: RSS limit in bytes, 0 for a fixed token limit
+            min_tokens: Lower bound of the token limit when it is lowered
+            worker_pids: Optional callable returning the PIDs of worker processes to include in RSS
+        """
+        self.max_tokens = max_tokens
+        self.memory_limit = memory_limit
+        self.min_tokens = min_tokens
+        self.worker_pids = worker_pids
+        self._ceiling = max_tokens
+
+    def rss(self):
+        return rss_bytes() + (sum(rss_bytes(pid) for pid in self.worker_pids()) if self.worker_pids else 0)
+
+    def adjust(self, batch_tokens):
+        """
+        Update the token limit after a batch of batch_tokens tokens has been processed.
+        
+        Returns:
+            int: Resident set size in bytes (0 without memory limit)
+        """
+        if self.memory_limit <= 0:
+            return 0
+        rss = self.rss()
+        if rss > self.memory_limit:
+            lowered = max(self.min_tokens, (self.max_tokens or batch_tokens) // 2)
+            if self.max_tokens == 0 or lowered < self.max_tokens:
+                logger.info(f"RSS {rss / 2**20:.0f} MiB above memory limit of {self.memory_limit / 2**20:.0f} MiB: "
+                            f"reducing batches to {lowered} tokens")
+                self.max_tokens = lowered
+        elif rss < 0.6 * self.memory_limit and self.max_tokens > 0 and batch_tokens >= 0.9 * self.max_tokens:
+            # A batch cut short by the limit stays below it by less than the sentence held back for the next one
+            raised = int(self.max_tokens * 1.25)
+            if self._ceiling > 0:
+                raised = min(raised, self._ceiling)
+            if raised > self.max_tokens:
+                logger.info(f"RSS {rss / 2**20:.0f} MiB: raising batches to {raised} tokens")
+                self.max_tokens = raised
+        return rss
@@ -0,0 +1,140 @@
+import json, logging, os, resource, time
+
+logger = logging.getLogger(__name__)
+
+# Statistics keys (see lib/spacy_annotation.py) exported as counters besides sentences, tokens and stage timings
+COUNTERS = ["dependency_warnings", "parse_timeouts", "parse_too_long", "parse_errors", "parse_bisections",
+            "batch_fallbacks", "sentence_errors", "germalemma_hits", "germalemma_misses",
+            "sentence_cache_hits", "sentence_cache_misses", "text_doc_fallbacks"]
+METRICS_FORMATS = ["jsonl", "prometheus"]
+
+
+def timed_iter(iterable, stats, key):
+    """ Yield from iterable, adding the seconds spent waiting for each item to stats[key]. """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stats[key] += time.perf_counter() - start
+            return
+        stats[key] += time.perf_counter() - start
+        yield item
+
+
+def rss_bytes(pid="self"):
+    """ Current resident set size of a process in bytes (0 if it cannot be read). """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss_bytes():
+    """ Peak resident set size of this process in bytes. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+
+
+class MetricsWriter():
+    """
+    Periodically writes the run statistics to a file, either appending one JSON object
+    per interval (jsonl) or replacing a Prometheus textfile (for the node_exporter
+    textfile collector). Stage timings are the "time_<stage>" keys of the statistics;
+    with several worker processes they are summed over all workers.
+    """
+    def __init__(self, path, metrics_format=None, interval=60, labels=None, worker_pids=None):
+        """
+        Args:
+            path: Output file
+            metrics_format: "jsonl" or "prometheus" (default: prometheus for *.prom files, else jsonl)
+            interval: Minimum number of seconds between two writes
+            labels: dict of labels added to every metric (e.g. corpus name)
+            worker_pids: Optional callable returning the PIDs of worker processes to include in RSS
+        """
+        if metrics_format is None:
+            metrics_format = "prometheus" if path.endswith(".prom") else "jsonl"
+        if metrics_format not in METRICS_FORMATS:
+            raise ValueError(f"Unknown metrics format {metrics_format}, expected one of {', '.join(METRICS_FORMATS)}")
+        self.path = path
+        self.metrics_format = metrics_format
+        self.interval = interval
+        self.labels = labels or {}
+        self.worker_pids = worker_pids
+        self.start = time.time()
+        self._last_time = self.start
+        self._last_sentences = 0
+        self._last_tokens = 0
+        if metrics_format == "jsonl":
+            # Start a fresh file for this run
+            open(path, "w").close()
+
+    def maybe_write(self, stats):
+        """ Write the metrics if at least interval seconds passed since the last write. """
+        if time.time() - self._last_time >= self.interval:
+            self.write(stats)
+
+    def write(self, stats, final=False):
+        now = time.time()
+        record = self._record(stats, now)
+        record["final"] = final
+        try:
+            if self.metrics_format == "jsonl":
+                with open(self.path, "a", encoding="utf-8") as out:
+                    out.write(json.dumps(record) + "\n")
+            else:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as out:
+                    out.write(self._prometheus(record))
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.path}: {str(e)}")
+        self._last_time = now
+        self._last_sentences = record["sentences"]
+        self._last_tokens = record["tokens"]
+
+    def _record(self, stats, now):
+        elapsed = now - self.start
+        interval = max(now - self._last_time, 1e-9)
+        sentences, tokens = stats["sentences"], stats["tokens"]
+        workers_rss = sum(rss_bytes(pid) for pid in self.worker_pids()) if self.worker_pids else 0
+        return {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(now)),
+            **self.labels,
+            "elapsed_seconds": round(elapsed, 3),
+            "sentences": sentences,
+            "tokens": tokens,
+            "sents_per_sec": round(sentences / elapsed, 1) if elapsed > 0 else 0,
+            "tokens_per_sec": round(tokens / elapsed, 1) if elapsed > 0 else 0,
+            "interval_sents_per_sec": round((sentences - self._last_sentences) / interval, 1),
+            "interval_tokens_per_sec": round((tokens - self._last_tokens) / interval, 1),
+            "stage_seconds": {key[len("time_"):]: round(value, 3) for key, value in sorted(stats.items()) if key.startswith("time_")},
+            "counters": {key: stats[key] for key in COUNTERS},
+            "rss_bytes": rss_bytes(),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "workers_rss_bytes": workers_rss,
+        }
+
+    def _prometheus(self, record):
+        def metric(name, kind, help_text, values):
+            lines = [f"# HELP spacy_{name} {help_text}", f"# TYPE spacy_{name} {kind}"]
+            for extra_labels, value in values:
+                labels = ",".join(f'{key}="{value}"' for key, value in {**self.labels, **extra_labels}.items())
+                lines.append(f"spacy_{name}{{{labels}}} {value}" if labels else f"spacy_{name} {value}")
+            return "\n".join(lines) + "\n"
+
+        return "".join([
+            metric("sentences_total", "counter", "Sentences annotated", [({}, record["sentences"])]),
+            metric("tokens_total", "counter", "Tokens annotated", [({}, record["tokens"])]),
+            metric("tokens_per_second", "gauge", "Tokens per second in the last interval", [({}, record["interval_tokens_per_sec"])]),
+            metric("sentences_per_second", "gauge", "Sentences per second in the last interval", [({}, record["interval_sents_per_sec"])]),
+            metric("stage_seconds_total", "counter", "Seconds spent per processing stage (summed over workers)",
+                   [({"stage": stage}, value) for stage, value in record["stage_seconds"].items()]),
+            metric("events_total", "counter", "Fallbacks, timeouts and cache lookups",
+                   [({"event": event}, value) for event, value in record["counters"].items()]),
+            metric("rss_bytes", "gauge", "Resident set size of the main process", [({}, record["rss_bytes"])]),
+            metric("workers_rss_bytes", "gauge", "Resident set size of all worker processes", [({}, record["workers_rss_bytes"])]),
+            metric("elapsed_seconds", "gauge", "Seconds since the start of the run", [({}, record["elapsed_seconds"])]),
+            metric("last_update_timestamp_seconds", "gauge", "Time of this update", [({}, round(time.time(), 3))]),
+        ])
@@ -0,0 +1,70 @@
+import logging, queue, threading
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class _Failure():
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, maxsize, name="reader"):
+    """
+    Consume iterable in a background thread and yield its items through a bounded queue,
+    so producing the next items overlaps with processing the current one.
+    Exceptions of the producer are re-raised in the consumer.
+    """
+    items = queue.Queue(maxsize)
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as e:
+            items.put(_Failure(e))
+            return
+        items.put(_END)
+
+    threading.Thread(target=produce, name=name, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is _END: return
+        if isinstance(item, _Failure): raise item.error
+        yield item
+
+
+class PipelineStage():
+    """
+    Background thread that calls func on every item put into a bounded queue.
+    put() blocks while the queue is full, which keeps earlier stages from running ahead.
+    """
+    def __init__(self, func, maxsize, name="writer"):
+        self._func = func
+        self._items = queue.Queue(maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._items.get()
+            if item is _END: return
+            if self._error is not None: continue  # Drain the queue after a failure
+            try:
+                self._func(item)
+            except BaseException as e:
+                self._error = e
+
+    def put(self, item):
+        if self._error is not None: raise self._error
+        self._items.put(item)
+
+    def close(self):
+        """ Wait until all items are processed; re-raises an exception of func. """
+        self._items.put(_END)
+        self._thread.join()
+        if self._error is not None: raise self._error
@@ -0,0 +1,159 @@
+import cProfile, logging, os, sys, threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# "sample": stack samples of all threads, written as collapsed stacks (flamegraph.pl, speedscope);
+# "cprofile": deterministic profile of the annotating thread, written as a pstats dump
+PROFILE_MODES = ["sample", "cprofile"]
+DEFAULT_SAMPLE_INTERVAL = 0.005  # seconds
+
+
+def parse_chunk_window(value):
+    """ Parse a window of chunk numbers such as "5-20" (1-based, inclusive) or "7" into (first, last). """
+    first, _, last = value.partition("-")
+    first, last = int(first), int(last or first)
+    if first < 1 or last < first:
+        raise ValueError(f"Invalid chunk window {value}, expected FIRST-LAST with 1 <= FIRST <= LAST")
+    return first, last
+
+
+class StackSampler():
+    """
+    Samples the Python stacks of all other threads of the process every interval seconds from a
+    background thread and counts them as collapsed stacks ("outer;inner;leaf count").
+    """
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = None
+        self._thread = None
+
+    def start(self):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = names.get(code)
+                    if label is None:
+                        label = names[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    frames.append(label)
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as out:
+            for stack, count in self.stacks.most_common():
+                out.write(f"{stack} {count}\n")
+
+
+class ChunkProfiler():
+    """
+    Profiles selected chunks (annotation batches) of a run: a window of chunk numbers, or every
+    Nth chunk. The profile of all chunks profiled so far is written whenever profiling stops
+    (after each run of consecutive profiled chunks), so it can be inspected while a long run
+    continues. Nothing is sampled or traced outside the selected chunks.
+    """
+    def __init__(self, path_prefix, mode="sample", window=None, every=0, interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        Args:
+            path_prefix: Output path without suffix; ".<pid>.collapsed" or ".<pid>.prof" is appended
+            mode: One of PROFILE_MODES
+            window: (first, last) chunk numbers to profile (1-based, inclusive), or None
+            every: Profile every Nth chunk (used if no window is given; 0 or 1 profiles every chunk)
+            interval: Seconds between two stack samples (sample mode)
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode}, expected one of {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.window = window
+        self.every = max(1, every)
+        suffix = "collapsed" if mode == "sample" else "prof"
+        self.path = f"{path_prefix}.{os.getpid()}.{suffix}"
+        self.chunks = 0  # number of chunks profiled
+        self._profiler = StackSampler(interval) if mode == "sample" else cProfile.Profile()
+        self._active = False
+
+    def wants(self, chunk):
+        """ Whether the 1-based chunk number is profiled. """
+        if self.window is not None:
+            return self.window[0] <= chunk <= self.window[1]
+        return chunk % self.every == 0
+
+    def start(self, chunk):
+        """ Start profiling if chunk is selected (profiling continues over consecutive selected chunks). """
+        if not self.wants(chunk):
+            return
+        if not self._active:
+            if self.mode == "cprofile":
+                self._profiler.enable()
+            else:
+                self._profiler.start()
+            self._active = True
+
+    def stop(self):
+        """ Stop profiling and write the profile so far. """
+        if self._active:
+            if self.mode == "cprofile":
+                self._profiler.disable()
+            else:
+                self._profiler.stop()
+            self._active = False
+            self.write()
+
+    def profile(self, chunk, func, *args, **kwargs):
+        """ Call func, profiling the call if chunk is selected. """
+        self.start(chunk)
+        self.chunks += self._active
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stop()
+
+    def wrap(self, jobs):
+        """
+        Iterate over jobs (one per chunk), profiling the selected chunks from the start of
+        producing a job until the next one is requested, i.e. including the consumer's work on it.
+        """
+        iterator = iter(jobs)
+        chunk = 1
+        try:
+            while True:
+                if self.wants(chunk):
+                    self.start(chunk)
+                else:
+                    self.stop()
+                try:
+                    job = next(iterator)
+                except StopIteration:
+                    return
+                self.chunks += self._active
+                yield job
+                chunk += 1
+        finally:
+            self.stop()
+
+    def write(self):
+        try:
+            if self.mode == "cprofile":
+                self._profiler.dump_stats(self.path)
+            else:
+                self._profiler.write(self.path)
+        except OSError as e:
+            logger.warning(f"Could not write profile {self.path}: {str(e)}")
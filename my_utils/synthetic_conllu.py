@@ -0,0 +1,106 @@
+import random
+from itertools import accumulate
+
+# Frequent German word forms; sampled with Zipf-distributed frequencies, so that caches and
+# vocabulary lookups see a realistic mix of repeated and rare tokens
+COMMON_WORDS = [
+    "der", "die", "und", "in", "den", "von", "zu", "das", "mit", "sich", "des", "auf", "für", "ist",
+    "im", "dem", "nicht", "ein", "eine", "als", "auch", "es", "an", "werden", "aus", "er", "hat",
+    "dass", "sie", "nach", "wird", "bei", "einer", "um", "am", "sind", "noch", "wie", "einem",
+    "über", "einen", "so", "zum", "war", "haben", "nur", "oder", "aber", "vor", "zur", "bis",
+    "mehr", "durch", "man", "sein", "wurde", "sei", "Prozent", "hatte", "kann", "gegen", "vom",
+    "können", "schon", "wenn", "habe", "seine", "Mark", "ihre", "dann", "unter", "wir", "soll",
+    "ich", "eines", "Jahr", "zwei", "Jahren", "diese", "dieser", "wieder", "keine", "Uhr",
+    "seiner", "worden", "will", "zwischen", "immer", "Millionen", "was", "sagte", "gibt", "alle",
+    "seit", "muss", "doch", "jetzt", "drei", "neue", "damit", "bereits", "da", "ab", "ihr",
+    "ohne", "sollen", "Frau", "Stadt", "Kinder", "Haus", "Regierung", "Zeit", "Menschen",
+    "große", "kleinen", "schnell", "gestern", "heute", "laut", "Hund", "Katze", "gelesen",
+    "geschrieben", "gegangen", "sagen", "machen", "gehen", "kommen", "sehen", "Arbeit",
+    "Land", "Welt", "Geld", "Schule", "Leben", "Beispiel", "Ende", "Teil", "Fall", "Recht",
+]
+PUNCTUATION = [",", ".", "?", "!", ":", ";", "(", ")", "\"", "-"]
+SYLLABLES = ["ver", "ge", "be", "an", "un", "zu", "haus", "stadt", "lich", "ung", "keit", "heit",
+             "ter", "men", "sch", "bar", "wer", "tag", "land", "berg", "feld", "schaft", "en", "er"]
+
+
+def _rare_word(rng):
+    word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+    return word.capitalize() if rng.random() < 0.4 else word
+
+
+def _sentence_length(rng, mean_log=2.7, sigma_log=0.65, max_length=400):
+    # Log-normal: median around 15 tokens with a long tail of very long sentences
+    return max(1, min(max_length, int(round(rng.lognormvariate(mean_log, sigma_log)))))
+
+
+def generate_conllu(n_sentences, seed=42, sentences_per_text=50, corpus="SYN", rare_word_rate=0.05):
+    """
+    Generate a synthetic CoNLL-U corpus in the format produced by korapxml2conllu: unannotated
+    CoNLLUP_Token lines, grouped into texts with # foundry / # filename / # text_id metadata
+    and per-sentence # start_offsets / # end_offsets.
+
+    Args:
+        n_sentences: Number of sentences to generate
+        seed: Random seed; the same seed always yields the same corpus
+        sentences_per_text: Mean number of sentences per text
+        corpus: Corpus sigle used in the text IDs and file names
+        rare_word_rate: Share of tokens drawn from an open vocabulary of generated words
+
+    Yields:
+        (str, int): CoNLL-U block of one sentence (including metadata, ending with an empty
+        line) and its number of tokens
+    """
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(COMMON_WORDS))))
+    text_no, left_in_text, offset = -1, 0, 0
+    for _ in range(n_sentences):
+        lines = []
+        if left_in_text == 0:
+            text_no += 1
+            left_in_text = max(1, int(rng.expovariate(1 / sentences_per_text)))
+            offset = 0
+            doc, text = divmod(text_no, 1000)
+            lines.append("# foundry = base")
+            lines.append(f"# filename = {corpus}/{doc:03d}/{text:05d}/base/tokens.xml")
+            lines.append(f"# text_id = {corpus}_{doc:03d}.{text:05d}")
+        left_in_text -= 1
+
+        n_tokens = _sentence_length(rng)
+        tokens = []
+        for i in range(n_tokens):
+            if i == n_tokens - 1 and n_tokens > 1:
+                tokens.append(rng.choice([".", ".", ".", "?", "!"]))
+            elif rng.random() < 0.08:
+                tokens.append(rng.choice(PUNCTUATION))
+            elif rng.random() < rare_word_rate:
+                tokens.append(_rare_word(rng))
+            else:
+                tokens.append(rng.choices(COMMON_WORDS, cum_weights=cum_weights)[0])
+        if tokens[0][0].isalpha():
+            tokens[0] = tokens[0][0].upper() + tokens[0][1:]
+
+        starts, ends = [], []
+        for token in tokens:
+            starts.append(offset)
+            ends.append(offset + len(token))
+            offset += len(token) + 1
+        lines.append(f"# start_offsets = {starts[0]} " + " ".join(map(str, starts)))
+        lines.append(f"# end_offsets = {ends[-1]} " + " ".join(map(str, ends)))
+        for i, token in enumerate(tokens, 1):
+            lines.append(f"{i}\t{token}\t_\t_\t_\t_\t_\t_\t_\t_")
+        yield "\n".join(lines) + "\n\n", n_tokens
+
+
+def write_synthetic_corpus(path, n_sentences, seed=42, **options):
+    """
+    Write a synthetic CoNLL-U corpus (see generate_conllu) to path.
+
+    Returns:
+        (int, int): Number of sentences and tokens written
+    """
+    n_tokens = 0
+    with open(path, "w", encoding="utf-8") as out:
+        for block, length in generate_conllu(n_sentences, seed=seed, **options):
+            out.write(block)
+            n_tokens += length
+    return n_sentences, n_tokens
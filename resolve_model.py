@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Resolve a spaCy model name to what parse_spacy_pipe.py should load, without importing
+spaCy or loading the model:
+
+  - a path to a model directory (containing config.cfg) is used as is
+  - a model preloaded in MODEL_DIR/<name> is used by its absolute path
+  - an installed model package is used by its name
+
+Prints the resolved model and exits with 0, or exits with 1 if the model is not available.
+"""
+import argparse, importlib.util, os, sys
+
+
+def is_model_dir(path):
+    """Check whether path is a spaCy model directory"""
+    return os.path.isfile(os.path.join(path, "config.cfg"))
+
+
+def is_model_package(model_name):
+    """Check whether model_name is an installed spaCy model package, without importing it"""
+    try:
+        spec = importlib.util.find_spec(model_name)
+    except (ImportError, ValueError):
+        return False
+    if spec is None or not spec.submodule_search_locations:
+        return False
+    # Model packages keep the pipeline in a versioned subdirectory, e.g. de_core_news_lg/de_core_news_lg-3.8.0
+    for location in spec.submodule_search_locations:
+        if is_model_dir(location):
+            return True
+        for entry in os.scandir(location):
+            if entry.is_dir() and entry.name.startswith(f"{model_name}-") and is_model_dir(entry.path):
+                return True
+    return False
+
+
+def resolve_model(model_name, model_dir="/local/models"):
+    """
+    Find the model to load for model_name.
+
+    Args:
+        model_name: spaCy model name or path
+        model_dir: Directory with preloaded models
+
+    Returns:
+        str: Model path or package name, None if the model is not available
+    """
+    if os.sep in model_name and is_model_dir(model_name):
+        return model_name
+    preloaded = os.path.join(model_dir, model_name)
+    if is_model_dir(preloaded):
+        return os.path.abspath(preloaded)
+    if is_model_package(model_name):
+        return model_name
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help="spaCy model name or path")
+    parser.add_argument("-d", "--model_dir", help="Directory with preloaded models", default="/local/models")
+    args = parser.parse_args()
+
+    resolved = resolve_model(args.model, args.model_dir)
+    if resolved is None:
+        sys.exit(1)
+    print(resolved)
@@ -0,0 +1,164 @@
+"""
+	Throughput benchmark for parse_spacy_pipe.py on a synthetic, reproducible CoNLL-U corpus.
+
+	Runs the pipeline once per combination of settings (dependencies on/off, GermaLemma on/off,
+	SPACY_BATCH_SIZE, SPACY_PARSE_BATCH_SIZE, SPACY_TOKEN_BUDGET) and writes sentences/sec, tokens/sec and peak RSS of
+	each run as JSON. Works offline with any installed or local model:
+
+		python systems/benchmark_spacy_pipe.py -sm de_core_news_sm -s 5000 -o benchmark.json
+		python systems/benchmark_spacy_pipe.py -sm /local/models/de_core_news_sm --batch_sizes 500,2000
+"""
+import argparse, itertools, json, os, platform, re, subprocess, sys, tempfile, time
+from importlib.metadata import version, PackageNotFoundError
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from my_utils.synthetic_conllu import write_synthetic_corpus
+
+PIPE_SCRIPT = os.path.join(REPO_DIR, "systems", "parse_spacy_pipe.py")
+TOTAL_TIME_RE = re.compile(r"Total time: ([0-9.]+)s")
+
+
+def package_version(name):
+	try:
+		return version(name)
+	except PackageNotFoundError:
+		return None
+
+
+def git_revision():
+	try:
+		return subprocess.run(["git", "-C", REPO_DIR, "describe", "--always", "--dirty"], capture_output=True,
+			text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def run_pipeline(model, input_file, work_dir, settings, extra_env):
+	"""
+	Run parse_spacy_pipe.py once and measure it.
+
+	Args:
+		model: spaCy model name or path
+		input_file: CoNLL-U input
+		work_dir: Working directory of the run (logs are written to work_dir/logs)
+		settings: dict of SPACY_* environment variables for this run
+		extra_env: dict of environment variables shared by all runs
+
+	Returns:
+		dict: Wall time, processing time (without startup), peak RSS and output sentence count
+	"""
+	env = dict(os.environ, **extra_env, **settings)
+	env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")]))
+	env.pop("SPACY_CONTAINER_START", None)
+	output_file = os.path.join(work_dir, "output.conllu")
+	log_file = os.path.join(work_dir, "stderr.log")
+	with open(input_file, "rb") as stdin, open(output_file, "wb") as stdout, open(log_file, "wb") as stderr:
+		start = time.perf_counter()
+		proc = subprocess.Popen([sys.executable, PIPE_SCRIPT, "--spacy_model", model, "--corpus_name", "benchmark"],
+			stdin=stdin, stdout=stdout, stderr=stderr, cwd=work_dir, env=env)
+		# wait4 reports the resource usage of this run only (including its reaped worker processes)
+		_, status, rusage = os.wait4(proc.pid, 0)
+		wall_time = time.perf_counter() - start
+		proc.returncode = os.waitstatus_to_exitcode(status)
+	with open(log_file, encoding="utf-8", errors="replace") as f:
+		log = f.read()
+	with open(output_file, "rb") as f:
+		output_sentences = sum(1 for line in f if line == b"\n")
+	match = TOTAL_TIME_RE.search(log)
+	return {
+		"returncode": proc.returncode,
+		"wall_time": round(wall_time, 3),
+		"processing_time": float(match.group(1)) if match else None,
+		"peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),  # ru_maxrss is in KiB on Linux
+		"output_sentences": output_sentences,
+		"log_tail": log.strip().splitlines()[-5:] if proc.returncode != 0 else None,
+	}
+
+
+def settings_matrix(args):
+	for deps, germalemma, batch_size, parse_batch_size, token_budget in itertools.product(args.dependencies.split(","),
+			args.germalemma.split(","), args.batch_sizes.split(","), args.parse_batch_sizes.split(","), args.token_budgets.split(",")):
+		yield {"SPACY_USE_DEPENDENCIES": deps, "SPACY_USE_GERMALEMMA": germalemma, "SPACY_BATCH_SIZE": batch_size,
+			"SPACY_PARSE_BATCH_SIZE": parse_batch_size, "SPACY_TOKEN_BUDGET": token_budget}
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Throughput benchmark for parse_spacy_pipe.py")
+	parser.add_argument("-sm", "--spacy_model", help="spaCy model name or path", default="de_core_news_sm")
+	parser.add_argument("-s", "--sentences", help="Number of synthetic sentences", type=int, default=5000)
+	parser.add_argument("--seed", help="Random seed of the synthetic corpus", type=int, default=42)
+	parser.add_argument("-i", "--input_file", help="Benchmark on this CoNLL-U file instead of a synthetic corpus", default=None)
+	parser.add_argument("--dependencies", help="Comma-separated SPACY_USE_DEPENDENCIES values", default="True,False")
+	parser.add_argument("--germalemma", help="Comma-separated SPACY_USE_GERMALEMMA values", default="True,False")
+	parser.add_argument("--batch_sizes", help="Comma-separated SPACY_BATCH_SIZE values", default="2000")
+	parser.add_argument("--parse_batch_sizes", help="Comma-separated SPACY_PARSE_BATCH_SIZE values", default="256")
+	parser.add_argument("--token_budgets", help="Comma-separated SPACY_TOKEN_BUDGET values (0: off)", default="0")
+	parser.add_argument("-r", "--repeat", help="Runs per setting; the fastest run is reported", type=int, default=1)
+	parser.add_argument("-e", "--env", help="Extra VAR=VALUE for all runs, e.g. SPACY_N_PROCESS=4", action="append", default=[])
+	parser.add_argument("-o", "--output", help="JSON result file (default: stdout)", default=None)
+	args = parser.parse_args()
+
+	extra_env = dict(assignment.split("=", 1) for assignment in args.env)
+	with tempfile.TemporaryDirectory(prefix="spacy-benchmark-") as work_dir:
+		os.makedirs(os.path.join(work_dir, "logs"))
+		if args.input_file:
+			input_file = args.input_file
+			n_sentences = n_tokens = 0
+			with open(input_file, encoding="utf-8") as f:
+				for line in f:
+					if line == "\n": n_sentences += 1
+					elif line[0].isdigit(): n_tokens += 1
+			corpus = {"file": os.path.abspath(input_file)}
+		else:
+			input_file = os.path.join(work_dir, "synthetic.conllu")
+			n_sentences, n_tokens = write_synthetic_corpus(input_file, args.sentences, seed=args.seed)
+			corpus = {"synthetic": True, "seed": args.seed}
+		corpus.update(sentences=n_sentences, tokens=n_tokens)
+		sys.stderr.write(f"Benchmark corpus: {n_sentences} sentences, {n_tokens} tokens\n")
+
+		runs = []
+		failed = False
+		for settings in settings_matrix(args):
+			best = None
+			for _ in range(args.repeat):
+				result = run_pipeline(args.spacy_model, input_file, work_dir, settings, extra_env)
+				if result["returncode"] != 0 or result["output_sentences"] != n_sentences:
+					best = result
+					break
+				if best is None or result["wall_time"] < best["wall_time"]:
+					best = result
+			ok = best["returncode"] == 0 and best["output_sentences"] == n_sentences
+			failed |= not ok
+			time_base = best["processing_time"] or best["wall_time"]
+			run = {"settings": dict(settings, **extra_env), "ok": ok, **best,
+				"sents_per_sec": round(n_sentences / time_base, 1) if ok and time_base else None,
+				"tokens_per_sec": round(n_tokens / time_base, 1) if ok and time_base else None}
+			if run["log_tail"] is None: del run["log_tail"]
+			runs.append(run)
+			sys.stderr.write(f"deps={settings['SPACY_USE_DEPENDENCIES']:5} germalemma={settings['SPACY_USE_GERMALEMMA']:5} "
+				f"batch={settings['SPACY_BATCH_SIZE']:>6} parse_batch={settings['SPACY_PARSE_BATCH_SIZE']:>5} "
+				f"token_budget={settings['SPACY_TOKEN_BUDGET']:>6}: " +
+				(f"{run['sents_per_sec']:8.1f} sents/s {run['tokens_per_sec']:9.1f} tokens/s "
+				 f"{run['peak_rss_mb']:7.1f} MiB peak RSS, {run['wall_time']:.1f}s wall" if ok else "FAILED") + "\n")
+
+	result = {
+		"benchmark": "parse_spacy_pipe",
+		"created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+		"revision": git_revision(),
+		"model": args.spacy_model,
+		"versions": {"python": platform.python_version(), "spacy": package_version("spacy"),
+			"germalemma": package_version("germalemma")},
+		"platform": {"system": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count()},
+		"corpus": corpus,
+		"repeat": args.repeat,
+		"runs": runs,
+	}
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as out:
+			json.dump(result, out, indent=2)
+			out.write("\n")
+	else:
+		json.dump(result, sys.stdout, indent=2)
+		sys.stdout.write("\n")
+	sys.exit(1 if failed else 0)
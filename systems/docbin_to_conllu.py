@@ -0,0 +1,60 @@
+"""
+	Write CoNLL-U from a DocBin stream of parse_spacy_pipe.py (--output_format docbin), without
+	loading or running a model. The same analysis can so be serialized in several variants,
+	e.g. with and without GermaLemma lemmas or for another foundry:
+
+		python systems/parse_spacy_pipe.py -sm de_core_news_lg -of docbin -i corpus.conllu -o corpus.docbin
+		python systems/docbin_to_conllu.py -ugl True -i corpus.docbin -o corpus.spacy.conllu
+		python systems/docbin_to_conllu.py -ugl False --foundry spacy_plain -i corpus.docbin -o corpus.plain.conllu
+"""
+import argparse, logging, os, sys, time
+from collections import Counter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import lib.spacy_annotation as sa
+from lib.docbin_stream import read_docbin_stream, docbin_to_conll
+import my_utils.file_utils as fu
+
+BATCH_SIZE = 2000  # sentences per write
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Write CoNLL-U from a DocBin stream of parse_spacy_pipe.py")
+	parser.add_argument("-i", "--input_file", help="DocBin stream, plain or gzip/zstd/bz2/xz compressed (default: stdin)", default=None)
+	parser.add_argument("-o", "--output_file", help="Output CoNLL-U file (default: stdout)", default=None)
+	parser.add_argument("-oc", "--output_compression", help=f"Compress the output: {', '.join(fu.COMPRESSIONS)}", default="none")
+	parser.add_argument("-ugl", "--use_germalemma", help="Use Germalemma lemmatizer on top of SpaCy", default="True")
+	parser.add_argument("-udp", "--use_dependencies", help="Include HEAD/DEPREL columns (where the dependencies were parsed)", default="True")
+	parser.add_argument("--foundry", help="Rewrite the foundry and filename metadata to this foundry (default: as annotated)", default=None)
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s", stream=sys.stderr)
+	logger = logging.getLogger(__name__)
+
+	if args.use_germalemma == "True" and not sa.load_germalemma(cache_file=os.getenv("SPACY_GERMALEMMA_CACHE_FILE") or None):
+		logger.warning("GermaLemma requested but not available. Using spaCy lemmas instead.")
+		args.use_germalemma = "False"
+
+	start = time.time()
+	stats = Counter()
+	input_stream = fu.open_input(args.input_file)
+	output = fu.open_output(args.output_file, compression=args.output_compression)
+	try:
+		docs = read_docbin_stream(input_stream.buffer)
+		for batch in fu.batch_sentences(docs, BATCH_SIZE):
+			conll_strs = [docbin_to_conll(doc, args.use_germalemma, args.use_dependencies, foundry=args.foundry, timings=stats) for doc in batch]
+			fu.write_conll_batch(output, conll_strs)
+			stats["sentences"] += len(batch)
+			stats["tokens"] += sum(len(doc) for doc in batch)
+	except ValueError as e:
+		logger.error(f"{args.input_file or 'stdin'}: {str(e)}")
+		sys.exit(1)
+	finally:
+		output.close()
+		input_stream.close()
+	if args.use_germalemma == "True":
+		sa.save_germalemma_cache(os.getenv("SPACY_GERMALEMMA_CACHE_FILE") or None)
+	total_time = time.time() - start
+	logger.info(f"Wrote {stats['sentences']} sentences, {stats['tokens']} tokens in {total_time:.2f}s "
+		f"({stats['tokens'] / total_time if total_time > 0 else 0:.0f} tokens/sec, GermaLemma {stats['time_germalemma']:.2f}s)")
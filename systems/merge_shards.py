@@ -0,0 +1,82 @@
+"""
+	Join the outputs of a sharded run (parse_spacy_pipe.py --shard K/N) into the output of a
+	single run over the whole input. Each shard output has a manifest (<output>.shard.json)
+	written when the shard is complete; all shards must be complete, belong to the same input
+	and settings, and cover the input without gaps.
+
+		python systems/merge_shards.py -o corpus.spacy.conllu corpus.part*.conllu
+"""
+import argparse, json, os, shutil, sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from my_utils.file_utils import SHARD_MANIFEST_SUFFIX, OUTPUT_BUFFER_SIZE
+
+# Manifest fields that must be equal for all shards of a run
+RUN_FIELDS = ["shards", "unit", "input_file", "input_size", "input_mtime", "spacy_model", "model_version",
+	"use_germalemma", "use_dependencies", "reuse_columns", "output_format", "text_doc_tokens", "output_compression"]
+
+
+def read_manifest(output_file):
+	try:
+		with open(output_file + SHARD_MANIFEST_SUFFIX, encoding="utf-8") as f:
+			return json.load(f)
+	except FileNotFoundError:
+		raise ValueError(f"{output_file} has no manifest {output_file + SHARD_MANIFEST_SUFFIX}; the shard is incomplete")
+	except ValueError as e:
+		raise ValueError(f"Could not read the manifest of {output_file}: {str(e)}")
+
+
+def check_shards(output_files):
+	"""
+	Check that the shard outputs form one complete run.
+
+	Returns:
+		list: (manifest, output file) pairs ordered by shard number
+
+	Raises:
+		ValueError: If a shard is missing, incomplete, duplicated or from a different run
+	"""
+	shards = sorted(((read_manifest(path), path) for path in output_files), key=lambda item: item[0]["shard"])
+	first = shards[0][0]
+	for manifest, path in shards:
+		differences = [field for field in RUN_FIELDS if manifest.get(field) != first.get(field)]
+		if differences:
+			raise ValueError(f"{path} belongs to a different run than {shards[0][1]} ({', '.join(differences)} differ)")
+	numbers = [manifest["shard"] for manifest, _ in shards]
+	if numbers != list(range(1, first["shards"] + 1)):
+		missing = sorted(set(range(1, first["shards"] + 1)) - set(numbers))
+		raise ValueError(f"Expected shards 1 to {first['shards']} once each, got {numbers}" + (f" (missing {missing})" if missing else ""))
+	end = 0
+	for manifest, path in shards:
+		if manifest["start"] != end:
+			raise ValueError(f"Shard {manifest['shard']} ({path}) starts at input byte {manifest['start']}, expected {end}")
+		end = manifest["end"]
+	if end != first["input_size"]:
+		raise ValueError(f"The shards end at input byte {end}, but the input has {first['input_size']} bytes")
+	return shards
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Join the outputs of parse_spacy_pipe.py --shard K/N runs")
+	parser.add_argument("shard_outputs", help="Output files of all shards (any order)", nargs="+")
+	parser.add_argument("-o", "--output_file", help="Merged output (default: stdout)", default=None)
+	args = parser.parse_args()
+
+	try:
+		shards = check_shards(args.shard_outputs)
+	except (ValueError, KeyError) as e:
+		sys.stderr.write(f"ERROR: {str(e)}\n")
+		sys.exit(1)
+
+	# Shard outputs are byte-for-byte parts of the single-run output; compressed shards are
+	# independent gzip/zstd/bz2/xz streams, which concatenated form a valid stream as well
+	out = open(args.output_file, "wb") if args.output_file else sys.stdout.buffer
+	for _, path in shards:
+		with open(path, "rb") as f:
+			shutil.copyfileobj(f, out, OUTPUT_BUFFER_SIZE)
+	out.flush()
+	if args.output_file:
+		out.close()
+	sentences = sum(manifest["sentences"] for manifest, _ in shards)
+	sys.stderr.write(f"Merged {len(shards)} shards with {sentences} sentences of {shards[0][0]['input_file']}\n")
@@ -1,184 +1,28 @@
-from sys import stdin
 import argparse, os
+from my_utils.cpu_utils import set_thread_env, parse_affinity, worker_cpus, pin_process, thread_settings
+# BLAS and OpenMP thread pools are sized when numpy is first imported, so SPACY_THREADS is applied before spaCy is
+set_thread_env(os.getenv("SPACY_THREADS"))
+import importlib.metadata
 import spacy
-from spacy.tokens import Doc
-import logging, sys, time, signal
-from lib.CoNLL_Annotation import get_token_type
+import logging, sys, time
+from collections import Counter
+from functools import partial
+from lib.CoNLL_Annotation import get_token_type, read_conll_stream, skip_sentences, shard_range
+from lib.spacy_annotation import GERMALEMMA_AVAILABLE, DEFAULT_PARSE_TIMEOUT, DEFAULT_MAX_SENTENCE_LENGTH, \
+	DEFAULT_PARSE_BATCH_SIZE, DEFAULT_PARSE_BATCH_BUDGET, DEFAULT_GERMALEMMA_CACHE_SIZE, DEFAULT_SENTENCE_CACHE_SIZE, load_pipeline, load_germalemma, \
+	save_germalemma_cache, load_sentence_cache, save_sentence_cache, get_model_meta, parse_batch, format_batch, parse_reuse_columns, \
+	OUTPUT_FORMATS
+from lib.annotation_pool import AnnotationPool, WorkerCrashException
+from lib.annotation_server import serve
+from lib.batch_files import expand_inputs, plan_files, annotate_file, log_summary
+from lib.docbin_stream import encode_docbin, write_docbin_batch
+from lib.korap_xml import KorapWriter, format_korap_batch
 import my_utils.file_utils as fu
-
-# Try to import GermaLemma, but make it optional
-try:
-    from germalemma import GermaLemma
-    GERMALEMMA_AVAILABLE = True
-except ImportError:
-    GERMALEMMA_AVAILABLE = False
-    GermaLemma = None
-
-# Dependency parsing safety limits
-DEFAULT_PARSE_TIMEOUT = 0.5  # seconds per sentence
-DEFAULT_MAX_SENTENCE_LENGTH = 500  # tokens
-
-class TimeoutException(Exception):
-	pass
-
-def timeout_handler(signum, frame):
-	raise TimeoutException("Dependency parsing timeout")
-
-def safe_dependency_parse(spacy_model, text, timeout=DEFAULT_PARSE_TIMEOUT, max_length=DEFAULT_MAX_SENTENCE_LENGTH):
-	"""
-	Safely parse a sentence with timeout and length limits.
-	
-	Args:
-		spacy_model: Loaded spaCy model
-		text: Text to parse
-		timeout: Maximum seconds to wait for parsing
-		max_length: Maximum sentence length in tokens
-		
-	Returns:
-		tuple: (spacy_doc, success, warning_message)
-	"""
-	# Check sentence length
-	if len(text.split()) > max_length:
-		# Process without dependency parsing for long sentences
-		disabled_components = ["ner", "parser"]
-		doc = spacy_model(text, disable=disabled_components)
-		return doc, False, f"Sentence too long ({len(text.split())} tokens > {max_length}), dependency parsing skipped"
-	
-	# Set up timeout
-	old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-	signal.setitimer(signal.ITIMER_REAL, timeout)
-	
-	try:
-		doc = spacy_model(text)
-		signal.setitimer(signal.ITIMER_REAL, 0)  # Cancel alarm
-		signal.signal(signal.SIGALRM, old_handler)
-		return doc, True, None
-	except TimeoutException:
-		signal.setitimer(signal.ITIMER_REAL, 0)  # Cancel alarm
-		signal.signal(signal.SIGALRM, old_handler)
-		# Retry without dependency parsing
-		disabled_components = ["ner", "parser"]
-		doc = spacy_model(text, disable=disabled_components)
-		return doc, False, f"Dependency parsing timeout after {timeout}s, processed without dependencies"
-	except Exception as e:
-		signal.setitimer(signal.ITIMER_REAL, 0)  # Cancel alarm
-		signal.signal(signal.SIGALRM, old_handler)
-		# Retry without dependency parsing
-		disabled_components = ["ner", "parser"]
-		doc = spacy_model(text, disable=disabled_components)
-		return doc, False, f"Dependency parsing error: {str(e)}, processed without dependencies"
-
-def format_morphological_features(token):
-	"""
-	Extract and format morphological features from a spaCy token for CoNLL-U output.
-	
-	Args:
-		token: spaCy token object
-		
-	Returns:
-		str: Formatted morphological features string for CoNLL-U 5th column
-			 Returns "_" if no features are available
-	"""
-	if not hasattr(token, 'morph') or not token.morph:
-		return "_"
-	
-	morph_dict = token.morph.to_dict()
-	if not morph_dict:
-		return "_"
-	
-	# Format as CoNLL-U format: Feature=Value|Feature2=Value2
-	features = []
-	for feature, value in sorted(morph_dict.items()):
-		features.append(f"{feature}={value}")
-	
-	return "|".join(features)
-
-
-def format_dependency_relations(doc):
-	"""
-	Extract and format dependency relations from a spaCy doc for CoNLL-U output.
-	
-	Args:
-		doc: spaCy Doc object
-		
-	Returns:
-		list: List of tuples (head_id, deprel) for each token
-	"""
-	dependencies = []
-	for i, token in enumerate(doc):
-		# HEAD column: 1-based index of the head token (0 for root)
-		if token.dep_ == "ROOT":
-			head_id = 0
-		else:
-			# Find the 1-based index of the head token
-			head_id = None
-			for j, potential_head in enumerate(doc):
-				if potential_head == token.head:
-					head_id = j + 1
-					break
-			if head_id is None:
-				head_id = 0  # Fallback to root if head not found
-		
-		# DEPREL column: dependency relation
-		deprel = token.dep_ if token.dep_ else "_"
-		
-		dependencies.append((head_id, deprel))
-	
-	return dependencies
-
-
-class WhitespaceTokenizer(object):
-	def __init__(self, vocab):
-		self.vocab = vocab
-
-	def __call__(self, text):
-		words = text.split(' ')
-		# Filter out empty strings to avoid spaCy errors
-		words = [w for w in words if w]
-		# Handle edge case of empty input - use a placeholder token
-		if not words:
-			words = ['_EMPTY_']
-		# All tokens 'own' a subsequent space character in this tokenizer
-		spaces = [True] * len(words)
-		return Doc(self.vocab, words=words, spaces=spaces)
-
-
-def get_conll_str(anno_obj, spacy_doc, use_germalemma, use_dependencies):
-	#  First lines are comments. (metadata)
-	conll_lines = anno_obj.metadata # Then we want: [ID, FORM, LEMMA, UPOS, XPOS, FEATS, HEAD, DEPREL, DEPS, MISC]
-	
-	# Get dependency relations if enabled
-	dependencies = format_dependency_relations(spacy_doc) if use_dependencies == "True" else None
-	
-	for ix, token in enumerate(spacy_doc):
-		morph_features = format_morphological_features(token)
-		
-		# Get HEAD and DEPREL columns
-		if dependencies:
-			head_id, deprel = dependencies[ix]
-		else:
-			head_id, deprel = "_", "_"
-		
-		if use_germalemma == "True":
-			content = (str(ix+1), token.text, find_germalemma(token.text, token.tag_, token.lemma_), token.pos_, token.tag_, morph_features, str(head_id), deprel, "_", "_")
-		else:
-			content = (str(ix+1), token.text, token.lemma_, token.pos_, token.tag_, morph_features, str(head_id), deprel, "_", "_") # Pure SpaCy!
-		conll_lines.append("\t".join(content))
-	return "\n".join(conll_lines)
-
-	
-def find_germalemma(word, pos, spacy_lemma):
-	simplify_pos = {"ADJA":"ADJ", "ADJD":"ADJ",
-					"NA":"N", "NE":"N", "NN":"N",
-					"ADV":"ADV", "PAV":"ADV", "PROAV":"ADV", "PAVREL":"ADV", "PWAV":"ADV", "PWAVREL":"ADV",
-					"VAFIN":"V", "VAIMP":"V", "VAINF":"V", "VAPP":"V", "VMFIN":"V", "VMINF":"V",
-					"VMPP":"V", "VVFIN":"V", "VVIMP":"V", "VVINF":"V", "VVIZU":"V","VVPP":"V"
-				}
-	# simplify_pos = {"VERB": "V", "ADV": "ADV", "ADJ": "ADJ", "NOUN":"N", "PROPN": "N"}
-	try:
-		return lemmatizer.find_lemma(word, simplify_pos.get(pos, "UNK"))
-	except:
-		return spacy_lemma
+from my_utils.pipeline_utils import prefetch, PipelineStage
+from my_utils.metrics_utils import MetricsWriter, timed_iter, METRICS_FORMATS
+from my_utils.memory_utils import TokenBudget
+from my_utils.checkpoint_utils import Checkpoint, run_identity
+from my_utils.profile_utils import ChunkProfiler, parse_chunk_window, DEFAULT_SAMPLE_INTERVAL
 
 
 if __name__ == "__main__":
@@ -196,9 +40,20 @@ if __name__ == "__main__":
 	parser.add_argument("-ugl", "--use_germalemma", help="Use Germalemma lemmatizer on top of SpaCy", default="True")
 	parser.add_argument("-udp", "--use_dependencies", help="Include dependency parsing (adds HEAD/DEPREL columns, set to False for faster processing)", default="True")
 	parser.add_argument("-c", "--comment_str", help="CoNLL Format of comentaries inside the file", default="#")
+	parser.add_argument("-i", "--input_file", help="Input CoNLL-U file, plain or gzip/zstd/bz2/xz compressed (default: stdin)", default=None)
+	parser.add_argument("-o", "--output_file", help="Output CoNLL-U file (default: stdout)", default=None)
+	parser.add_argument("-oc", "--output_compression", help=f"Compress the output: {', '.join(fu.COMPRESSIONS)}", default="none")
+	parser.add_argument("-of", "--output_format", help="conllu, docbin to write the annotated Docs for systems/docbin_to_conllu.py, "
+		"or korap to write KorAP morpho.xml layers into the --output_file zip (*.zip) or directory", choices=OUTPUT_FORMATS, default="conllu")
+	parser.add_argument("--checkpoint", help="Record progress in this file and resume from it when run again with the same arguments (needs an uncompressed --output_file)", default=None)
+	parser.add_argument("--input_files", help="Batch mode: annotate these CoNLL-U files or glob patterns (quoted, ** for subdirectories) with one model load, into --output_dir", nargs="+", default=None)
+	parser.add_argument("--output_dir", help="Output directory of the batch mode; files with a complete output there are skipped", default=None)
+	parser.add_argument("--shard", help="Annotate only part K of N (e.g. 2/8) of the input file, cut at text boundaries; join the outputs with systems/merge_shards.py", default=None)
+	parser.add_argument("--serve", help="Run as annotation server on host:port or unix:/path/to/socket instead of reading stdin", default=None)
 	args = parser.parse_args()
+	if args.input_files and not args.output_dir:
+		parser.error("--input_files needs --output_dir")
 	
-	file_has_next, chunk_ix = True, 0
 	CHUNK_SIZE = int(os.getenv("SPACY_CHUNK_SIZE", "20000"))
 	SPACY_BATCH = int(os.getenv("SPACY_BATCH_SIZE", "2000"))
 	SPACY_PROC = int(os.getenv("SPACY_N_PROCESS", "1"))
@@ -227,45 +82,142 @@ if __name__ == "__main__":
 		args.use_germalemma = os.getenv("SPACY_USE_GERMALEMMA", "True")
 		logger.info(f"Using SPACY_USE_GERMALEMMA environment variable: {args.use_germalemma}")
 	
-	logger.info(f"Chunking {args.corpus_name} Corpus in chunks of {CHUNK_SIZE} Sentences")
+	if os.getenv("SPACY_OUTPUT_COMPRESSION") is not None:
+		args.output_compression = os.getenv("SPACY_OUTPUT_COMPRESSION", "none")
+		logger.info(f"Using SPACY_OUTPUT_COMPRESSION environment variable: {args.output_compression}")
+	
+	if os.getenv("SPACY_OUTPUT_FORMAT") is not None:
+		args.output_format = os.getenv("SPACY_OUTPUT_FORMAT", "conllu")
+		logger.info(f"Using SPACY_OUTPUT_FORMAT environment variable: {args.output_format}")
+	if args.output_format not in OUTPUT_FORMATS:
+		logger.error(f"Unknown output format {args.output_format}, expected one of {', '.join(OUTPUT_FORMATS)}")
+		sys.exit(1)
+	if args.output_format != "conllu" and (args.serve or args.input_files):
+		logger.error(f"{args.output_format} output is only supported when annotating a single input stream")
+		sys.exit(1)
+	if args.output_format == "korap":
+		if args.output_file in (None, "-") or args.checkpoint or args.shard or args.output_compression != "none":
+			logger.error("KorAP XML output needs an --output_file (zip file or directory) and cannot be compressed, checkpointed or sharded")
+			sys.exit(1)
+		if args.use_dependencies == "True":
+			# Dependencies are not part of the morpho.xml layer
+			logger.info("KorAP morpho.xml output: dependency parsing disabled")
+			args.use_dependencies = "False"
+	
+	if os.getenv("SPACY_SHARD") is not None:
+		args.shard = os.getenv("SPACY_SHARD") or None
+		logger.info(f"Using SPACY_SHARD environment variable: {args.shard}")
+	
+	if os.getenv("SPACY_CHECKPOINT_FILE") is not None:
+		args.checkpoint = os.getenv("SPACY_CHECKPOINT_FILE") or None
+		logger.info(f"Using SPACY_CHECKPOINT_FILE environment variable: {args.checkpoint}")
+	
+	# Permissions of the Unix domain socket of the annotation server (default: the umask decides)
+	try:
+		socket_mode = int(os.getenv("SPACY_SOCKET_MODE"), 8) if os.getenv("SPACY_SOCKET_MODE") else None
+	except ValueError:
+		logger.error(f"Invalid SPACY_SOCKET_MODE {os.getenv('SPACY_SOCKET_MODE')}, expected octal permissions such as 660")
+		sys.exit(1)
+	
+	# Intra-op threads per process (applied at import, see above) and optional pinning to CPUs or NUMA nodes
+	cpu_affinity = None
+	if os.getenv("SPACY_CPU_AFFINITY"):
+		try:
+			cpu_affinity = parse_affinity(os.getenv("SPACY_CPU_AFFINITY"))
+		except ValueError as e:
+			logger.error(f"Invalid SPACY_CPU_AFFINITY {os.getenv('SPACY_CPU_AFFINITY')}: {str(e)}")
+			sys.exit(1)
+		if SPACY_PROC <= 1 and not args.serve:
+			pin_process(worker_cpus(cpu_affinity, 0, 1))
+	logger.info(f"CPU settings: SPACY_THREADS={os.getenv('SPACY_THREADS') or 'default'}, SPACY_CPU_AFFINITY={os.getenv('SPACY_CPU_AFFINITY') or 'none'}; "
+		+ ", ".join(f"{name}={value}" for name, value in thread_settings().items()))
+	
+	# Opt-in profiling of selected chunks (annotation batches of SPACY_BATCH_SIZE sentences)
+	profile_options = None
+	if os.getenv("SPACY_PROFILE", "False") not in ("", "False"):
+		profile_mode = "sample" if os.getenv("SPACY_PROFILE") == "True" else os.getenv("SPACY_PROFILE")
+		try:
+			profile_options = dict(path_prefix=f"logs/Parse_{args.corpus_name}.SpaCy.profile", mode=profile_mode,
+				window=parse_chunk_window(os.getenv("SPACY_PROFILE_CHUNKS")) if os.getenv("SPACY_PROFILE_CHUNKS") else None,
+				every=int(os.getenv("SPACY_PROFILE_EVERY", "0")),
+				interval=float(os.getenv("SPACY_PROFILE_INTERVAL", str(DEFAULT_SAMPLE_INTERVAL))))
+			# Validates the mode before any work is done
+			ChunkProfiler(**profile_options)
+		except ValueError as e:
+			logger.error(f"Invalid profiling settings: {str(e)}")
+			sys.exit(1)
+		logger.info(f"Profiling ({profile_mode}) "
+			+ (f"chunks {os.getenv('SPACY_PROFILE_CHUNKS')}" if profile_options["window"] else f"every {max(1, profile_options['every'])}. chunk")
+			+ f" to {profile_options['path_prefix']}.<pid>.{'collapsed' if profile_mode == 'sample' else 'prof'}")
+	
+	logger.info(f"Streaming {args.corpus_name} Corpus, reporting progress every {CHUNK_SIZE} Sentences")
 	logger.info(f"Processing configuration: batch_size={SPACY_BATCH}, n_process={SPACY_PROC}")
 	
 	# =====================================================================================
 	#                    POS TAG DOCUMENTS
 	# =====================================================================================
-	# Configure which components to disable based on dependency parsing option
-	disabled_components = ["ner"]
 	if args.use_dependencies != "True":
-		disabled_components.append("parser")
 		logger.info("Dependency parsing disabled for faster processing")
 	else:
 		logger.info("Dependency parsing enabled (slower but includes HEAD/DEPREL)")
 	
-	spacy_de = spacy.load(args.spacy_model, disable=disabled_components)
-	spacy_de.tokenizer = WhitespaceTokenizer(spacy_de.vocab) # We won't re-tokenize to respect how the source CoNLL are tokenized!
-
-	# Increase max_length to handle very long sentences (especially when parser is disabled)
-	spacy_de.max_length = 10000000  # 10M characters
-
-	# Initialize GermaLemma if available and requested
-	lemmatizer = None
+	if args.output_format == "docbin" and args.use_germalemma == "True":
+		# The Docs keep the spaCy lemmas; GermaLemma is applied when they are serialized
+		logger.info("DocBin output: GermaLemma is applied by systems/docbin_to_conllu.py instead")
+		args.use_germalemma = "False"
+	
+	if args.use_germalemma == "True" and not GERMALEMMA_AVAILABLE:
+		logger.warning("GermaLemma requested but not available. Using spaCy lemmatizer instead.")
+		args.use_germalemma = "False"
+	
+	# GermaLemma lookups are memoized per (word, POS); the cache can be kept on disk between runs
+	germalemma_options = dict(cache_size=int(os.getenv("SPACY_GERMALEMMA_CACHE_SIZE", str(DEFAULT_GERMALEMMA_CACHE_SIZE))),
+		cache_file=os.getenv("SPACY_GERMALEMMA_CACHE_FILE") or None)
 	if args.use_germalemma == "True":
-		if GERMALEMMA_AVAILABLE:
-			lemmatizer = GermaLemma()
-		else:
-			logger.warning("GermaLemma requested but not available. Using spaCy lemmatizer instead.")
-			args.use_germalemma = "False"
+		logger.info(f"GermaLemma cache: size={germalemma_options['cache_size']}, file={germalemma_options['cache_file']}")
+	
+	# Identical sentences (bylines, boilerplate) are annotated once and then taken from this cache
+	sentence_cache_options = dict(cache_size=int(os.getenv("SPACY_SENTENCE_CACHE_SIZE", str(DEFAULT_SENTENCE_CACHE_SIZE))),
+		cache_file=os.getenv("SPACY_SENTENCE_CACHE_FILE") or None)
+	if args.output_format != "conllu":
+		# The cache holds formatted token lines, not Docs
+		sentence_cache_options["cache_size"] = 0
+	logger.info(f"Sentence cache: size={sentence_cache_options['cache_size']}, file={sentence_cache_options['cache_file']}")
+	
+	# Consecutive sentences of a text can be annotated together, as one Doc with preset sentence boundaries
+	text_doc_tokens = int(os.getenv("SPACY_TEXT_DOC_TOKENS", "0"))
+	if text_doc_tokens > 0:
+		logger.info(f"Annotating sentences of the same text together in Docs of up to {text_doc_tokens} tokens")
+	
+	# Input columns taken over as preset annotations; components computing only these are not run
+	try:
+		reuse_columns = parse_reuse_columns(os.getenv("SPACY_REUSE_COLUMNS", ""))
+	except ValueError as e:
+		logger.error(f"Invalid SPACY_REUSE_COLUMNS: {str(e)}")
+		sys.exit(1)
+	if "LEMMA" in reuse_columns and args.use_germalemma == "True":
+		logger.info("LEMMA is reused from the input, GermaLemma disabled")
+		args.use_germalemma = "False"
+	
+	# With several processes, each worker loads the pipeline itself and the main process only reads and writes
+	spacy_de = None
+	if SPACY_PROC <= 1 and not args.serve:
+		spacy_de = load_pipeline(args.spacy_model, use_dependencies=args.use_dependencies, reuse_columns=reuse_columns)
+		# Initialize GermaLemma if requested
+		if args.use_germalemma == "True":
+			load_germalemma(**germalemma_options)
+		load_sentence_cache(spacy_de, args.use_germalemma, args.use_dependencies, text_doc_tokens=text_doc_tokens, **sentence_cache_options)
 	
 	# Log version information
 	logger.info(f"spaCy version: {spacy.__version__}")
 	logger.info(f"spaCy model: {args.spacy_model}")
-	logger.info(f"spaCy model version: {spacy_de.meta.get('version', 'unknown')}")
+	model_meta = spacy_de.meta if spacy_de is not None else get_model_meta(args.spacy_model)
+	logger.info(f"spaCy model version: {model_meta.get('version', 'unknown')}")
 	if GERMALEMMA_AVAILABLE:
 		try:
-			import germalemma
-			logger.info(f"GermaLemma version: {germalemma.__version__}")
-		except AttributeError:
-			logger.info("GermaLemma version: unknown (no __version__ attribute)")
+			logger.info(f"GermaLemma version: {importlib.metadata.version('germalemma')}")
+		except importlib.metadata.PackageNotFoundError:
+			logger.info("GermaLemma version: unknown (no package metadata)")
 	else:
 		logger.info("GermaLemma: not installed")
 	
@@ -273,72 +225,299 @@ if __name__ == "__main__":
 	parse_timeout = float(os.getenv("SPACY_PARSE_TIMEOUT", str(DEFAULT_PARSE_TIMEOUT)))
 	max_sentence_length = int(os.getenv("SPACY_MAX_SENTENCE_LENGTH", str(DEFAULT_MAX_SENTENCE_LENGTH)))
 	
+	parse_batch_size = int(os.getenv("SPACY_PARSE_BATCH_SIZE", str(DEFAULT_PARSE_BATCH_SIZE)))
+	parse_batch_budget = float(os.getenv("SPACY_PARSE_BATCH_BUDGET", str(DEFAULT_PARSE_BATCH_BUDGET)))
+	
 	logger.info(f"Dependency parsing limits: timeout={parse_timeout}s, max_length={max_sentence_length} tokens")
+	logger.info(f"Dependency parsing batch size: {parse_batch_size} sentences, at most {parse_batch_budget}s per batch")
+	
+	# Group sentences of similar length into model batches of at most this many tokens
+	token_budget = int(os.getenv("SPACY_TOKEN_BUDGET", "0"))
+	if token_budget > 0:
+		logger.info(f"Length-bucketed model batches of at most {token_budget} tokens")
+	
+	parse_settings = dict(parse_timeout=parse_timeout, max_sentence_length=max_sentence_length,
+		parse_batch_size=parse_batch_size, batch_size=SPACY_BATCH, token_budget=token_budget, text_doc_tokens=text_doc_tokens,
+		parse_batch_budget=parse_batch_budget)
+	annotation_settings = dict(use_germalemma=args.use_germalemma, use_dependencies=args.use_dependencies, output_format=args.output_format,
+		**parse_settings)
+	pool = None
+	if SPACY_PROC > 1 or args.serve:
+		# The server always annotates in worker processes: request threads cannot use SIGALRM parse timeouts
+		n_workers = max(1, SPACY_PROC)
+		max_tasks = int(os.getenv("SPACY_WORKER_MAX_TASKS", "0"))
+		logger.info(f"Starting {n_workers} annotation worker processes" + (f" (restarted after {max_tasks} batches)" if max_tasks > 0 else ""))
+		pool = AnnotationPool(n_workers, args.spacy_model, annotation_settings, germalemma_options=germalemma_options,
+			max_tasks_per_child=max_tasks or None, sentence_cache_options=sentence_cache_options, reuse_columns=reuse_columns,
+			affinity=cpu_affinity, profile_options=profile_options)
+	
+	# Set by docker-entrypoint.sh, so the log shows the total startup overhead including model resolution
+	try:
+		logger.info(f"Startup time since container start: {time.time() - float(os.environ['SPACY_CONTAINER_START']):.2f}s")
+	except (KeyError, ValueError):
+		pass
+	
+	if args.serve:
+		try:
+			serve(args.serve, pool, args.spacy_model, get_token_type(args.gld_token_type), comment_str=args.comment_str,
+				batch_size=SPACY_BATCH, max_requests=int(os.getenv("SPACY_SERVER_MAX_REQUESTS", "4")), socket_mode=socket_mode)
+		except WorkerCrashException as e:
+			logger.error(f"{str(e)}; stopping the server")
+			pool.close()
+			sys.exit(1)
+		pool.close()
+		sys.exit(0)
+	
+	if args.input_files:
+		# Batch mode: one output per input file, largest files first, each file annotated by one worker
+		try:
+			jobs, skipped = plan_files(expand_inputs(args.input_files), args.output_dir, compression=args.output_compression)
+		except ValueError as e:
+			logger.error(str(e))
+			sys.exit(1)
+		logger.info(f"Batch mode: {len(jobs)} files to annotate (about {sum(size for _, _, size in jobs) / 2**20:.1f} MiB uncompressed), "
+			f"{len(skipped)} already complete in {args.output_dir}")
+		start = time.time()
+		files = [(input_path, output_path) for input_path, output_path, _ in jobs]
+		file_options = dict(token_class=get_token_type(args.gld_token_type), comment_str=args.comment_str, compression=args.output_compression)
+		if pool is not None:
+			results = pool.annotate_files(files, **file_options)
+		else:
+			results = (annotate_file(spacy_de, input_path, output_path, annotation_settings, **file_options) for input_path, output_path in files)
+		done = []
+		try:
+			for result in results:
+				done.append(result)
+				logger.info(f"[{len(done)}/{len(files)}] {result['input']}: " + (f"{result['sentences']} sentences in {result['seconds']:.1f}s"
+					if result["error"] is None else "FAILED"))
+		except WorkerCrashException as e:
+			# Files that were completed keep their output and are skipped when the batch is run again
+			logger.error(f"{str(e)}; stopping after {len(done)} of {len(files)} files")
+			pool.close()
+			sys.exit(1)
+		if pool is not None:
+			pool.close()
+		else:
+			if args.use_germalemma == "True":
+				save_germalemma_cache(germalemma_options["cache_file"])
+			save_sentence_cache(sentence_cache_options["cache_file"])
+		n_failed = log_summary(done, skipped, time.time() - start)
+		sys.exit(1 if n_failed > 0 else 0)
+	
+	# Pipelined mode: reading, annotation and formatting/output run in separate stages connected by bounded queues
+	use_pipeline = os.getenv("SPACY_PIPELINE", "False") == "True"
+	queue_size = int(os.getenv("SPACY_QUEUE_SIZE", "4"))
+	if use_pipeline:
+		logger.info(f"Pipelined processing: reader, annotator and writer stages with queues of {queue_size} batches")
+	
+	# Stage timings, counters and RSS, written periodically for monitoring long runs
+	metrics = None
+	if os.getenv("SPACY_METRICS_FILE"):
+		metrics_format = os.getenv("SPACY_METRICS_FORMAT") or None
+		if metrics_format is not None and metrics_format not in METRICS_FORMATS:
+			logger.error(f"Unknown SPACY_METRICS_FORMAT {metrics_format}, expected one of {', '.join(METRICS_FORMATS)}")
+			sys.exit(1)
+		metrics = MetricsWriter(os.getenv("SPACY_METRICS_FILE"), metrics_format=metrics_format,
+			interval=float(os.getenv("SPACY_METRICS_INTERVAL", "60")), labels={"corpus": args.corpus_name},
+			worker_pids=pool.pids if pool is not None else None)
+		logger.info(f"Writing {metrics.metrics_format} metrics to {metrics.path} every {metrics.interval:g}s")
+	
+	# Batches can also be limited by tokens, and that limit adapted to the observed memory use
+	budget = None
+	chunk_max_tokens = int(os.getenv("SPACY_CHUNK_MAX_TOKENS", "0"))
+	memory_limit = int(os.getenv("SPACY_MEMORY_LIMIT", "0")) * 2**20
+	if chunk_max_tokens > 0 or memory_limit > 0:
+		budget = TokenBudget(chunk_max_tokens, memory_limit=memory_limit,
+			min_tokens=int(os.getenv("SPACY_CHUNK_MIN_TOKENS", "1000")), worker_pids=pool.pids if pool is not None else None)
+		logger.info(f"Batches limited to {chunk_max_tokens or 'unlimited'} tokens" +
+			(f", adapted to a memory limit of {memory_limit // 2**20} MiB" if memory_limit > 0 else ""))
+	
+	# Shard mode: annotate only one byte range of the input, cut at text (or sentence) boundaries
+	shard = None
+	if args.shard and not args.serve and not args.input_files:
+		shard_unit = os.getenv("SPACY_SHARD_UNIT", "text")
+		try:
+			shard_no, n_shards = (int(part) for part in args.shard.split("/"))
+			if args.input_file in (None, "-") or args.output_file in (None, "-"):
+				raise ValueError("Shard mode needs an input file (--input_file) and an output file (--output_file)")
+			shard_start, shard_end = shard_range(args.input_file, shard_no - 1, n_shards, comment_str=args.comment_str, unit=shard_unit)
+		except ValueError as e:
+			logger.error(f"Invalid shard {args.shard}: {str(e)}")
+			sys.exit(1)
+		input_stat = os.stat(args.input_file)
+		shard = {"shard": shard_no, "shards": n_shards, "unit": shard_unit, "input_file": os.path.abspath(args.input_file),
+			"input_size": input_stat.st_size, "input_mtime": int(input_stat.st_mtime), "start": shard_start, "end": shard_end,
+			"spacy_model": args.spacy_model, "model_version": model_meta.get("version"), "use_germalemma": args.use_germalemma,
+			"use_dependencies": args.use_dependencies, "reuse_columns": list(reuse_columns), "output_format": args.output_format,
+			"text_doc_tokens": text_doc_tokens, "output_compression": args.output_compression}
+		logger.info(f"Shard {shard_no}/{n_shards}: input bytes {shard_start}-{shard_end} of {input_stat.st_size}")
+		if os.path.exists(args.output_file + fu.SHARD_MANIFEST_SUFFIX):
+			os.unlink(args.output_file + fu.SHARD_MANIFEST_SUFFIX)
+	
+	# Checkpoint and resume: skip the sentences an interrupted run with the same arguments already wrote
+	checkpoint = None
+	if args.checkpoint and not args.serve:
+		if args.output_file in (None, "-") or args.output_compression != "none":
+			logger.error("Checkpoints need an uncompressed output file (--output_file), since the output is truncated and appended to on resume")
+			sys.exit(1)
+		identity = run_identity(args.input_file, args.output_file, spacy_model=args.spacy_model, model_version=model_meta.get("version"),
+			use_germalemma=args.use_germalemma, use_dependencies=args.use_dependencies, gld_token_type=args.gld_token_type,
+			comment_str=args.comment_str, shard=args.shard, reuse_columns=list(reuse_columns), output_format=args.output_format,
+			text_doc_tokens=text_doc_tokens)
+		checkpoint = Checkpoint(args.checkpoint, identity, interval=float(os.getenv("SPACY_CHECKPOINT_INTERVAL", "60")))
+		try:
+			resumed = checkpoint.load()
+		except ValueError as e:
+			logger.error(str(e))
+			sys.exit(1)
+		if checkpoint.complete:
+			logger.info(f"Checkpoint {args.checkpoint}: all {checkpoint.sentences} sentences were already processed; remove it to process the input again")
+			if pool is not None:
+				pool.close()
+			sys.exit(0)
+		if resumed:
+			logger.info(f"Resuming after {checkpoint.sentences} sentences ({checkpoint.output_offset} bytes of output) from checkpoint {args.checkpoint}")
+		else:
+			logger.info(f"Recording progress in checkpoint {args.checkpoint} every {checkpoint.interval:g}s")
+		if args.input_file in (None, "-"):
+			logger.warning("Reading from stdin: a resumed run must be given the same input again")
+	resume_sentences = checkpoint.sentences if checkpoint is not None else 0
 	
 	start = time.time()
-	total_processed_sents = 0
-	dependency_warnings = 0
+	stats = Counter()
+	next_report = CHUNK_SIZE
 	
-	while file_has_next:
-		annos, file_has_next = fu.get_file_annos_chunk(stdin, chunk_size=CHUNK_SIZE, token_class=get_token_type(args.gld_token_type), comment_str=args.comment_str, our_foundry="spacy")
-		if len(annos) == 0: break
-		total_processed_sents += len(annos)
-		
-		# Calculate progress statistics
-		elapsed_time = time.time() - start
-		sents_per_sec = total_processed_sents / elapsed_time if elapsed_time > 0 else 0
-		current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-		
-		logger.info(f"{current_time} | Processed: {total_processed_sents} sentences | Elapsed: {elapsed_time:.1f}s | Speed: {sents_per_sec:.1f} sents/sec")
-		
-		sents = [a.get_sentence() for a in annos]
+	write_output = {"conllu": fu.write_conll_batch, "docbin": write_docbin_batch,
+		"korap": lambda writer, sentences: writer.write_batch(sentences)}[args.output_format]
+	
+	def write_batch(job):
+		""" Finish an annotated batch (job returns its CoNLL-U strings, DocBinBatch or KorapSentences, and statistics) and print it. """
+		global next_report
+		conll_strs, batch_stats = job()
+		stats.update(batch_stats)
+		write_start = time.perf_counter()
+		write_output(output, conll_strs)
+		stats["time_write"] += time.perf_counter() - write_start
+		stats["sentences"] += len(conll_strs)
+		if budget is not None:
+			budget.adjust(batch_stats["tokens"])
+		if metrics is not None:
+			metrics.maybe_write(stats)
+		if checkpoint is not None:
+			checkpoint.maybe_update(resume_sentences + stats["sentences"], output)
 		
-		# Process sentences individually when dependency parsing is enabled for timeout protection
-		if args.use_dependencies == "True":
-			for ix, sent in enumerate(sents):
-				doc, dependency_success, warning = safe_dependency_parse(
-					spacy_de, sent, timeout=parse_timeout, max_length=max_sentence_length
-				)
-				if warning:
-					dependency_warnings += 1
-					logger.warning(f"Sentence {total_processed_sents - len(sents) + ix + 1}: {warning}")
-				
-				# Override use_dependencies based on actual parsing success
-				actual_use_dependencies = "True" if dependency_success else "False"
-				conll_str = get_conll_str(annos[ix], doc, use_germalemma=args.use_germalemma, use_dependencies=actual_use_dependencies)
-				print(conll_str+ "\n")
-		else:
-			# Use batch processing for faster processing when dependencies are disabled
-			# Use n_process=1 to avoid multiprocessing deadlocks and memory issues with large files
-			try:
-				for ix, doc in enumerate(spacy_de.pipe(sents, batch_size=SPACY_BATCH, n_process=1)):
-					conll_str = get_conll_str(annos[ix], doc, use_germalemma=args.use_germalemma, use_dependencies=args.use_dependencies)
-					print(conll_str+ "\n")
-			except Exception as e:
-				logger.error(f"Batch processing failed: {str(e)}")
-				logger.info("Falling back to individual sentence processing...")
-				# Fallback: process sentences individually
-				for ix, sent in enumerate(sents):
-					try:
-						doc = spacy_de(sent)
-						conll_str = get_conll_str(annos[ix], doc, use_germalemma=args.use_germalemma, use_dependencies=args.use_dependencies)
-						print(conll_str+ "\n")
-					except Exception as sent_error:
-						logger.error(f"Failed to process sentence {total_processed_sents - len(sents) + ix + 1}: {str(sent_error)}")
-						logger.error(f"Sentence preview: {sent[:100]}...")
-						# Output a placeholder to maintain alignment
-						conll_str = get_conll_str(annos[ix], spacy_de("ERROR"), use_germalemma=args.use_germalemma, use_dependencies=args.use_dependencies)
-						print(conll_str+ "\n")
+		if stats["sentences"] >= next_report:
+			next_report = (stats["sentences"] // CHUNK_SIZE + 1) * CHUNK_SIZE
+			# Calculate progress statistics
+			elapsed_time = time.time() - start
+			sents_per_sec = stats["sentences"] / elapsed_time if elapsed_time > 0 else 0
+			tokens_per_sec = stats["tokens"] / elapsed_time if elapsed_time > 0 else 0
+			current_time = time.strftime("%Y-%m-%d %H:%M:%S")
 			
+			logger.info(f"{current_time} | Processed: {stats['sentences']} sentences | Elapsed: {elapsed_time:.1f}s | Speed: {sents_per_sec:.1f} sents/sec, {tokens_per_sec:.0f} tokens/sec")
+	
+	def parse_jobs(batches):
+		""" Annotate batches in this process; CoNLL-U formatting is left to the writer. """
+		offset = resume_sentences
+		for annos in batches:
+			docs, dependency_flags, batch_stats = parse_batch(spacy_de, annos, args.use_dependencies, offset=offset, **parse_settings)
+			offset += len(annos)
+			if args.output_format == "docbin":
+				yield partial(encode_docbin, annos, docs, dependency_flags, stats=batch_stats)
+			elif args.output_format == "korap":
+				yield partial(format_korap_batch, annos, docs, dependency_flags, args.use_germalemma, stats=batch_stats)
+			else:
+				yield partial(format_batch, annos, docs, dependency_flags, args.use_germalemma, stats=batch_stats)
+	
+	def pool_jobs(batches):
+		""" Annotate batches in the worker processes, which also format them. """
+		for result in pool.annotate(batches, offset=resume_sentences):
+			yield lambda result=result: result
+	
+	# Sentences are read lazily and annotated in batches as soon as a batch is complete
+	input_stream = fu.open_input(args.input_file, byte_range=(shard["start"], shard["end"]) if shard is not None else None)
+	if resume_sentences > 0:
+		output = fu.open_output(args.output_file, resume_offset=checkpoint.output_offset)
+		skipped = skip_sentences(input_stream, resume_sentences, comment_str=args.comment_str)
+		if skipped < resume_sentences:
+			logger.error(f"Input ended after {skipped} sentences, but the checkpoint records {resume_sentences}")
+			sys.exit(1)
+	elif args.output_format == "korap":
+		output = KorapWriter(args.output_file)
+	else:
+		output = fu.open_output(args.output_file, compression=args.output_compression)
+	sentences = read_conll_stream(input_stream, token_class=get_token_type(args.gld_token_type), comment_str=args.comment_str, our_foundry="spacy")
+	batches = timed_iter(fu.batch_sentences(sentences, SPACY_BATCH, budget=budget), stats, "time_read")
+	if use_pipeline:
+		batches = prefetch(batches, maxsize=queue_size)
+	profiler = None
+	if pool is not None:
+		jobs = pool_jobs(batches)
+	else:
+		jobs = parse_jobs(batches)
+		if profile_options is not None:
+			# Includes reading and writing the profiled chunks (and the other threads in pipeline mode)
+			profiler = ChunkProfiler(**profile_options)
+			jobs = profiler.wrap(jobs)
+	
+	try:
+		if use_pipeline:
+			writer = PipelineStage(write_batch, maxsize=queue_size)
+			for job in jobs:
+				writer.put(job)
+			writer.close()
+		else:
+			for job in jobs:
+				write_batch(job)
+	except WorkerCrashException as e:
+		logger.error(f"{str(e)}; stopping after {resume_sentences + stats['sentences']} sentences" +
+			(f" (run again to resume from checkpoint {args.checkpoint})" if checkpoint is not None else ""))
+		pool.close()
+		sys.exit(1)
+	
+	if metrics is not None:
+		# Before closing the pool, so the worker processes are still included in the RSS
+		metrics.write(stats, final=True)
+	if checkpoint is not None:
+		checkpoint.update(resume_sentences + stats["sentences"], output, complete=True)
+	output.close()
+	input_stream.close()
+	if shard is not None:
+		# Written last: a shard without manifest is incomplete and refused by merge_shards.py
+		fu.dict_to_file(dict(shard, sentences=resume_sentences + stats["sentences"]), args.output_file + fu.SHARD_MANIFEST_SUFFIX)
+	if pool is not None:
+		pool.close()
+	else:
+		if args.use_germalemma == "True":
+			save_germalemma_cache(germalemma_options["cache_file"])
+		save_sentence_cache(sentence_cache_options["cache_file"])
+	
 	end = time.time()
 	total_time = end - start
-	final_sents_per_sec = total_processed_sents / total_time if total_time > 0 else 0
+	final_sents_per_sec = stats["sentences"] / total_time if total_time > 0 else 0
 	
 	logger.info(f"=== Processing Complete ===")
-	logger.info(f"Total sentences: {total_processed_sents}")
+	logger.info(f"Total sentences: {stats['sentences']}" + (f" (after {resume_sentences} sentences of earlier runs)" if resume_sentences > 0 else ""))
+	if args.output_format == "korap":
+		logger.info(f"KorAP morpho.xml layers written: {output.texts} texts to {args.output_file}")
+	if profiler is not None:
+		logger.info(f"Profile of {profiler.chunks} chunks written to {profiler.path}")
+	elif profile_options is not None:
+		logger.info(f"Profiles written to {profile_options['path_prefix']}.<pid>.* by the worker processes")
 	logger.info(f"Total time: {total_time:.2f}s")
-	logger.info(f"Average speed: {final_sents_per_sec:.1f} sents/sec")
+	logger.info(f"Average speed: {final_sents_per_sec:.1f} sents/sec, {stats['tokens'] / total_time if total_time > 0 else 0:.0f} tokens/sec")
+	stage_times = {key[len("time_"):]: value for key, value in stats.items() if key.startswith("time_")}
+	logger.info("Time per stage: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in sorted(stage_times.items(), key=lambda item: -item[1]))
+		+ (" (summed over worker processes)" if pool is not None else ""))
+	
+	if stats["dependency_warnings"] > 0:
+		logger.info(f"Dependency parsing warnings: {stats['dependency_warnings']} sentences processed without dependencies")
+	
+	germalemma_lookups = stats["germalemma_hits"] + stats["germalemma_misses"]
+	if germalemma_lookups > 0:
+		logger.info(f"GermaLemma cache: {stats['germalemma_hits']} hits, {stats['germalemma_misses']} misses ({100 * stats['germalemma_hits'] / germalemma_lookups:.1f}% hit rate)")
 	
-	if dependency_warnings > 0:
-		logger.info(f"Dependency parsing warnings: {dependency_warnings} sentences processed without dependencies")
+	sentence_lookups = stats["sentence_cache_hits"] + stats["sentence_cache_misses"]
+	if sentence_lookups > 0:
+		logger.info(f"Sentence cache: {stats['sentence_cache_hits']} hits, {stats['sentence_cache_misses']} misses ({100 * stats['sentence_cache_hits'] / sentence_lookups:.1f}% hit rate)")
 			
\ No newline at end of file
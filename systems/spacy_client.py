@@ -0,0 +1,60 @@
+"""
+	Thin client for the annotation server (parse_spacy_pipe.py --serve): sends CoNLL-U from
+	stdin and writes the annotated CoNLL-U to stdout, like running the pipeline directly.
+	
+		cat input.conllu | python systems/spacy_client.py http://localhost:8080 > output.conllu
+		cat input.conllu | python systems/spacy_client.py unix:/tmp/spacy.sock > output.conllu
+"""
+import argparse, http.client, socket, sys
+from urllib.parse import urlsplit
+
+CHUNK_SIZE = 1024 * 1024  # bytes
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+	def __init__(self, socket_path, timeout=None):
+		super().__init__("localhost", timeout=timeout)
+		self.socket_path = socket_path
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(self.timeout)
+		self.sock.connect(self.socket_path)
+
+
+def get_connection(server, timeout=None):
+	if server.startswith("unix:"):
+		return UnixHTTPConnection(server[len("unix:"):], timeout=timeout), "/annotate"
+	url = urlsplit(server if "://" in server else f"http://{server}")
+	return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout), (url.path.rstrip("/") or "") + "/annotate"
+
+
+def read_chunks(stream):
+	while True:
+		data = stream.read(CHUNK_SIZE)
+		if not data: return
+		yield data
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("server", help="Server address: http://host:port or unix:/path/to/socket")
+	parser.add_argument("-t", "--timeout", help="Socket timeout in seconds", type=float, default=None)
+	args = parser.parse_args()
+	
+	connection, path = get_connection(args.server, timeout=args.timeout)
+	try:
+		connection.request("POST", path, body=read_chunks(sys.stdin.buffer), encode_chunked=True,
+			headers={"Content-Type": "text/plain; charset=utf-8"})
+		response = connection.getresponse()
+		if response.status != 200:
+			sys.stderr.write(f"ERROR: Annotation server returned {response.status} {response.reason}\n")
+			sys.exit(1)
+		for data in read_chunks(response):
+			sys.stdout.buffer.write(data)
+		sys.stdout.buffer.flush()
+	except (OSError, http.client.HTTPException) as e:
+		sys.stderr.write(f"ERROR: Annotation request to {args.server} failed: {str(e)}\n")
+		sys.exit(1)
+	finally:
+		connection.close()
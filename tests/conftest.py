@@ -0,0 +1,5 @@
+import os, sys
+
+# The modules are imported as lib.* and my_utils.*, as by the scripts in systems/
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
@@ -0,0 +1,40 @@
+import os, signal
+import pytest
+import spacy
+from lib.CoNLL_Annotation import get_annotation, CoNLLUP_Token
+from lib.annotation_pool import AnnotationPool, WorkerCrashException
+
+SETTINGS = dict(use_germalemma="False", use_dependencies="False")
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("model") / "blank_de"
+    spacy.blank("de").to_disk(path)
+    return str(path)
+
+
+def batches(n_batches, n_sents=20):
+    for batch in range(n_batches):
+        yield [get_annotation([f"{ix + 1}\tWort{batch}_{ix}" + "\t_" * 8 + "\n" for ix in range(5)], [], token_class=CoNLLUP_Token) for _ in range(n_sents)]
+
+
+def test_results_in_input_order(model_path):
+    pool = AnnotationPool(2, model_path, SETTINGS)
+    try:
+        results = list(pool.annotate(batches(6)))
+        assert 1 <= len(pool.pids()) <= 2
+    finally:
+        pool.close()
+    assert [conll_strs[0].split("\t")[1] for conll_strs, _ in results] == [f"Wort{batch}_0" for batch in range(6)]
+
+
+def test_killed_worker_fails_instead_of_hanging(model_path):
+    pool = AnnotationPool(2, model_path, SETTINGS)
+    try:
+        with pytest.raises(WorkerCrashException):
+            for ix, _ in enumerate(pool.annotate(batches(1000))):
+                if ix == 0:
+                    os.kill(pool.pids()[0], signal.SIGKILL)
+    finally:
+        pool.close()
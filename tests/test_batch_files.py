@@ -0,0 +1,49 @@
+import bz2, gzip, lzma, random
+import pytest
+from lib.batch_files import plan_files
+import my_utils.file_utils as fu
+
+COMPRESSORS = {"gzip": gzip.compress, "bz2": bz2.compress, "xz": lzma.compress}
+if fu.ZSTD_AVAILABLE:
+    COMPRESSORS["zstd"] = lambda data: fu.zstandard.ZstdCompressor().compress(data)
+
+
+def conllu(n_sentences, seed=0):
+    rng = random.Random(seed)
+    words = [f"wort{ix}" for ix in range(500)]
+    return "".join(f"# sent_id = {sentence}\n" + "".join(f"{ix + 1}\t{rng.choice(words)}\t_\t_\t_\t_\t_\t_\t_\t_\n" for ix in range(8)) + "\n"
+                   for sentence in range(n_sentences)).encode("utf-8")
+
+
+@pytest.mark.parametrize("compression", sorted(COMPRESSORS))
+def test_estimate_uncompressed_size(tmp_path, compression):
+    data = conllu(8000)
+    path = tmp_path / f"in.{compression}"
+    path.write_bytes(COMPRESSORS[compression](data))
+    # A small sample, so only part of the file is decompressed; bz2 and zstd hold back up to
+    # a block of output, which makes the estimate rough (but good enough to order files)
+    assert abs(fu.estimate_uncompressed_size(str(path), sample_size=32 * 1024) - len(data)) < 0.3 * len(data)
+
+
+def test_estimate_of_small_and_uncompressed_files(tmp_path):
+    data = conllu(10)
+    (tmp_path / "plain.conllu").write_bytes(data)
+    (tmp_path / "small.conllu.gz").write_bytes(gzip.compress(data))
+    (tmp_path / "broken.conllu.gz").write_bytes(b"\x1f\x8b" + b"\x00" * 100)
+    assert fu.estimate_uncompressed_size(str(tmp_path / "plain.conllu")) == len(data)
+    assert fu.estimate_uncompressed_size(str(tmp_path / "small.conllu.gz")) == len(data)
+    assert fu.estimate_uncompressed_size(str(tmp_path / "broken.conllu.gz")) == 102
+
+
+def test_plan_files_orders_by_uncompressed_size(tmp_path):
+    (tmp_path / "in").mkdir()
+    # The gzip file is the smallest on disk, but holds the most text
+    (tmp_path / "in" / "large.conllu.gz").write_bytes(gzip.compress(conllu(8000)))
+    (tmp_path / "in" / "medium.conllu").write_bytes(conllu(1500))
+    (tmp_path / "in" / "small.conllu").write_bytes(conllu(500))
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "small.conllu").write_bytes(b"done")
+    inputs = [str(tmp_path / "in" / name) for name in ("small.conllu", "medium.conllu", "large.conllu.gz")]
+    jobs, done = plan_files(inputs, str(tmp_path / "out"))
+    assert [job[0] for job in jobs] == inputs[:0:-1]
+    assert done == [(inputs[0], str(tmp_path / "out" / "small.conllu"))]
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+import pytest
+from lib.CoNLL_Annotation import get_annotation, CoNLLUP_Token, take_sentences
+import my_utils.file_utils as fu
+
+
+def sentence(n_tokens):
+    return get_annotation([f"{ix + 1}\tWort\t_\t_\t_\t_\t_\t_\t_\t_\n" for ix in range(n_tokens)], [], token_class=CoNLLUP_Token)
+
+
+def batch_lengths(lengths, batch_size, max_tokens):
+    batches = fu.batch_sentences([sentence(n) for n in lengths], batch_size, budget=SimpleNamespace(max_tokens=max_tokens))
+    return [[len(anno.tokens) for anno in batch] for batch in batches]
+
+
+def test_batches_stay_within_token_limit():
+    assert batch_lengths([4, 4, 4, 4, 4], 10, 10) == [[4, 4], [4, 4], [4]]
+
+
+def test_oversized_sentence_forms_its_own_batch():
+    assert batch_lengths([3, 3, 25, 3, 3], 10, 10) == [[3, 3], [25], [3, 3]]
+
+
+def test_sentence_limit_still_applies():
+    assert batch_lengths([1] * 5, 2, 10) == [[1, 1], [1, 1], [1]]
+
+
+def test_no_token_limit():
+    assert batch_lengths([30, 30, 30], 2, 0) == [[30, 30], [30]]
+
+
+def test_token_limit_needs_held_back():
+    with pytest.raises(ValueError):
+        take_sentences(iter([sentence(3)]), 10, max_tokens=10)
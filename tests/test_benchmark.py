@@ -0,0 +1,30 @@
+import json, os, subprocess, sys
+import spacy
+from lib.CoNLL_Annotation import read_conll_stream
+from my_utils.synthetic_conllu import generate_conllu, write_synthetic_corpus
+
+BENCHMARK_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "systems", "benchmark_spacy_pipe.py")
+
+
+def test_synthetic_corpus_is_reproducible(tmp_path):
+    path = tmp_path / "synthetic.conllu"
+    n_sentences, n_tokens = write_synthetic_corpus(path, 30, seed=7)
+    assert "".join(block for block, _ in generate_conllu(30, seed=7)) == path.read_text(encoding="utf-8")
+    assert path.read_text(encoding="utf-8") != "".join(block for block, _ in generate_conllu(30, seed=8))
+    with open(path, encoding="utf-8") as f:
+        sentences = list(read_conll_stream(f, comment_str="#"))
+    assert len(sentences) == n_sentences == 30
+    assert sum(len(anno.tokens) for anno in sentences) == n_tokens
+    assert any(line.startswith("# text_id = SYN_") for line in sentences[0].metadata)
+
+
+def test_benchmark_smoke(tmp_path):
+    model = tmp_path / "blank_de"
+    spacy.blank("de").to_disk(model)
+    output = tmp_path / "benchmark.json"
+    subprocess.run([sys.executable, BENCHMARK_SCRIPT, "-sm", str(model), "-s", "20", "--dependencies", "False",
+                    "--germalemma", "False", "-o", str(output)], check=True, capture_output=True, cwd=tmp_path)
+    result = json.loads(output.read_text())
+    assert result["corpus"]["sentences"] == 20
+    [run] = result["runs"]
+    assert run["ok"] and run["output_sentences"] == 20 and run["sents_per_sec"] > 0
@@ -0,0 +1,57 @@
+import threading
+from my_utils.cache_utils import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert (cache.hits, cache.misses, len(cache)) == (3, 1, 2)
+
+
+def test_size_zero_keeps_nothing():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a", "missing") == "missing" and len(cache) == 0
+
+
+def test_save_merges_and_load_filters(tmp_path):
+    path = str(tmp_path / "cache.json")
+    first, second = LRUCache(10), LRUCache(10)
+    first.put(("m1", "Haus"), "x")
+    first.put(("m2", "Baum"), "y")
+    first.save(path)
+    second.put(("m1", "Haus"), "newer")
+    second.save(path)
+    loaded = LRUCache(10)
+    loaded.load(path, keep=lambda key: key[0] == "m1")
+    assert len(loaded) == 1 and loaded.get(("m1", "Haus")) == "newer"
+    small = LRUCache(1)
+    small.load(path)
+    assert len(small) == 1
+
+
+def test_concurrent_get_and_put():
+    # As in pipeline mode: one thread looks sentences up while another fills the cache
+    cache, errors = LRUCache(8), []
+
+    def work(step):
+        try:
+            for ix in range(20000):
+                key = str((ix * step) % 32)
+                if cache.get(key) is None:
+                    cache.put(key, ix)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(step,)) for step in (1, 3, 7, 11)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(cache) <= 8 and cache.hits + cache.misses == 4 * 20000
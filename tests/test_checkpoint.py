@@ -0,0 +1,102 @@
+import json
+import pytest
+from lib.CoNLL_Annotation import read_conll_stream, skip_sentences
+from my_utils.checkpoint_utils import Checkpoint, run_identity
+import my_utils.file_utils as fu
+
+BATCH_SIZE = 3
+
+
+class Crash(Exception):
+    pass
+
+
+def make_input(path, n_sentences=20):
+    blocks = []
+    for sentence in range(n_sentences):
+        tokens = [f"{ix + 1}\tWort{sentence}_{ix}\t_\t_\t_\t_\t_\t_\t_\t_" for ix in range(1 + sentence % 4)]
+        blocks.append("\n".join([f"# sent_id = {sentence}"] + tokens) + "\n")
+    path.write_text("\n".join(blocks), encoding="utf-8")
+    return str(path)
+
+
+def annotate(anno):
+    return "\n".join(anno.metadata + [f"{ix + 1}\t{word}\t{word.lower()}" for ix, word in enumerate(anno.get_words())])
+
+
+def run(input_file, output_file, checkpoint_file, crash_after_batches=None):
+    """ The checkpoint handling of parse_spacy_pipe.py around a stand-in annotator. """
+    checkpoint = Checkpoint(checkpoint_file, run_identity(input_file, output_file, spacy_model="test"), interval=0)
+    checkpoint.load()
+    if checkpoint.complete:
+        return
+    input_stream = fu.open_input(input_file)
+    if checkpoint.sentences > 0:
+        output = fu.open_output(output_file, resume_offset=checkpoint.output_offset)
+        assert skip_sentences(input_stream, checkpoint.sentences, comment_str="#") == checkpoint.sentences
+    else:
+        output = fu.open_output(output_file)
+    written = checkpoint.sentences
+    try:
+        for ix, batch in enumerate(fu.batch_sentences(read_conll_stream(input_stream, comment_str="#"), BATCH_SIZE)):
+            if ix == crash_after_batches:
+                # A batch written only in part when the process dies
+                output.write(annotate(batch[0])[:15])
+                output.flush()
+                raise Crash()
+            fu.write_conll_batch(output, [annotate(anno) for anno in batch])
+            written += len(batch)
+            checkpoint.maybe_update(written, output)
+        checkpoint.update(written, output, complete=True)
+    finally:
+        output.close()
+        input_stream.close()
+
+
+@pytest.mark.parametrize("crashes", [[0], [2], [1, 1, 3], [6]])
+def test_resume_matches_uninterrupted_run(tmp_path, crashes):
+    input_file = make_input(tmp_path / "in.conllu")
+    run(input_file, str(tmp_path / "expected.conllu"), str(tmp_path / "expected.json"))
+    output_file, checkpoint_file = str(tmp_path / "out.conllu"), str(tmp_path / "out.json")
+    for crash_after in crashes:
+        with pytest.raises(Crash):
+            run(input_file, output_file, checkpoint_file, crash_after_batches=crash_after)
+    run(input_file, output_file, checkpoint_file)
+    with open(output_file, "rb") as out, open(tmp_path / "expected.conllu", "rb") as expected:
+        assert out.read() == expected.read()
+    with open(checkpoint_file) as f:
+        state = json.load(f)
+    assert state["complete"] and state["sentences"] == 20
+
+
+def test_complete_run_is_not_repeated(tmp_path):
+    input_file = make_input(tmp_path / "in.conllu")
+    output_file, checkpoint_file = str(tmp_path / "out.conllu"), str(tmp_path / "out.json")
+    run(input_file, output_file, checkpoint_file)
+    size = (tmp_path / "out.conllu").stat().st_size
+    run(input_file, output_file, checkpoint_file)
+    assert (tmp_path / "out.conllu").stat().st_size == size
+
+
+def test_checkpoint_of_other_run_is_refused(tmp_path):
+    input_file = make_input(tmp_path / "in.conllu")
+    output_file, checkpoint_file = str(tmp_path / "out.conllu"), str(tmp_path / "out.json")
+    with pytest.raises(Crash):
+        run(input_file, output_file, checkpoint_file, crash_after_batches=2)
+    checkpoint = Checkpoint(checkpoint_file, run_identity(input_file, output_file, spacy_model="other"))
+    with pytest.raises(ValueError, match="spacy_model"):
+        checkpoint.load()
+    # A changed input must not be resumed at the sentence count of its old version
+    make_input(tmp_path / "in.conllu", n_sentences=21)
+    checkpoint = Checkpoint(checkpoint_file, run_identity(input_file, output_file, spacy_model="test"))
+    with pytest.raises(ValueError, match="input_size"):
+        checkpoint.load()
+
+
+def test_resume_needs_the_checkpointed_output(tmp_path):
+    path = tmp_path / "out.conllu"
+    path.write_text("short")
+    with pytest.raises(ValueError, match="shorter"):
+        fu.open_output(str(path), resume_offset=100)
+    with pytest.raises(ValueError, match="uncompressed"):
+        fu.open_output(str(path), compression="gzip", resume_offset=0)
@@ -0,0 +1,29 @@
+import pytest
+from lib.CoNLL_Annotation import CoNLLUP_Token, TEXT_START_RE, TEXT_START_BYTES_RE
+
+
+@pytest.mark.parametrize("line", ["1\tHaus\n", "1\tHaus\r\n", "1\tHaus", "1 Haus\n"])
+def test_two_column_line(line):
+    token = CoNLLUP_Token(line, 0)
+    assert token.word == "Haus"
+    assert token.info == ["1", "Haus"]
+
+
+def test_form_with_space():
+    token = CoNLLUP_Token("2\tNew York\tNew York\tPROPN\tNE\t_\t_\t_\t_\t_\r\n", 1)
+    assert token.word == "New York"
+    assert token.lemma == "New York"
+    assert token.auto_score == "_"
+
+
+@pytest.mark.parametrize("line, starts_text", [
+    ("# text_id = GOE_AGA.00000", True),
+    ("# newdoc id = doc1", True),
+    ("#newdoc", True),
+    ("# text = Die newdoc-Zeile und text_id stehen im Satz", False),
+    ("# sent_id = newdoc_1", False),
+    ("1\ttext_id\t_\t_\t_\t_\t_\t_\t_\t_", False),
+])
+def test_text_start(line, starts_text):
+    assert bool(TEXT_START_RE.match(line)) == starts_text
+    assert bool(TEXT_START_BYTES_RE.match(line.encode("utf-8"))) == starts_text
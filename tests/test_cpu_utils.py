@@ -0,0 +1,40 @@
+import os
+import pytest
+import my_utils.cpu_utils as cu
+
+
+@pytest.fixture
+def host(monkeypatch):
+    """ Two NUMA nodes of 4 CPUs each, of which this process may use CPUs 0-6. """
+    monkeypatch.setattr(cu, "numa_nodes", lambda: {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]})
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0, 1, 2, 3, 4, 5, 6})
+
+
+def test_cpu_lists():
+    assert cu.parse_cpu_list("0-3,8, 10-11,") == [0, 1, 2, 3, 8, 10, 11]
+    assert cu.format_cpu_list([8, 0, 1, 2, 3, 10, 11]) == "0-3,8,10-11"
+
+
+def test_parse_affinity_numa(host):
+    assert cu.parse_affinity("numa") == ("numa", [[0, 1, 2, 3], [4, 5, 6]])
+    assert cu.parse_affinity("numa:1") == ("numa", [[4, 5, 6]])
+    with pytest.raises(ValueError, match="Unknown NUMA nodes"):
+        cu.parse_affinity("numa:2")
+
+
+def test_parse_affinity_cpus(host):
+    assert cu.parse_affinity("0-2,5") == ("cpus", [0, 1, 2, 5])
+    with pytest.raises(ValueError, match="not available"):
+        cu.parse_affinity("6-7")
+    with pytest.raises(ValueError, match="Empty"):
+        cu.parse_affinity(",")
+
+
+def test_worker_cpus():
+    cpus = ("cpus", list(range(10)))
+    assert [cu.worker_cpus(cpus, ix, 3) for ix in range(3)] == [[0, 1, 2], [3, 4, 5], [6, 7, 8, 9]]
+    assert cu.worker_cpus(cpus, 0, 1) == list(range(10))
+    # More workers than CPUs share them
+    assert [cu.worker_cpus(("cpus", [0, 1]), ix, 3) for ix in range(3)] == [[0], [1], [0]]
+    numa = ("numa", [[0, 1], [2, 3]])
+    assert [cu.worker_cpus(numa, ix, 3) for ix in range(3)] == [[0, 1], [2, 3], [0, 1]]
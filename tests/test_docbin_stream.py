@@ -0,0 +1,67 @@
+import io
+import pytest
+from spacy.tokens import Doc
+from spacy.vocab import Vocab
+from lib.CoNLL_Annotation import get_annotation, CoNLLUP_Token
+from lib.docbin_stream import encode_docbin, write_docbin_batch, read_docbin_stream, docbin_to_conll, FRAME_MAGIC
+
+
+def sentence(words, metadata):
+    lines = [f"{ix + 1}\t{word}\t_\t_\t_\t_\t_\t_\t_\t_\n" for ix, word in enumerate(words)]
+    return get_annotation(lines, metadata, CoNLLUP_Token)
+
+
+def make_batch(vocab, texts, flag="False"):
+    annos = [sentence(words, [f"# sent_id = {ix}"]) for ix, words in enumerate(texts)]
+    docs = [Doc(vocab, words=words) for words in texts]
+    return annos, encode_docbin(annos, docs, [flag] * len(docs))[0]
+
+
+def write_stream(batches):
+    out = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+    for batch in batches:
+        write_docbin_batch(out, batch)
+    return out.buffer.getvalue()
+
+
+def test_frames_round_trip_in_order():
+    vocab = Vocab()
+    _, first = make_batch(vocab, [["Das", "Haus", "."], ["Ja"]])
+    _, second = make_batch(vocab, [["Der", "Baum"]], flag="True")
+    assert len(first) == 2 and len(second) == 1
+    docs = list(read_docbin_stream(io.BytesIO(write_stream([first, second]))))
+    assert [[token.text for token in doc] for doc in docs] == [["Das", "Haus", "."], ["Ja"], ["Der", "Baum"]]
+    assert [list(doc.user_data["conllu_metadata"]) for doc in docs] == [["# sent_id = 0"], ["# sent_id = 1"], ["# sent_id = 0"]]
+    assert [doc.user_data["conllu_dependencies"] for doc in docs] == ["False", "False", "True"]
+
+
+def test_concatenated_streams_are_a_stream():
+    vocab = Vocab()
+    data = b"".join(write_stream([make_batch(vocab, [[f"Satz{ix}"]])[1]]) for ix in range(3))
+    assert [doc[0].text for doc in read_docbin_stream(io.BytesIO(data))] == ["Satz0", "Satz1", "Satz2"]
+
+
+def test_empty_stream():
+    assert list(read_docbin_stream(io.BytesIO(b""))) == []
+
+
+@pytest.mark.parametrize("cut", [2, len(FRAME_MAGIC) + 4, -1])
+def test_truncated_stream(cut):
+    data = write_stream([make_batch(Vocab(), [["Das", "Haus"]])[1]])
+    with pytest.raises(ValueError):
+        list(read_docbin_stream(io.BytesIO(data[:cut])))
+
+
+def test_not_a_docbin_stream():
+    with pytest.raises(ValueError, match="Not a DocBin stream"):
+        list(read_docbin_stream(io.BytesIO(b"# sent_id = 1\n1\tDas\t_\n")))
+
+
+def test_docbin_to_conll():
+    data = write_stream([make_batch(Vocab(), [["Das", "Haus"]])[1]])
+    doc, = read_docbin_stream(io.BytesIO(data))
+    lines = docbin_to_conll(doc, "False", "True").split("\n")
+    assert lines[0] == "# sent_id = 0"
+    assert [line.split("\t")[:2] for line in lines[1:]] == [["1", "Das"], ["2", "Haus"]]
+    # The dependencies were not parsed, so HEAD and DEPREL stay empty
+    assert all(line.split("\t")[6:8] == ["_", "_"] for line in lines[1:])
@@ -0,0 +1,85 @@
+import os, zipfile
+import xml.etree.ElementTree as ET
+import pytest
+from lib.CoNLL_Annotation import get_annotation, CoNLLUP_Token
+from lib.korap_xml import KorapSentence, KorapWriter, layer_path, token_offsets, morpho_spans
+
+NS = "{http://ids-mannheim.de/ns/KorAP}"
+
+
+def sentence(words, metadata):
+    lines = [f"{ix + 1}\t{word}\t_\t_\t_\t_\t_\t_\t_\t_\n" for ix, word in enumerate(words)]
+    return get_annotation(lines, metadata, CoNLLUP_Token)
+
+
+def korap_sentences():
+    first = sentence(["Das", "Haus"], ["# text_id = GOE_AGA.00000", "# start_offsets = 0 0 4", "# end_offsets = 8 3 8"])
+    second = sentence(["Ja", "&"], ["# start_offsets = 9 9 12"])
+    third = sentence(["Nein"], ["# text_id = GOE_AGA.00001", "# filename = GOE/AGA/00001/spacy/morpho.xml",
+                                "# start_offsets = 0 0", "# end_offsets = 4 4"])
+    result = []
+    for anno, lemmas in ((first, ["der", "Haus"]), (second, ["ja", "_"]), (third, ["nein"])):
+        words = anno.get_words()
+        columns = (words, lemmas, ["X"] * len(words), ["ADV"] * len(words), ["_"] * len(words))
+        text_id = next((line.split("= ")[1] for line in anno.metadata if "text_id" in line), None)
+        filename = next((line.split("= ")[1] for line in anno.metadata if "filename" in line), None)
+        result.append(KorapSentence(text_id, filename, morpho_spans(anno, columns)))
+    return result
+
+
+def test_token_offsets():
+    anno = sentence(["Das", "Haus"], ["# start_offsets = 0 0 4", "# end_offsets = 8 3 8"])
+    assert token_offsets(anno, anno.get_words()) == ([0, 4], [3, 8])
+    # Without end_offsets, tokens end after their FORM
+    anno = sentence(["Ja", "&"], ["# start_offsets = 9 9 12"])
+    assert token_offsets(anno, anno.get_words()) == ([9, 12], [11, 13])
+    with pytest.raises(ValueError, match="start_offsets"):
+        token_offsets(sentence(["Ja"], []), ["Ja"])
+
+
+def test_layer_path():
+    assert layer_path("GOE_AGA.00000") == "GOE/AGA/00000/spacy/morpho.xml"
+    assert layer_path("GOE_AGA.00000", "X/Y/Z/spacy/morpho.xml") == "X/Y/Z/spacy/morpho.xml"
+
+
+def check_layers(read):
+    first = ET.fromstring(read("GOE/AGA/00000/spacy/morpho.xml"))
+    assert first.get("docid") == "GOE_AGA.00000"
+    spans = first.iter(f"{NS}span")
+    assert [(span.get("id"), span.get("from"), span.get("to")) for span in spans] == \
+        [("s_0", "0", "3"), ("s_1", "4", "8"), ("s_2", "9", "11"), ("s_3", "12", "13")]
+    features = {f.get("name"): f.text for f in first.iter("{http://www.tei-c.org/ns/1.0}f") if f.get("name") != "lex"}
+    assert features["pos"] == "ADV"
+    second = ET.fromstring(read("GOE/AGA/00001/spacy/morpho.xml"))
+    # Span ids are numbered per text
+    assert [span.get("id") for span in second.iter(f"{NS}span")] == ["s_0"]
+
+
+def test_writes_zip(tmp_path):
+    path = str(tmp_path / "out.zip")
+    writer = KorapWriter(path)
+    sentences = korap_sentences()
+    writer.write_batch(sentences[:1])
+    writer.write_batch(sentences[1:])
+    writer.close()
+    assert writer.texts == 2
+    with zipfile.ZipFile(path) as archive:
+        assert sorted(archive.namelist()) == ["GOE/AGA/00000/spacy/morpho.xml", "GOE/AGA/00001/spacy/morpho.xml"]
+        check_layers(archive.read)
+
+
+def test_writes_directory(tmp_path):
+    writer = KorapWriter(str(tmp_path))
+    writer.write_batch(korap_sentences())
+    writer.close()
+
+    def read(name):
+        with open(os.path.join(tmp_path, name), "rb") as f:
+            return f.read()
+    check_layers(read)
+
+
+def test_needs_text_id(tmp_path):
+    writer = KorapWriter(str(tmp_path))
+    with pytest.raises(ValueError, match="text_id"):
+        writer.write_batch(korap_sentences()[1:2])
@@ -0,0 +1,102 @@
+import time
+from collections import Counter
+import pytest
+import spacy
+from spacy.language import Language
+import lib.spacy_annotation as sa
+
+HANG, FAIL = "HÄNGT", "KAPUTT"
+
+
+@Language.component("fake_parser")
+def fake_parser(doc):
+    """ Stands in for the parser: hangs on HANG and raises on FAIL, marks all other Docs as parsed. """
+    words = [token.text for token in doc]
+    if HANG in words:
+        time.sleep(60)
+    if FAIL in words:
+        raise RuntimeError("parser failed")
+    doc.user_data["parsed"] = True
+    return doc
+
+
+@pytest.fixture(scope="module")
+def nlp():
+    nlp = spacy.blank("de")
+    nlp.add_pipe("fake_parser", name="parser")
+    return nlp
+
+
+def sentences(n, bad=()):
+    return [[bad[ix]] if ix in bad else [f"Satz{ix}", "."] for ix in range(n)]
+
+
+def check_results(sents, results, bad):
+    assert [[token.text for token in doc] for doc, _, _ in results] == sents
+    for ix, (doc, success, warning) in enumerate(results):
+        if ix in bad:
+            assert not success and warning and "parsed" not in doc.user_data
+        else:
+            assert success and warning is None and doc.user_data["parsed"]
+
+
+def test_hanging_sentence_loses_only_its_dependencies(nlp):
+    sents = sentences(16, bad={5: HANG})
+    stats = Counter()
+    start = time.perf_counter()
+    results = sa.safe_dependency_parse_batch(nlp, sents, timeout=0.2, batch_size=16, stats=stats, max_budget=0.5)
+    elapsed = time.perf_counter() - start
+    check_results(sents, results, {5})
+    assert "timeout" in results[5][2]
+    assert stats["parse_batch_timeouts"] == 1
+    # One capped batch budget and one sentence timeout, not a timeout per bisection level
+    assert elapsed < 0.5 + 0.2 + 1.5
+
+
+def test_failing_sentences_are_bisected(nlp):
+    sents = sentences(10, bad={0: FAIL, 7: FAIL})
+    stats = Counter()
+    results = sa.safe_dependency_parse_batch(nlp, sents, timeout=1, batch_size=10, stats=stats)
+    check_results(sents, results, {0, 7})
+    assert "error" in results[7][2]
+    assert stats["parse_bisections"] > 0
+
+
+def test_order_kept_with_token_budget(nlp):
+    sents = [["Wort"] * (1 + (ix * 7) % 5) for ix in range(20)]
+    sents[11] = [FAIL]
+    results = sa.safe_dependency_parse_batch(nlp, sents, timeout=1, batch_size=4, token_budget=6)
+    check_results(sents, results, {11})
+
+
+def test_long_sentences_skip_the_parser(nlp):
+    sents = sentences(3) + [["Wort"] * 20]
+    results = sa.safe_dependency_parse_batch(nlp, sents, timeout=1, max_length=10)
+    check_results(sents, results, {3})
+    assert "too long" in results[3][2]
+
+
+def test_batch_budget():
+    assert sa.batch_budget(0.5, 10, max_budget=60) == 5
+    assert sa.batch_budget(30, 256, max_budget=60) == 60
+    # A batch always gets at least the timeout of one sentence
+    assert sa.batch_budget(30, 256, max_budget=10) == 30
+
+
+@pytest.mark.parametrize("token_budget", [0, 10])
+def test_plan_batches_covers_each_sentence_once(token_budget):
+    lengths = [(ix * 13) % 9 + 1 for ix in range(50)]
+    indices = [ix for ix in range(50) if ix % 7]
+    batches = sa.plan_batches(lengths, indices, 8, token_budget)
+    assert sorted(ix for batch in batches for ix in batch) == indices
+    assert all(0 < len(batch) <= 8 for batch in batches)
+    if token_budget:
+        # Only a single sentence longer than the budget may exceed it
+        assert all(sum(lengths[ix] for ix in batch) <= token_budget or len(batch) == 1 for batch in batches)
+    else:
+        assert [ix for batch in batches for ix in batch] == indices
+
+
+def test_plan_batches_groups_similar_lengths():
+    lengths = [1, 9, 1, 9, 1, 9]
+    assert sa.plan_batches(lengths, list(range(6)), 3, token_budget=100) == [[0, 2, 4], [1, 3, 5]]
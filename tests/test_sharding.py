@@ -0,0 +1,132 @@
+import importlib.util, json, os
+import pytest
+from lib.CoNLL_Annotation import read_conll_stream, find_shard_boundary, shard_range, TEXT_START_BYTES_RE
+import my_utils.file_utils as fu
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location("merge_shards", os.path.join(REPO_DIR, "systems", "merge_shards.py"))
+merge_shards = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(merge_shards)
+
+
+def make_corpus(path, n_texts=4, closing_blank=True):
+    """ Texts with a text_id comment block and sentences with comment blocks of their own. """
+    blocks = []
+    for text in range(n_texts):
+        for sentence in range(3):
+            metadata = ([f"# text_id = T{text}", f"# start_offsets = 0 {sentence}"] if sentence == 0 else []) + [f"# sent_no = {sentence}"]
+            tokens = [f"{ix + 1}\tWort{text}_{sentence}_{ix}\t_\t_\t_\t_\t_\t_\t_\t_" for ix in range(2 + (text + sentence) % 3)]
+            blocks.append("\n".join(metadata + tokens) + "\n")
+    data = "\n".join(blocks) + ("\n" if closing_blank else "")
+    path.write_bytes(data.encode("utf-8"))
+    return path
+
+
+def read_sentences(path, byte_range=None):
+    stream = fu.open_input(str(path), byte_range=byte_range)
+    try:
+        return [(tuple(anno.metadata), tuple(anno.get_words())) for anno in read_conll_stream(stream, comment_str="#")]
+    finally:
+        stream.close()
+
+
+def is_block_start(data, position):
+    """ Whether position starts a sentence block, i.e. follows a blank line. """
+    return position == 0 or data[:position].endswith(b"\n\n")
+
+
+@pytest.mark.parametrize("closing_blank", [True, False])
+@pytest.mark.parametrize("unit", ["text", "sentence"])
+def test_boundary_from_every_offset(tmp_path, closing_blank, unit):
+    path = make_corpus(tmp_path / "corpus.conllu", closing_blank=closing_blank)
+    data = path.read_bytes()
+    with open(path, "rb") as f:
+        for offset in range(1, len(data) + 1):
+            boundary = find_shard_boundary(f, offset, "#", unit)
+            assert offset <= boundary <= len(data)
+            assert boundary == len(data) or is_block_start(data, boundary)
+            # No earlier boundary was skipped: the blank line before a block start must be read
+            # after the line the offset falls into, and with unit text the block must open a text
+            line_end = data.find(b"\n", offset)
+            line_end = len(data) if line_end < 0 else line_end
+            for position in range(line_end + 2, boundary):
+                if is_block_start(data, position) and data[position:position + 1] != b"\n":
+                    assert unit == "text" and not TEXT_START_BYTES_RE.match(data[position:data.find(b"\n", position)])
+
+
+def test_boundary_inside_sentence_and_comment_block(tmp_path):
+    path = make_corpus(tmp_path / "corpus.conllu")
+    data = path.read_bytes()
+    text_starts = [data.index(f"# text_id = T{text}".encode()) for text in range(4)]
+    with open(path, "rb") as f:
+        # Inside the text_id comment of text 1: the next text starts the shard
+        assert find_shard_boundary(f, text_starts[1] + 3, "#", "text") == text_starts[2]
+        # Inside the following comment line of the same block
+        assert find_shard_boundary(f, data.index(b"# start_offsets", text_starts[1]) + 2, "#", "text") == text_starts[2]
+        # Inside a token line of text 2: the next sentence, or the next text
+        token = data.index(b"Wort2_1_0")
+        assert find_shard_boundary(f, token, "#", "text") == text_starts[3]
+        assert find_shard_boundary(f, token, "#", "sentence") == data.index(b"# sent_no = 2", token)
+
+
+def test_boundary_in_last_sentence_without_closing_blank_line(tmp_path):
+    path = make_corpus(tmp_path / "corpus.conllu", closing_blank=False)
+    data = path.read_bytes()
+    last = data.rindex(b"# sent_no")
+    with open(path, "rb") as f:
+        assert find_shard_boundary(f, last + 1, "#", "sentence") == len(data)
+        # No text starts after the offset: the first sentence boundary is used
+        assert find_shard_boundary(f, data.index(b"# sent_no = 1", data.index(b"T3")), "#", "text") == last
+
+
+@pytest.mark.parametrize("closing_blank", [True, False])
+@pytest.mark.parametrize("unit", ["text", "sentence"])
+def test_shards_read_each_sentence_once(tmp_path, closing_blank, unit):
+    path = make_corpus(tmp_path / "corpus.conllu", closing_blank=closing_blank)
+    expected = read_sentences(path)
+    for n_shards in range(1, 15):
+        ranges = [shard_range(str(path), shard, n_shards, "#", unit) for shard in range(n_shards)]
+        assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(path)
+        assert all(ranges[ix][1] == ranges[ix + 1][0] for ix in range(n_shards - 1))
+        sentences = [sentence for start, end in ranges for sentence in read_sentences(path, (start, end))]
+        assert sentences == expected
+
+
+def write_shards(tmp_path, ranges, input_size):
+    paths = []
+    for shard, (start, end) in enumerate(ranges, 1):
+        path = str(tmp_path / f"out.part{shard}.conllu")
+        with open(path, "w") as f:
+            f.write(f"part {shard}\n")
+        manifest = {"shard": shard, "shards": len(ranges), "unit": "text", "input_file": "corpus.conllu", "input_size": input_size,
+                    "start": start, "end": end, "sentences": 1, "text_doc_tokens": 0}
+        with open(path + fu.SHARD_MANIFEST_SUFFIX, "w") as f:
+            json.dump(manifest, f)
+        paths.append(path)
+    return paths
+
+
+def test_check_shards(tmp_path):
+    paths = write_shards(tmp_path, [(0, 10), (10, 25), (25, 40)], 40)
+    assert [path for _, path in merge_shards.check_shards(reversed(paths))] == paths
+    with pytest.raises(ValueError, match="missing"):
+        merge_shards.check_shards(paths[:2])
+    with pytest.raises(ValueError, match="once each"):
+        merge_shards.check_shards(paths + paths[1:2])
+
+
+def test_check_shards_refuses_gaps_and_other_runs(tmp_path):
+    with pytest.raises(ValueError, match="expected 10"):
+        merge_shards.check_shards(write_shards(tmp_path, [(0, 10), (12, 40)], 40))
+    with pytest.raises(ValueError, match="input has 50 bytes"):
+        merge_shards.check_shards(write_shards(tmp_path, [(0, 10), (10, 40)], 50))
+    paths = write_shards(tmp_path, [(0, 10), (10, 40)], 40)
+    with open(paths[1] + fu.SHARD_MANIFEST_SUFFIX) as f:
+        manifest = json.load(f)
+    with open(paths[1] + fu.SHARD_MANIFEST_SUFFIX, "w") as f:
+        json.dump(dict(manifest, text_doc_tokens=500), f)
+    with pytest.raises(ValueError, match="text_doc_tokens"):
+        merge_shards.check_shards(paths)
+    os.unlink(paths[0] + fu.SHARD_MANIFEST_SUFFIX)
+    with pytest.raises(ValueError, match="incomplete"):
+        merge_shards.check_shards(paths)